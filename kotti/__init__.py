@@ -57,6 +57,7 @@ def none_factory(**kwargs):  # pragma: no cover
 
 # All of these can be set by passing them in the Paste Deploy settings:
 conf_defaults = {
+    "kotti.acl_index": "false",
     "kotti.alembic_dirs": "kotti:alembic",
     "kotti.asset_overrides": "",
     "kotti.authn_policy_factory": "kotti.authtkt_factory",
@@ -68,6 +69,8 @@ conf_defaults = {
         [
             "kotti",
             "kotti.traversal",
+            "kotti.security",
+            "kotti.acl_index",
             "kotti.filedepot",
             "kotti.events",
             "kotti.sanitizers",
@@ -92,6 +95,7 @@ conf_defaults = {
     "kotti.date_format": "medium",
     "kotti.datetime_format": "medium",
     "kotti.depot_mountpoint": "/depot",
+    "kotti.contents_max_page_size": "100",
     "kotti.depot_replace_wsgi_file_wrapper": False,
     "kotti.depot.0.backend": "kotti.filedepot.DBFileStorage",
     "kotti.depot.0.name": "dbfiles",
@@ -100,7 +104,10 @@ conf_defaults = {
     "kotti.login_success_callback": "kotti.views.login.login_success_callback",
     "kotti.max_file_size": "10",
     "kotti.modification_date_excludes": " ".join(["kotti.resources.Node.position"]),
+    "kotti.polymorphic_loading": "joined",
     "kotti.populators": "kotti.populate.populate",
+    "kotti.principal_cache_size": "0",
+    "kotti.principal_cache_timeout": "60",
     "kotti.principals_factory": "kotti.security.principals_factory",
     "kotti.register": "False",
     "kotti.register.group": "",
@@ -128,6 +135,9 @@ conf_defaults = {
     "kotti.static.view_needed": "",  # BBB
     "kotti.templates.api": "kotti.views.util.TemplateAPI",
     "kotti.time_format": "medium",
+    "kotti.traversal_cache_size": "1000",
+    "kotti.tree_engine": "path",
+    "kotti.traversal_cache_timeout": "60",
     "kotti.url_normalizer": "kotti.url_normalizer.url_normalizer",
     "kotti.url_normalizer.map_non_ascii_characters": True,
     "kotti.use_tables": "",
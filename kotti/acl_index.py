@@ -0,0 +1,435 @@
+""" This module maintains a materialized index of the effective ``view``
+permissions of all nodes (:class:`kotti.resources.ViewACE`), which allows to
+filter queries for content by the ``view`` permission in SQL, instead of
+loading all candidates and calling ``request.has_permission`` for each of
+them.
+
+The index is only maintained and used if the ``kotti.acl_index`` setting is
+enabled.  Run ``kotti-rebuild-acl-index`` after enabling it for an existing
+site.
+
+For every node, the ``view`` related entries of the ACLs in its lineage are
+stored in the order in which :class:`pyramid.authorization.ACLAuthorizationPolicy`
+evaluates them.  Principals that get a principal of such an entry through
+local groups in the node's lineage, or through the groups of a group in the
+principals database, get an entry with the same rank.  A user may view a node
+if the entry with the lowest rank for one of the user's global principals
+(see :func:`request_principals`) allows it.
+
+The index is updated whenever ACLs, local groups or the groups of groups
+change and when nodes are added or moved.  It therefore assumes that Kotti's
+default authentication and authorization policies are used.
+"""
+
+from collections import defaultdict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from pyramid.security import ALL_PERMISSIONS
+from pyramid.security import Allow
+from pyramid.security import Authenticated
+from pyramid.security import Everyone
+from pyramid.settings import asbool
+from sqlalchemy import and_
+from sqlalchemy import event
+from sqlalchemy import exists
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy.sql.expression import ClauseElement
+from zope.sqlalchemy import mark_changed
+
+from kotti import DBSession
+from kotti.resources import BULK_BATCH_SIZE
+from kotti.resources import LocalGroup
+from kotti.resources import Node
+from kotti.resources import ViewACE
+from kotti.resources import hash_path
+from kotti.security import Principal
+from kotti.security import is_user
+from kotti.security import list_groups
+from kotti.util import command
+
+#: Whether the index is maintained and used, set by :func:`includeme` from the
+#: ``kotti.acl_index`` setting
+enabled = False
+
+_STALE_KEY = "kotti.acl_index.stale"
+_ALL = "all"
+
+
+def _view_entries(acl):
+    """ Return the ``(principal, allowed)`` pairs of the ``view`` related
+    entries of an ACL. """
+
+    entries = []
+    for action, principal, permissions in acl or ():
+        if permissions is not ALL_PERMISSIONS and isinstance(permissions, str):
+            permissions = [permissions]
+        if "view" in permissions:
+            entries.append((principal, action == Allow))
+    return entries
+
+
+def _chain(own, inherited):
+    """ Prepend the view entries of a node's ACL to the ones inherited from its
+    parent.  Only the first entry of each principal matters and nothing after
+    an entry for ``system.Everyone``, which every user has. """
+
+    chain = []
+    seen = set()
+    for principal, allowed in own + list(inherited):
+        if principal in seen:
+            continue
+        seen.add(principal)
+        chain.append((principal, allowed))
+        if principal == Everyone:
+            break
+    return tuple(chain)
+
+
+def _entries(chain, edges, group_edges):
+    """ Return a dict that maps principals to the ``(rank, allowed)`` of the
+    entry of ``chain`` that decides for them.
+
+    :param chain: The view entries of a node, see :func:`_chain`
+    :param edges: ``(principal_name, group_name)`` pairs of all local groups
+                  in the node's lineage
+    :param group_edges: ``(principal_name, group_name)`` pairs of the groups
+                        of groups in the principals database
+    """
+
+    members = defaultdict(set)
+    for principal_name, group_name in edges:
+        members[group_name].add(principal_name)
+    for principal_name, group_name in group_edges:
+        members[group_name].add(principal_name)
+
+    result = {}
+    for rank, (principal, allowed) in enumerate(chain):
+        stack = [principal]
+        while stack:
+            principal = stack.pop()
+            if principal in result:
+                continue
+            result[principal] = (rank, allowed)
+            stack.extend(members.get(principal, ()))
+    return result
+
+
+def _group_edges():
+    # Only the names and groups of groups (``group:...``) are queried, not the
+    # principal objects of all users
+    query = DBSession.query(Principal.name, Principal.groups).filter(
+        Principal.name.like("%:%")
+    )
+    edges = set()
+    for name, groups in query:
+        for group_name in groups or ():
+            edges.add((name, group_name))
+    return frozenset(edges)
+
+
+def refresh(node_ids: Optional[Iterable[int]] = None) -> None:
+    """Recompute the index entries of the nodes with the given ids and of all
+    of their descendants.
+
+    :param node_ids: Ids of the nodes to update, ``None`` for all nodes
+    :type node_ids: iterable of int
+    """
+
+    session = DBSession()
+    nodes = Node.__table__
+    columns = [nodes.c.id, nodes.c.path]
+    if node_ids is None:
+        query = select(columns).where(nodes.c.parent_id == None)  # noqa
+        rows = session.execute(query).fetchall()
+    else:
+        node_ids = list(node_ids)
+        rows = []
+        for offset in range(0, len(node_ids), BULK_BATCH_SIZE):
+            batch_ids = node_ids[offset : offset + BULK_BATCH_SIZE]
+            query = select(columns).where(nodes.c.id.in_(batch_ids))
+            rows.extend(session.execute(query))
+
+    # Updating a subtree includes the subtrees of all of its descendants.
+    roots = []
+    for row in sorted((r for r in rows if r.path is not None), key=lambda r: r.path):
+        if not roots or not row.path.startswith(roots[-1].path):
+            roots.append(row)
+    if not roots:
+        return
+
+    group_edges = _group_edges()
+    for root in roots:
+        _refresh_subtree(session, root, group_edges)
+    mark_changed(session)
+
+
+def _refresh_subtree(session, root, group_edges):
+    # ``root`` is a row with the id and path of the subtree's root node
+    from kotti.traversal import tree_engine
+
+    nodes = Node.__table__
+    local_groups = LocalGroup.__table__
+    view_aces = ViewACE.__table__
+
+    path = root.path
+    segments = path.split("/")[1:-2]
+    ancestor_paths = ["/"] + [
+        "/" + "/".join(segments[: idx + 1]) + "/" for idx in range(len(segments))
+    ]
+    if path == "/":
+        ancestor_paths = []
+    ancestors = session.execute(
+        select([nodes.c.id, nodes.c.path, nodes.c._acl])
+        .where(nodes.c.path_hash.in_([hash_path(p) for p in ancestor_paths]))
+        .where(nodes.c.path.in_(ancestor_paths))
+        .order_by(nodes.c.path)
+    ).fetchall()
+    condition = tree_engine().in_subtree(nodes.c.id, root)
+    subtree = session.execute(
+        select([nodes.c.id, nodes.c.parent_id, nodes.c._acl])
+        .where(condition)
+        .order_by(nodes.c.path)
+    ).fetchall()
+
+    groups = defaultdict(set)
+    ancestor_ids = [row.id for row in ancestors]
+    for condition_ids in (
+        local_groups.c.node_id.in_(ancestor_ids),
+        local_groups.c.node_id.in_(select([nodes.c.id]).where(condition)),
+    ):
+        for node_id, principal_name, group_name in session.execute(
+            select(
+                [
+                    local_groups.c.node_id,
+                    local_groups.c.principal_name,
+                    local_groups.c.group_name,
+                ]
+            ).where(condition_ids)
+        ):
+            groups[node_id].add((principal_name, group_name))
+
+    # Inherit the ACLs and local groups of the ancestors, from the root down.
+    chain, edges = (), frozenset()
+    for row in ancestors:
+        chain = _chain(_view_entries(row._acl), chain)
+        edges = edges | groups.get(row.id, frozenset())
+
+    state = {}
+    computed = {}
+    rows = []
+    for row in subtree:
+        parent_chain, parent_edges = state.get(row.parent_id, (chain, edges))
+        node_chain = _chain(_view_entries(row._acl), parent_chain)
+        node_edges = parent_edges
+        if row.id in groups:
+            node_edges = parent_edges | groups[row.id]
+        state[row.id] = (node_chain, node_edges)
+
+        key = (node_chain, node_edges)
+        if key not in computed:
+            computed[key] = _entries(node_chain, node_edges, group_edges)
+        for principal_name, (rank, allowed) in computed[key].items():
+            rows.append(
+                {
+                    "node_id": row.id,
+                    "principal_name": principal_name,
+                    "rank": rank,
+                    "allowed": allowed,
+                }
+            )
+
+    session.execute(
+        view_aces.delete().where(
+            view_aces.c.node_id.in_(select([nodes.c.id]).where(condition))
+        )
+    )
+    for offset in range(0, len(rows), BULK_BATCH_SIZE):
+        session.execute(view_aces.insert(), rows[offset : offset + BULK_BATCH_SIZE])
+
+
+def update(node_ids: Iterable[int]) -> None:
+    """Update the index entries of the nodes with the given ids and of their
+    descendants if the index is enabled.  Call this after changing ACLs or
+    local groups with bulk statements, which the index doesn't notice.
+
+    :param node_ids: Ids of the nodes to update
+    :type node_ids: iterable of int
+    """
+
+    if enabled:
+        refresh(node_ids)
+
+
+def request_principals(request) -> List[str]:
+    """Return the principals of the current user that don't depend on the
+    context, i.e. ``system.Everyone``, ``system.Authenticated``, the user
+    itself and the groups from the principals database.
+
+    :param request: current request
+    :type request: :class:`kotti.request.Request`
+
+    :result: principal names
+    :rtype: list
+    """
+
+    principals = [Everyone]
+    userid = request.authenticated_userid
+    if userid is not None and is_user(userid):
+        principals.extend([Authenticated, userid])
+        principals.extend(list_groups(userid))
+    return principals
+
+
+def view_filter(request, permission: str = "view") -> Optional[ClauseElement]:
+    """Return a condition for queries that selects only those nodes for which
+    the current user has the ``view`` permission.
+
+    :param request: current request
+    :type request: :class:`kotti.request.Request`
+
+    :param permission: The permission to check
+    :type permission: str
+
+    :result: SQL condition on :attr:`kotti.resources.Node.id` or ``None`` if
+             the index is disabled or the permission is not ``view``.
+    :rtype: :class:`sqlalchemy.sql.expression.ClauseElement`
+    """
+
+    if not enabled or permission != "view":
+        return None
+
+    principals = request_principals(request)
+    view_aces = ViewACE.__table__
+    allow, deny = view_aces.alias("allow"), view_aces.alias("deny")
+    denied_before = exists().where(
+        and_(
+            deny.c.node_id == allow.c.node_id,
+            deny.c.principal_name.in_(principals),
+            deny.c.allowed == False,  # noqa
+            deny.c.rank < allow.c.rank,
+        )
+    )
+    return exists().where(
+        and_(
+            allow.c.node_id == Node.id,
+            allow.c.principal_name.in_(principals),
+            allow.c.allowed == True,  # noqa
+            ~denied_before,
+        )
+    )
+
+
+def _changed_nodes(session):
+    """ Return the ids of the nodes whose index entries are affected by the
+    pending changes of ``session`` or :data:`_ALL`. """
+
+    node_ids = set()
+    for obj in session.new:
+        if isinstance(obj, Node):
+            node_ids.add(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Node):
+            attrs = inspect(obj).attrs
+            if attrs._acl.history.has_changes() or attrs.parent.history.has_changes():
+                node_ids.add(obj)
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, LocalGroup):
+            node = obj.node if obj.node is not None else obj.node_id
+            if node is not None:
+                node_ids.add(node)
+        elif isinstance(obj, Principal) and not is_user(obj):
+            if obj in session.dirty:
+                if not inspect(obj).attrs.groups.history.has_changes():
+                    continue
+            return _ALL
+    return node_ids
+
+
+# noinspection PyUnusedLocal
+def _before_flush(session, flush_context, instances):
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Node)]
+    if deleted:
+        # Not every database cascades the deletion of the nodes.
+        view_aces = ViewACE.__table__
+        session.execute(view_aces.delete().where(view_aces.c.node_id.in_(deleted)))
+
+    changed = _changed_nodes(session)
+    if not changed:
+        return
+    stale = session.info.get(_STALE_KEY)
+    if stale == _ALL:
+        return
+    if changed == _ALL:
+        session.info[_STALE_KEY] = _ALL
+    else:
+        session.info.setdefault(_STALE_KEY, set()).update(changed)
+
+
+# noinspection PyUnusedLocal
+def _after_flush_postexec(session, flush_context):
+    stale = session.info.pop(_STALE_KEY, None)
+    if not stale:
+        return
+    if stale == _ALL:
+        refresh()
+        return
+    node_ids = set()
+    for node in stale:
+        if isinstance(node, Node):
+            if inspect(node).deleted or inspect(node).detached:
+                continue
+            node = node.id
+        node_ids.add(node)
+    refresh(node_ids)
+
+
+# noinspection PyUnusedLocal
+def _forget_stale(session, *args):
+    session.info.pop(_STALE_KEY, None)
+
+
+def rebuild_acl_index_command():
+    __doc__ = """Rebuild the index of effective view permissions.
+
+    Run this after enabling the ``kotti.acl_index`` setting for an existing
+    site.
+
+    Usage:
+      kotti-rebuild-acl-index <config_uri>
+
+    Options:
+      -h --help          Show this screen.
+    """
+
+    def rebuild(args):
+        import transaction
+
+        refresh()
+        transaction.commit()
+
+    return command(rebuild, __doc__)
+
+
+def includeme(config):
+    """Pyramid includeme hook.
+
+    :param config: app config
+    :type config: :class:`pyramid.config.Configurator`
+    """
+
+    global enabled
+
+    enabled = asbool(config.get_settings()["kotti.acl_index"])
+    listeners = (
+        ("before_flush", _before_flush),
+        ("after_flush_postexec", _after_flush_postexec),
+        ("after_soft_rollback", _forget_stale),
+    )
+    for name, listener in listeners:
+        if enabled and not event.contains(DBSession, name, listener):
+            event.listen(DBSession, name, listener)
+        elif not enabled and event.contains(DBSession, name, listener):
+            event.remove(DBSession, name, listener)
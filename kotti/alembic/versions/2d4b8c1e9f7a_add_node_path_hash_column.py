@@ -0,0 +1,62 @@
+"""Add Node.path_hash column
+
+Revision ID: 2d4b8c1e9f7a
+Revises: 814c4ec72f1
+Create Date: 2026-10-18 10:12:41.518230
+
+"""
+
+import logging
+import sys
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '2d4b8c1e9f7a'
+down_revision = '814c4ec72f1'
+
+log = logging.getLogger('kotti')
+log.addHandler(logging.StreamHandler(sys.stdout))
+log.setLevel(logging.INFO)
+
+batch_size = 1000
+
+
+def upgrade():
+    from kotti.resources import hash_path
+
+    op.add_column('nodes', sa.Column('path_hash', sa.String(32)))
+    op.create_index('ix_nodes_path_hash', 'nodes', ['path_hash', ])
+
+    nodes = sa.table(
+        'nodes', sa.column('id'), sa.column('path'), sa.column('path_hash'))
+    update = nodes.update().where(nodes.c.id == sa.bindparam('node_id')).\
+        values({nodes.c.path_hash: sa.bindparam('hash')})
+
+    conn = op.get_bind()
+    last_id = 0
+    count = 0
+    while True:
+        rows = conn.execute(
+            sa.select([nodes.c.id, nodes.c.path])
+            .where(nodes.c.id > last_id)
+            .order_by(nodes.c.id)
+            .limit(batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        values = [
+            {'node_id': row.id, 'hash': hash_path(row.path)}
+            for row in rows if row.path is not None
+        ]
+        if values:
+            conn.execute(update, values)
+        last_id = rows[-1].id
+        count += len(rows)
+        log.info(f"Computed path hashes for {count} nodes")
+
+
+def downgrade():
+    op.drop_index('ix_nodes_path_hash', 'nodes')
+    op.drop_column('nodes', 'path_hash')
@@ -0,0 +1,25 @@
+"""Add shared_depot_files table
+
+Revision ID: 3c5a7e2f8d41
+Revises: 2d4b8c1e9f7a
+Create Date: 2026-10-18 11:02:17.340612
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3c5a7e2f8d41'
+down_revision = '2d4b8c1e9f7a'
+
+
+def upgrade():
+    op.create_table(
+        'shared_depot_files',
+        sa.Column('path', sa.String(200), primary_key=True),
+        sa.Column('refcount', sa.Integer(), nullable=False))
+
+
+def downgrade():
+    op.drop_table('shared_depot_files')
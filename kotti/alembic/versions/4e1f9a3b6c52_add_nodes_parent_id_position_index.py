@@ -0,0 +1,22 @@
+"""Add index on nodes (parent_id, position, id)
+
+Revision ID: 4e1f9a3b6c52
+Revises: 3c5a7e2f8d41
+Create Date: 2026-10-18 11:48:05.129774
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '4e1f9a3b6c52'
+down_revision = '3c5a7e2f8d41'
+
+
+def upgrade():
+    op.create_index(
+        'ix_nodes_parent_id_position', 'nodes', ['parent_id', 'position', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_nodes_parent_id_position', 'nodes')
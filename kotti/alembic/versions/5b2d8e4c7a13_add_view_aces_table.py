@@ -0,0 +1,30 @@
+"""Add view_aces table
+
+Revision ID: 5b2d8e4c7a13
+Revises: 4e1f9a3b6c52
+Create Date: 2026-10-18 14:02:37.415208
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5b2d8e4c7a13'
+down_revision = '4e1f9a3b6c52'
+
+
+def upgrade():
+    op.create_table(
+        'view_aces',
+        sa.Column(
+            'node_id', sa.Integer(),
+            sa.ForeignKey('nodes.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('principal_name', sa.Unicode(100), primary_key=True),
+        sa.Column('rank', sa.Integer(), nullable=False),
+        sa.Column('allowed', sa.Boolean(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('view_aces')
@@ -0,0 +1,33 @@
+"""Add blob_chunks table and chunk_size, content_hash columns to blobs
+
+Revision ID: 6a3f0c9d2e84
+Revises: 5b2d8e4c7a13
+Create Date: 2026-10-18 16:21:49.603217
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.mysql import LONGBLOB
+
+# revision identifiers, used by Alembic.
+revision = '6a3f0c9d2e84'
+down_revision = '5b2d8e4c7a13'
+
+
+def upgrade():
+    op.add_column('blobs', sa.Column('content_hash', sa.String(64)))
+    op.add_column('blobs', sa.Column('chunk_size', sa.Integer()))
+    op.create_table(
+        'blob_chunks',
+        sa.Column('file_id', sa.String(36), primary_key=True),
+        sa.Column(
+            'position', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('data', sa.LargeBinary().with_variant(LONGBLOB(), 'mysql')),
+    )
+
+
+def downgrade():
+    op.drop_table('blob_chunks')
+    op.drop_column('blobs', 'chunk_size')
+    op.drop_column('blobs', 'content_hash')
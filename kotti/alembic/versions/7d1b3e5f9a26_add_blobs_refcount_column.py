@@ -0,0 +1,53 @@
+"""Add refcount and data_id columns to blobs, enlarge file_id columns and
+make blobs.file_id unique
+
+Revision ID: 7d1b3e5f9a26
+Revises: 6a3f0c9d2e84
+Create Date: 2026-10-18 18:02:37.218405
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '7d1b3e5f9a26'
+down_revision = '6a3f0c9d2e84'
+
+
+def upgrade():
+    # SQLite can't change column types in place, batch mode recreates the
+    # tables there and issues plain ALTER statements everywhere else
+    with op.batch_alter_table('blobs') as batch_op:
+        batch_op.add_column(sa.Column('refcount', sa.Integer()))
+        batch_op.add_column(sa.Column('data_id', sa.String(64)))
+        batch_op.alter_column('file_id',
+                              existing_type=sa.String(36),
+                              type_=sa.String(64),
+                              )
+        batch_op.drop_index('ix_blobs_file_id')
+        batch_op.create_index('ix_blobs_file_id', ['file_id'], unique=True)
+    with op.batch_alter_table('blob_chunks') as batch_op:
+        batch_op.alter_column('file_id',
+                              existing_type=sa.String(36),
+                              type_=sa.String(64),
+                              existing_nullable=False,
+                              )
+
+
+def downgrade():
+    with op.batch_alter_table('blob_chunks') as batch_op:
+        batch_op.alter_column('file_id',
+                              existing_type=sa.String(64),
+                              type_=sa.String(36),
+                              existing_nullable=False,
+                              )
+    with op.batch_alter_table('blobs') as batch_op:
+        batch_op.drop_index('ix_blobs_file_id')
+        batch_op.create_index('ix_blobs_file_id', ['file_id'])
+        batch_op.alter_column('file_id',
+                              existing_type=sa.String(64),
+                              type_=sa.String(36),
+                              )
+        batch_op.drop_column('data_id')
+        batch_op.drop_column('refcount')
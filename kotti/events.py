@@ -11,31 +11,51 @@ Inheritance Diagram
 
 """
 
+import json
 from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
 import sqlalchemy.event
 import venusian
 from pyramid.location import lineage
 from pyramid.threadlocal import get_current_request
-from sqlalchemy.orm import load_only
+from sqlalchemy import Text
+from sqlalchemy import Unicode
+from sqlalchemy import and_
+from sqlalchemy import bindparam
+from sqlalchemy import exists
+from sqlalchemy import func
+from sqlalchemy import inspect
+from sqlalchemy import literal
+from sqlalchemy import select
+from sqlalchemy import type_coerce
 from sqlalchemy.orm import mapper
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy_utils.functions import has_changes
 from zope.deprecation import deprecated
+from zope.sqlalchemy import mark_changed
 
 from kotti import DBSession
+from kotti import acl_index
 from kotti import get_settings
 from kotti.resources import Content
 from kotti.resources import LocalGroup
 from kotti.resources import Node
 from kotti.resources import Tag
 from kotti.resources import TagsToContents
+from kotti.resources import hash_path
 from kotti.security import Principal
+from kotti.security import Principals
 from kotti.security import get_principals
+from kotti.security import invalidate_principal_caches
+from kotti.security import is_user
 from kotti.security import list_groups
 from kotti.security import list_groups_raw
 from kotti.security import set_groups
 from kotti.sqla import no_autoflush
+from kotti.traversal import invalidate_path_cache
+from kotti.util import command
 
 
 class ObjectEvent:
@@ -88,9 +108,82 @@ class UserDeleted(ObjectEvent):
     """This event is emitted when an user object is deleted from the DB."""
 
 
+class BatchEvent:
+    """Event that stands for one :class:`ObjectEvent` per object in
+    :attr:`objects`.  Object event handlers with a ``batch`` attribute get it
+    passed to that attribute instead of being called for every object while
+    :func:`bulk_mode` is active, see :func:`notify_batch`."""
+
+    def __init__(self, event_type, objects, request=None):
+        """Constructor.
+
+        :param event_type: Type of the events this event stands for.
+        :type event_type: class:`ObjectEvent` or descendant
+
+        :param objects: The objects related to the event, which are all of
+                        the same type.
+        :type objects: list
+
+        :param request: current request
+        :type request: :class:`kotti.request.Request`
+        """
+
+        self.event_type = event_type
+        self.objects = objects
+        self.request = request
+
+
+class _Handlers(list):
+    """ List of the handlers for one key of a :class:`DispatcherDict`, which
+    resets the dispatch cache of the dispatcher whenever it is changed. """
+
+    def __init__(self, iterable=(), dispatcher=None):
+        super().__init__(iterable)
+        self._dispatcher = dispatcher
+
+    def _changed(self):
+        if self._dispatcher is not None:
+            self._dispatcher._cache.clear()
+
+
+def _resetting(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._changed()
+        return result
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in (
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "__setitem__",
+    "append",
+    "clear",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "reverse",
+    "sort",
+):
+    setattr(_Handlers, _name, _resetting(_name))
+
+
 class DispatcherDict(OrderedDict):
+    """ Maps keys to lists of handlers.  Dispatchers resolve the handlers for
+    an event once per combination of types and keep the result in a cache,
+    which is reset whenever handlers are added or removed. """
+
     # Source: http://stackoverflow.com/a/6190500/562769
     def __init__(self, *a, **kw):
+        self._cache = {}
         OrderedDict.__init__(self, *a, **kw)
         self.default_factory = list
 
@@ -103,8 +196,51 @@ class DispatcherDict(OrderedDict):
     def __missing__(self, key):
         if self.default_factory is None:
             raise KeyError(key)
-        self[key] = value = self.default_factory()
-        return value
+        self[key] = self.default_factory()
+        return OrderedDict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, _Handlers) or value._dispatcher is not self:
+            value = _Handlers(value, self)
+        OrderedDict.__setitem__(self, key, value)
+        self._cache.clear()
+
+    def __delitem__(self, key):
+        OrderedDict.__delitem__(self, key)
+        self._cache.clear()
+
+    def clear(self):
+        OrderedDict.clear(self)
+        self._cache.clear()
+
+    def pop(self, *args):
+        result = OrderedDict.pop(self, *args)
+        self._cache.clear()
+        return result
+
+    def popitem(self, *args, **kwargs):
+        result = OrderedDict.popitem(self, *args, **kwargs)
+        self._cache.clear()
+        return result
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = [] if default is None else default
+        return self[key]
+
+    def _handlers(self, key, matches):
+        """ Return the handlers registered for all keys that ``matches``
+        accepts, in the order of registration, and cache them under ``key``. """
+
+        handlers = self._cache.get(key)
+        if handlers is None:
+            handlers = self._cache[key] = [
+                handler
+                for registered, registered_handlers in self.items()
+                if matches(registered)
+                for handler in registered_handlers
+            ]
+        return handlers
 
     def __reduce__(self):
         if self.default_factory is None:
@@ -162,13 +298,15 @@ class Dispatcher(DispatcherDict):
       [1]
     """
 
+    def handlers_for(self, event_type):
+        """ Return the handlers for events of type ``event_type``. """
+
+        return self._handlers(
+            event_type, lambda registered: issubclass(event_type, registered)
+        )
+
     def __call__(self, event):
-        results = []
-        for event_type, handlers in self.items():
-            if isinstance(event, event_type):
-                for handler in handlers:
-                    results.append(handler(event))
-        return results
+        return [handler(event) for handler in self.handlers_for(type(event))]
 
 
 class ObjectEventDispatcher(DispatcherDict):
@@ -198,15 +336,21 @@ class ObjectEventDispatcher(DispatcherDict):
       ['base', 'sub', 'all']
     """
 
+    def handlers_for(self, event_type, object_type):
+        """ Return the handlers for events of type ``event_type`` for objects
+        of type ``object_type``. """
+
+        def matches(registered):
+            evtype, objtype = registered
+            return issubclass(event_type, evtype) and (
+                objtype is None or issubclass(object_type, objtype)
+            )
+
+        return self._handlers((event_type, object_type), matches)
+
     def __call__(self, event):
-        results = []
-        for (evtype, objtype), handlers in self.items():
-            if isinstance(event, evtype) and (
-                objtype is None or isinstance(event.object, objtype)
-            ):
-                for handler in handlers:
-                    results.append(handler(event))
-        return results
+        handlers = self.handlers_for(type(event), type(event.object))
+        return [handler(event) for handler in handlers]
 
 
 def clear():
@@ -246,10 +390,27 @@ def _before_flush(session, flush_context, instances):
     - :class:``ObjectUpdate``
     - :class:``ObjectInsert``
     - :class:``ObjectDelete``
+
+    In :func:`bulk_mode` the events are sent with :func:`notify_batch`.
     """
     req = get_current_request()
+    inserted = session.info.get(_INSERTED_KEY, ())
+
+    if session.info.get(_BULK_KEY):
+        updated = [
+            obj
+            for obj in session.dirty
+            if id(obj) not in inserted
+            and session.is_modified(obj, include_collections=False)
+        ]
+        notify_batch(ObjectUpdate, updated, req)
+        notify_batch(ObjectInsert, list(session.new), req)
+        notify_batch(ObjectDelete, list(session.deleted), req)
+        return
 
     for obj in session.dirty:
+        if id(obj) in inserted:
+            continue
         if session.is_modified(obj, include_collections=False):  # XXX ?
             notify(ObjectUpdate(obj, req))
     for obj in session.new:
@@ -258,6 +419,106 @@ def _before_flush(session, flush_context, instances):
         notify(ObjectDelete(obj, req))
 
 
+_INSERTED_KEY = "kotti.events.inserted"
+_BULK_KEY = "kotti.events.bulk"
+
+
+@contextmanager
+def bulk_mode(session=None):
+    """Context manager for importing or changing many objects at once.  While
+    it is active, flushes send the :class:`ObjectInsert`, :class:`ObjectUpdate`
+    and :class:`ObjectDelete` events of all objects of a type together (see
+    :func:`notify_batch`).  Flush in batches of a few hundred objects to
+    benefit from it::
+
+        with bulk_mode():
+            for idx, row in enumerate(rows):
+                folder[row["name"]] = Document(**row)
+                if idx % 500 == 0:
+                    DBSession.flush()
+
+    :param session: The session to put into bulk mode, defaults to
+                    :data:`kotti.DBSession`.
+    :type session: :class:`sqlalchemy.orm.session.Session`
+    """
+
+    session = DBSession() if session is None else session
+    before = session.info.get(_BULK_KEY, False)
+    session.info[_BULK_KEY] = True
+    try:
+        yield session
+    finally:
+        session.info[_BULK_KEY] = before
+
+
+def _dispatch_batch(handlers, event_type, objects, request):
+    for handler in handlers:
+        if isinstance(handler, ObjectEventDispatcher):
+            groups = OrderedDict()
+            for obj in objects:
+                groups.setdefault(type(obj), []).append(obj)
+            for object_type, group in groups.items():
+                _dispatch_batch(
+                    handler.handlers_for(event_type, object_type),
+                    event_type,
+                    group,
+                    request,
+                )
+        elif getattr(handler, "batch", None) is not None:
+            handler.batch(BatchEvent(event_type, objects, request))
+        else:
+            for obj in objects:
+                handler(event_type(obj, request))
+
+
+def notify_batch(event_type, objects, request=None):
+    """Send the events of type ``event_type`` for all ``objects``.  Unlike
+    with :func:`notify`, every handler is called for all objects before the
+    next handler is called.  Object event handlers with a ``batch`` attribute
+    get a :class:`BatchEvent` for all objects of a type passed to it, all
+    other handlers are called for every object.  Kotti's own handlers have
+    such batch implementations.
+
+    :param event_type: Type of the events to send.
+    :type event_type: class:`ObjectEvent` or descendant
+
+    :param objects: The objects to send the events for.
+    :type objects: list
+
+    :param request: current request
+    :type request: :class:`kotti.request.Request`
+    """
+
+    if objects:
+        _dispatch_batch(listeners.handlers_for(event_type), event_type, objects, request)
+
+
+def notify_inserted(objects, request=None):
+    """Trigger :class:`ObjectInsert` for objects whose rows were inserted
+    without the ORM, e.g. by :func:`kotti.resources.copy_subtree`.  The changes
+    that the event handlers make to the objects are flushed right away, as
+    part of their insertion, i.e. without triggering :class:`ObjectUpdate`.
+
+    :param objects: The inserted objects.
+    :type objects: list
+
+    :param request: current request
+    :type request: :class:`kotti.request.Request`
+    """
+
+    session = DBSession()
+    if session.info.get(_BULK_KEY):
+        notify_batch(ObjectInsert, objects, request)
+    else:
+        for obj in objects:
+            notify(ObjectInsert(obj, request))
+    session.info[_INSERTED_KEY] = {id(obj) for obj in objects}
+    try:
+        session.flush()
+    finally:
+        del session.info[_INSERTED_KEY]
+
+
 def set_owner(event):
     """Set ``owner`` of the object that triggered the event.
 
@@ -278,6 +539,44 @@ def set_owner(event):
                 set_groups(userid, obj, groups)
 
 
+def _set_owner_batch(event):
+    """Batch implementation of :func:`set_owner`.  The owner role is looked up
+    once per parent, parents in the batch are handled before their children.
+
+    :param event: event that triggered this handler.
+    :type event: :class:`BatchEvent`
+    """
+
+    request = event.request
+    if request is None:
+        return
+    userid = request.authenticated_userid
+    if userid is None:
+        return
+
+    nodes = [obj for obj in event.objects if isinstance(obj, Node)]
+    depths = {id(node): len(list(lineage(node))) for node in nodes}
+    nodes.sort(key=lambda node: depths[id(node)])
+    is_owner = {}
+    for node in nodes:
+        if node.owner is None:
+            node.owner = userid
+        parent = node.__parent__
+        if parent is not None and id(parent) not in is_owner:
+            is_owner[id(parent)] = "role:owner" in list_groups(userid, parent)
+        if parent is not None and is_owner[id(parent)] and not node.local_groups:
+            inherited = True
+        else:
+            inherited = "role:owner" in list_groups(userid, node)
+        if not inherited:
+            groups = list_groups_raw(userid, node) | {"role:owner"}
+            set_groups(userid, node, groups)
+        is_owner[id(node)] = True
+
+
+set_owner.batch = _set_owner_batch
+
+
 def set_creation_date(event):
     """Set ``creation_date`` of the object that triggered the event.
 
@@ -290,6 +589,24 @@ def set_creation_date(event):
         obj.creation_date = obj.modification_date = datetime.now()
 
 
+def _set_creation_date_batch(event):
+    now = datetime.now()
+    for obj in event.objects:
+        if obj.creation_date is None:
+            obj.creation_date = obj.modification_date = now
+
+
+set_creation_date.batch = _set_creation_date_batch
+
+
+def _modification_date_excludes(obj):
+    return [
+        e.key
+        for e in get_settings()["kotti.modification_date_excludes"]
+        if isinstance(obj, e.class_)
+    ]
+
+
 def set_modification_date(event):
     """Update ``modification_date`` of the object that triggered the event.
 
@@ -297,47 +614,223 @@ def set_modification_date(event):
     :type event: :class:`ObjectUpdate`
     """
 
-    exclude = []
-
-    for e in get_settings()["kotti.modification_date_excludes"]:
-        if isinstance(event.object, e.class_):
-            exclude.append(e.key)
+    exclude = _modification_date_excludes(event.object)
 
     if has_changes(event.object, exclude=exclude):
         event.object.modification_date = datetime.now()
 
 
+def _set_modification_date_batch(event):
+    if not event.objects:
+        return
+    # All objects of a batch have the same type.
+    exclude = _modification_date_excludes(event.objects[0])
+    now = datetime.now()
+    for obj in event.objects:
+        if has_changes(obj, exclude=exclude):
+            obj.modification_date = now
+
+
+set_modification_date.batch = _set_modification_date_batch
+
+
+_ORPHANED_TAGS_KEY = "kotti.events.orphaned_tags"
+
+
+def delete_orphaned_tags_later(tag_ids, session=None):
+    """Delete those of the given tags that are not associated with any content
+    anymore when the current transaction is committed.  The check runs once
+    per transaction for all tags that were scheduled.
+
+    :param tag_ids: Ids of tags that lost content associations, ``None`` to
+                    check all tags.
+    :type tag_ids: iterable of int
+
+    :param session: The session whose commit triggers the deletion, defaults
+                    to :data:`kotti.DBSession`.
+    :type session: :class:`sqlalchemy.orm.session.Session`
+    """
+
+    session = DBSession() if session is None else session
+    if tag_ids is None:
+        session.info[_ORPHANED_TAGS_KEY] = None
+    elif session.info.get(_ORPHANED_TAGS_KEY, ()) is not None:
+        session.info.setdefault(_ORPHANED_TAGS_KEY, set()).update(tag_ids)
+
+
+def sweep_orphaned_tags(tag_ids=None):
+    """Delete tags that are not associated with any content.
+
+    :param tag_ids: Ids of the tags to check, ``None`` to check all tags.
+    :type tag_ids: iterable of int
+
+    :result: Number of deleted tags.
+    :rtype: int
+    """
+
+    from kotti.resources import BULK_BATCH_SIZE
+
+    session = DBSession()
+    tags = Tag.__table__
+    tags_to_contents = TagsToContents.__table__
+    orphaned = ~exists().where(tags_to_contents.c.tag_id == tags.c.id)
+    if tag_ids is None:
+        conditions = [orphaned]
+    else:
+        tag_ids = sorted(tag_ids)
+        conditions = [
+            and_(tags.c.id.in_(tag_ids[offset : offset + BULK_BATCH_SIZE]), orphaned)
+            for offset in range(0, len(tag_ids), BULK_BATCH_SIZE)
+        ]
+    deleted = 0
+    for condition in conditions:
+        deleted += session.execute(tags.delete().where(condition)).rowcount
+    if deleted:
+        mark_changed(session)
+    return deleted
+
+
 # noinspection PyUnusedLocal
 def delete_orphaned_tags(event):
-    """Delete Tag instances / records when they are not associated with any
-    content.
+    """Schedule the deletion of the tag of a deleted content association if it
+    isn't associated with any content anymore (see
+    :func:`delete_orphaned_tags_later`).
 
     :param event: event that triggered this handler.
     :type event: :class:`ObjectAfterDelete`
     """
 
-    # noinspection PyUnresolvedReferences
-    DBSession.query(Tag).filter(~Tag.content_tags.any()).delete(
-        synchronize_session=False
-    )
+    state = event.object.__dict__
+    tag_id = state.get("tag_id")
+    if tag_id is None and state.get("tag") is not None:
+        tag_id = state["tag"].id
+    delete_orphaned_tags_later(None if tag_id is None else [tag_id])
+
+
+def _delete_orphaned_tags(session):
+    """Delete the tags scheduled with :func:`delete_orphaned_tags_later`
+    before ``session`` is committed. """
+
+    if _ORPHANED_TAGS_KEY not in session.info:
+        return
+    # Deleted tag associations are only known after they have been flushed.
+    session.flush()
+    sweep_orphaned_tags(session.info.pop(_ORPHANED_TAGS_KEY))
+
+
+def _forget_orphaned_tags(session):
+    session.info.pop(_ORPHANED_TAGS_KEY, None)
+
+
+def delete_orphaned_tags_command():
+    __doc__ = """Delete all tags that are not associated with any content.
+
+    Usage:
+      kotti-delete-orphaned-tags <config_uri>
+
+    Options:
+      -h --help          Show this screen.
+    """
+
+    def delete(args):
+        import transaction
+
+        deleted = sweep_orphaned_tags()
+        transaction.commit()
+        print(f"Deleted {deleted} orphaned tags.")
+
+    return command(delete, __doc__)
 
 
 def cleanup_user_groups(event):
     """Remove a deleted group from the groups of a user/group and remove
        all local group entries of it.
 
+       Both are done with bulk statements.  Only the rows of the principals
+       that are members of the deleted group are rewritten and principals
+       that are already loaded in the session are synchronized.
+
        :param event: event that triggered this handler.
        :type event: :class:`UserDeleted`
        """
     name = event.object.name
+    session = DBSession()
+    session.flush()
 
+    regroup_all = False
     if name.startswith("group:"):
         principals = get_principals()
-        users_groups = [p for p in principals if name in principals[p].groups]
-        for user_or_group in users_groups:
-            principals[user_or_group].groups.remove(name)
+        if isinstance(principals, Principals) and issubclass(
+            principals.factory, Principal
+        ):
+            changed = _remove_group_from_principals(session, name)
+            regroup_all = any(not is_user(member) for member in changed)
+        else:
+            users_groups = [p for p in principals if name in principals[p].groups]
+            for user_or_group in users_groups:
+                # Keep a reference, the groups don't keep their owner alive
+                principal = principals[user_or_group]
+                principal.groups.remove(name)
+
+    local_groups = DBSession.query(LocalGroup).filter(
+        LocalGroup.principal_name == name
+    )
+    node_ids = {id for (id,) in local_groups.with_entities(LocalGroup.node_id)}
+    local_groups.delete()
+    invalidate_principal_caches()
+    if regroup_all and acl_index.enabled:
+        acl_index.refresh()
+    else:
+        acl_index.update(node_ids)
+
+
+def _remove_group_from_principals(session, name):
+    """Remove the group ``name`` from the groups of all principals with bulk
+    statements and return the names of the principals that were changed.
+
+    Only the rows whose serialized groups contain the group's name are read
+    back from the database, all other principals are never loaded."""
+
+    principals = Principal.__table__
+    members = session.execute(
+        select([principals.c.id, principals.c.name, principals.c.groups]).where(
+            type_coerce(principals.c.groups, Text).contains(
+                json.dumps(name), autoescape=True
+            )
+        )
+    )
+    changes = []
+    changed = set()
+    for id, member, groups in members:
+        if name in groups:
+            changes.append(
+                {"_id": id, "_groups": [group for group in groups if group != name]}
+            )
+            changed.add(member)
+    if not changes:
+        return changed
+    session.execute(
+        principals.update()
+        .where(principals.c.id == bindparam("_id"))
+        .values(groups=bindparam("_groups")),
+        changes,
+    )
+    mark_changed(session)
 
-    DBSession.query(LocalGroup).filter(LocalGroup.principal_name == name).delete()
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Principal) and obj.__dict__.get("name") in changed:
+            session.expire(obj, ["groups"])
+    return changed
+
+
+def invalidate_traversal_cache(event):
+    """Remove the deleted node and its descendants from the traversal cache.
+
+    :param event: event that triggered this handler.
+    :type event: :class:`ObjectDelete`
+    """
+
+    invalidate_path_cache(event.object.path)
 
 
 def reset_content_owner(event):
@@ -347,23 +840,53 @@ def reset_content_owner(event):
     :type event: :class:`UserDeleted`
     """
 
-    contents = DBSession.query(Content).filter(Content.owner == event.object.name).all()
-    for content in contents:
-        content.owner = None
+    name = event.object.name
+    session = DBSession()
+    session.flush()
+    contents = Content.__table__
+    result = session.execute(
+        contents.update().where(contents.c.owner == name).values(owner=None)
+    )
+    if not result.rowcount:
+        return
+    mark_changed(session)
+
+    for obj in session.identity_map.values():
+        if isinstance(obj, Content) and obj.__dict__.get("owner") == name:
+            set_committed_value(obj, "owner", None)
 
 
 def _update_children_paths(old_parent_path, new_parent_path):
-    for child in (
-        DBSession.query(Node)
-        .options(load_only("path", "type"))
-        .filter(Node.path.startswith(old_parent_path))
-        .order_by(Node.path)
-    ):
-        if child.path == new_parent_path:
-            # The child is the node itself and has already be renamed.
-            # Nothing to do!
+    """Rewrite the paths of all nodes below ``old_parent_path`` with a single
+    UPDATE statement and synchronize the nodes in the session with the new
+    paths, without loading any additional nodes."""
+
+    nodes = Node.__table__
+    path = literal(new_parent_path, Unicode) + func.substr(
+        nodes.c.path, len(old_parent_path) + 1
+    )
+    session = DBSession()
+    session.execute(
+        nodes.update()
+        .where(nodes.c.path.startswith(old_parent_path, autoescape=True))
+        .values(path=path, path_hash=func.md5(path))
+    )
+    mark_changed(session)
+
+    for obj in list(session.identity_map.values()) + list(session.new):
+        if not isinstance(obj, Node):
+            continue
+        child_path = obj.__dict__.get("path")
+        if child_path is None or not child_path.startswith(old_parent_path):
             continue
-        child.path = new_parent_path + child.path[len(old_parent_path):]
+        child_path = new_parent_path + child_path[len(old_parent_path) :]
+        state = inspect(obj)
+        if state.pending or state.attrs.path.history.has_changes():
+            # The change will be flushed by the ORM
+            obj.path = child_path
+        else:
+            set_committed_value(obj, "path", child_path)
+            set_committed_value(obj, "path_hash", hash_path(child_path))
 
 
 # noinspection PyUnusedLocal,SpellCheckingInspection
@@ -396,6 +919,8 @@ def _set_path_for_new_name(target, value, oldvalue, initiator):
     else:
         target_path += f"/{value}/"
     target.path = target_path
+    invalidate_path_cache(old_path)
+    invalidate_path_cache(target_path)
     # We need to set the name to value here so that the subsequent
     # UPDATE in _update_children_paths will include the new 'name'
     # already.  We have to make sure that we don't end up in an
@@ -453,6 +978,8 @@ def _set_path_for_new_parent(target, value, oldvalue, initiator):
     target_path = "/".join(node.__name__ for node in line)
     target_path += f"/{target.__name__}/"
     target.path = target_path
+    invalidate_path_cache(old_path)
+    invalidate_path_cache(target_path)
 
     if old_path and target.id is not None:
         _update_children_paths(old_path, target_path)
@@ -538,6 +1065,8 @@ def wire_sqlalchemy():  # pragma: no cover
         _WIRED_SQLALCHMEY = True
     sqlalchemy.event.listen(mapper, "after_delete", _after_delete)
     sqlalchemy.event.listen(DBSession, "before_flush", _before_flush)
+    sqlalchemy.event.listen(DBSession, "before_commit", _delete_orphaned_tags)
+    sqlalchemy.event.listen(DBSession, "after_rollback", _forget_orphaned_tags)
 
     # Update the 'path' attribute on changes to 'name' or 'parent'
     sqlalchemy.event.listen(Node.name, "set", _set_path_for_new_name, propagate=True)
@@ -568,11 +1097,14 @@ def includeme(config):
     # Set content modification date on content updates
     objectevent_listeners[(ObjectUpdate, Content)].append(set_modification_date)
 
-    # Delete orphaned tags after a tag association has ben deleted
+    # Delete orphaned tags when deleted tag associations are committed
     objectevent_listeners[(ObjectAfterDelete, TagsToContents)].append(
         delete_orphaned_tags
     )
 
+    # Drop cached traversal results for deleted nodes
+    objectevent_listeners[(ObjectDelete, Node)].append(invalidate_traversal_cache)
+
     # Initialze the workflow on content creation.
     objectevent_listeners[(ObjectInsert, Content)].append(initialize_workflow)
 
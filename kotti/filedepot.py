@@ -1,15 +1,30 @@
+import hashlib
+import io
+import json
 import logging
 import mimetypes
+import os
+import re
+import tempfile
+import time
 import uuid
 from cgi import FieldStorage
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from datetime import timedelta
+from io import BytesIO
+from itertools import repeat
+from typing import IO
 from typing import Callable
 from typing import Dict
+from typing import Iterable
 from typing import List
 from typing import Optional
 from typing import Tuple
 from typing import Union
 
+from depot.fields.sqlalchemy import UploadedFileField
 from depot.fields.sqlalchemy import _SQLAMutationTracker
 from depot.fields.upload import UploadedFile
 from depot.io.interfaces import FileStorage
@@ -20,6 +35,7 @@ from pyramid import tweens
 from pyramid.config import Configurator
 from pyramid.httpexceptions import HTTPMovedPermanently
 from pyramid.httpexceptions import HTTPNotFound
+from pyramid.httpexceptions import HTTPNotModified
 from pyramid.registry import Registry
 from pyramid.response import FileIter
 from pyramid.response import Response
@@ -28,27 +44,56 @@ from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import Integer
 from sqlalchemy import LargeBinary
+from sqlalchemy import MetaData
 from sqlalchemy import String
+from sqlalchemy import Table
 from sqlalchemy import Unicode
+from sqlalchemy import and_
 from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import inspect
+from sqlalchemy import select
 from sqlalchemy.engine.base import Connection
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import deferred
 from sqlalchemy.orm.attributes import Event
+from sqlalchemy.orm.attributes import get_history
 from sqlalchemy.util.langhelpers import _symbol
+from webob.byterange import ContentRange
+from webob.datetime_utils import parse_date
+from webob.datetime_utils import serialize_date
+from webob.request import BaseRequest
+from zope.sqlalchemy import mark_changed
 
 from kotti import Base
 from kotti import DBSession
 from kotti import get_settings
+from kotti.events import BatchEvent
 from kotti.events import ObjectInsert
 from kotti.events import ObjectUpdate
 from kotti.request import Request
-from kotti.util import _to_fieldstorage
 from kotti.util import camel_case_to_name
 from kotti.util import command
 from kotti.util import extract_from_settings
 
 _marker = object()
 
+# depot's field type doesn't declare whether it can be part of the keys of
+# SQLAlchemy's statement cache.  Its state doesn't change the SQL that is
+# generated, so it can.
+if UploadedFileField.cache_ok is None:
+    UploadedFileField.cache_ok = True
+
+#: Default size of the chunks :class:`DBFileStorage` writes blobs in
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+#: Default size limit in bytes of a :class:`BlobCache`
+BLOB_CACHE_SIZE = 1024 * 1024 * 1024
+
+#: Default number of seconds stored files may be cached by user agents
+CACHE_MAX_AGE = 604800
+
 
 class DBStoredFile(Base):
     """ :class:`depot.io.interfaces.StoredFile` implementation that stores
@@ -65,7 +110,7 @@ class DBStoredFile(Base):
     id = Column(Integer(), primary_key=True)
     #: Unique file id given to this blob
     #: (:class:`sqlalchemy.types.String`)
-    file_id = Column(String(36), index=True)
+    file_id = Column(String(64), index=True, unique=True)
     #: The original filename it had when it was uploaded.
     #: (:class:`sqlalchemy.types.String`)
     filename = Column(Unicode(100))
@@ -78,12 +123,32 @@ class DBStoredFile(Base):
     #: Date / time the blob was created or last modified
     #: (:class:`sqlalchemy.types.DateTime`)
     last_modified = Column(DateTime())
+    #: Hex digest of the SHA-256 hash of the blob's data
+    #: (:class:`sqlalchemy.types.String`)
+    content_hash = Column(String(64))
+    #: Size of the chunks in the ``blob_chunks`` table that hold the data of
+    #: large blobs, ``None`` if the data is in the ``data`` column.
+    #: (:class:`sqlalchemy.types.Integer`)
+    chunk_size = Column(Integer())
+    #: Number of files of a :class:`DedupFileStorage` that share the data of
+    #: this blob, ``None`` for blobs of other storages.
+    #: (:class:`sqlalchemy.types.Integer`)
+    refcount = Column(Integer())
+    #: File id of the blob that holds the data of a file of a
+    #: :class:`DedupFileStorage`, ``None`` for blobs that hold their own data.
+    #: (:class:`sqlalchemy.types.String`)
+    data_id = Column(String(64))
     #: The binary data itself
     #: (:class:`sqlalchemy.types.LargeBinary`)
     data = deferred(Column("data", LargeBinary()))
 
     _cursor = 0
-    _data = _marker
+    _location = None
+    _chunk = None
+    #: ``(cache, key)`` of the copy of the blob in a :class:`BlobCache`
+    _cache_entry = None
+    _cache_file = None
+    _cache_fill = None
 
     public_url = None
 
@@ -108,30 +173,153 @@ class DBStoredFile(Base):
     def read(self, n: int = -1) -> bytes:
         """Reads ``n`` bytes from the file.
 
-        If ``n`` is not specified or is ``-1`` the whole
-        file content is read in memory and returned
+        If ``n`` is not specified or is ``-1`` the rest of the file is read.
+        Unless the blob data has been loaded already, only the requested
+        slice of it is fetched from the database, so that streaming a file
+        in blocks needs memory for a single block.  If the storage has a
+        :class:`BlobCache` the data is read from the cached copy instead.
         """
-        if self._data is _marker:
-            file_id = DBSession.merge(self).file_id
-            self._data = (
-                DBSession.query(DBStoredFile.data).filter_by(file_id=file_id).scalar()
-            )
+        cache_file = self._open_cache()
+        if cache_file is not None:
+            return cache_file.read(n)
+        result = self._read_db(n)
+        fill = self._cache_fill
+        if fill is not None and n != 0:
+            if not fill.write(result):
+                self._cache_fill = None
+            elif n == -1 or len(result) < n:
+                # Read up to the end, the copy is complete
+                self._cache_fill = None
+                fill.commit()
+        return result
 
-        if n == -1:
-            result = self._data[self._cursor :]
+    def _read_db(self, n: int) -> bytes:
+        data = self._loaded_data()
+        if data is not _marker:
+            data = data or b""
+            if n == -1:
+                result = data[self._cursor :]
+            else:
+                result = data[self._cursor : self._cursor + n]
+        elif n == 0:
+            result = b""
+        elif self._blob_location()[1] is not None:
+            result = self._read_chunks(n)
         else:
-            result = self._data[self._cursor : self._cursor + n]
+            # SQL strings are indexed from 1
+            args = (self._cursor + 1,) if n == -1 else (self._cursor + 1, n)
+            column = func.substr(DBStoredFile.data, *args, type_=LargeBinary)
+            result = self._query(column) or b""
 
         self._cursor += len(result)
 
         return result
 
-    @staticmethod
-    def close(*args, **kwargs) -> None:
+    def _read_chunks(self, n: int) -> bytes:
+        """ Read ``n`` bytes from the ``blob_chunks`` table, one chunk at a
+        time.  The last chunk is kept for subsequent reads. """
+
+        file_id, chunk_size = self._blob_location()
+        parts = []
+        cursor = self._cursor
+        stop = None if n == -1 else cursor + n
+        while stop is None or cursor < stop:
+            position, offset = divmod(cursor, chunk_size)
+            if self._chunk is None or self._chunk[0] != position:
+                chunks = BlobChunk.__table__
+                data = DBSession.execute(
+                    select([chunks.c.data]).where(
+                        and_(
+                            chunks.c.file_id == file_id,
+                            chunks.c.position == position,
+                        )
+                    )
+                ).scalar()
+                self._chunk = (position, data or b"")
+            end = None if stop is None else offset + stop - cursor
+            part = self._chunk[1][offset:end]
+            if not part:
+                break
+            parts.append(part)
+            cursor += len(part)
+        return b"".join(parts)
+
+    def _open_cache(self) -> Optional[IO]:
+        """ Return the cached copy of the blob, opened at the current position,
+        or ``None`` if it isn't cached.  If the blob is read from its start, a
+        copy is written to the cache along the way and added to it once the
+        end is reached.  Reads of other ranges don't fill the cache. """
+
+        if self._cache_file is None and self._cache_entry is not None:
+            cache, key = self._cache_entry
+            self._cache_entry = None
+            f = cache.open(key)
+            if f is not None:
+                f.seek(self._cursor)
+                self._cache_file = f
+            elif self._cursor == 0:
+                self._cache_fill = cache.fill(key)
+        return self._cache_file
+
+    def _abort_cache_fill(self) -> None:
+        if self._cache_fill is not None:
+            self._cache_fill.abort()
+            self._cache_fill = None
+
+    def _loaded_data(self) -> Union[bytes, object]:
+        # The data of the blob if it is loaded and complete, ``_marker`` if it
+        # has to be read from the database
+        data = self.__dict__.get("data", _marker)
+        if data is _marker or self.chunk_size is not None or self.data_id:
+            return _marker
+        return data or b""
+
+    def _blob_location(self) -> Tuple[str, Optional[int]]:
+        """ Return the file id of the blob that holds this blob's data and
+        its chunk size without loading the data. """
+
+        if self._location is None:
+            if all(
+                key in self.__dict__ for key in ("file_id", "chunk_size", "data_id")
+            ):
+                blob = self
+            else:
+                # Expired or detached, e.g. while a response is streamed
+                blob = DBSession.merge(self)
+            self._location = (blob.data_id or blob.file_id, blob.chunk_size)
+        return self._location
+
+    def _query(self, column):
+        """ Return the value of ``column`` for this blob's row without loading
+        the row's data. """
+
+        file_id = self._blob_location()[0]
+        return (
+            DBSession.query(column).filter(DBStoredFile.file_id == file_id).limit(1)
+        ).scalar()
+
+    def close(self, *args, **kwargs) -> None:
         """Implement :meth:`StoredFile.close`.
-        :class:`DBStoredFile` never closes.
+        :class:`DBStoredFile` never closes, only the cached copy it reads
+        from is closed.
         """
-        return
+        self._abort_cache_fill()
+        if self._cache_file is not None:
+            self._cursor = self._cache_file.tell()
+            self._cache_file.close()
+            self._cache_file = None
+
+    def fileno(self) -> int:
+        """ Return the file descriptor of the cached copy of the blob, which
+        lets WSGI servers send it with ``sendfile``.
+
+        :raises io.UnsupportedOperation: if the blob isn't in the storage's
+                                         cache (yet).
+        """
+        cache_file = self._open_cache()
+        if cache_file is None:
+            raise io.UnsupportedOperation("fileno")
+        return cache_file.fileno()
 
     @staticmethod
     def closed() -> bool:
@@ -166,12 +354,27 @@ class DBStoredFile(Base):
                        * 2 -- end of stream; offset is usually negative
         :type whence: int
         """
+        if self._cache_file is not None:
+            self._cache_file.seek(offset, whence)
+            return
         if whence == 0:
             self._cursor = offset
-        elif whence in (1, 2):
+        elif whence == 1:
             self._cursor = self._cursor + offset
+        elif whence == 2:
+            self._cursor = self._size() + offset
         else:
             raise ValueError("whence must be 0, 1 or 2")
+        if self._cache_fill is not None and self._cursor != self._cache_fill.size:
+            self._abort_cache_fill()
+
+    def _size(self) -> int:
+        data = self._loaded_data()
+        if data is not _marker:
+            return len(data)
+        if self._blob_location()[1] is not None:
+            return self._query(DBStoredFile.content_length) or 0
+        return self._query(func.length(DBStoredFile.data)) or 0
 
     def tell(self) -> int:
         """ Returns current position of file cursor
@@ -179,6 +382,8 @@ class DBStoredFile(Base):
         :result: Current file cursor position.
         :rtype: int
         """
+        if self._cache_file is not None:
+            return self._cache_file.tell()
         return self._cursor
 
     @property
@@ -198,6 +403,7 @@ class DBStoredFile(Base):
         instance, to allow proper streaming of data.
         """
         event.listen(DBStoredFile.data, "set", handle_change_data)
+        event.listen(DBStoredFile, "before_delete", _delete_data)
 
 
 # noinspection PyUnusedLocal
@@ -207,8 +413,72 @@ def handle_change_data(
     oldvalue: Union[bytes, _symbol],
     initiator: Event,
 ) -> None:
+    if target._cache_file is not None:
+        target._cache_file.close()
+    target._abort_cache_fill()
     target._cursor = 0
-    target._data = _marker
+    target._location = None
+    target._chunk = None
+    target._cache_entry = None
+    target._cache_file = None
+
+
+# noinspection PyUnusedLocal
+def _delete_data(mapper, connection, target: DBStoredFile) -> None:
+    if target.data_id is not None:
+        release_blob(connection, target.data_id)
+    elif target.chunk_size is not None:
+        chunks = BlobChunk.__table__
+        connection.execute(chunks.delete().where(chunks.c.file_id == target.file_id))
+
+
+def release_blob(connection: Connection, file_id: str) -> None:
+    """ Remove a reference to the blob with the given id, that holds the data
+    of files of a :class:`DedupFileStorage`.  The blob is deleted when the
+    last reference is removed.
+
+    :param connection: Connection or session to execute the statements with
+    :param file_id: File id of the blob, i.e. the SHA-256 hash of its data
+    """
+
+    blobs = DBStoredFile.__table__
+    chunks = BlobChunk.__table__
+    connection.execute(
+        blobs.update()
+        .where(blobs.c.file_id == file_id)
+        .values(refcount=blobs.c.refcount - 1)
+    )
+    unreferenced = and_(blobs.c.file_id == file_id, blobs.c.refcount <= 0)
+    if connection.execute(select([blobs.c.id]).where(unreferenced)).first():
+        connection.execute(blobs.delete().where(unreferenced))
+        connection.execute(chunks.delete().where(chunks.c.file_id == file_id))
+
+
+class BlobChunk(Base):
+    """ One chunk of the data of a large :class:`DBStoredFile`.  Chunks are
+    written and read with SQL statements, they're not meant to be used through
+    the ORM. """
+
+    __tablename__ = "blob_chunks"
+
+    #: File id of the blob the chunk belongs to
+    #: (:class:`sqlalchemy.types.String`)
+    file_id = Column(String(64), primary_key=True)
+    #: Index of the chunk in the blob's data
+    #: (:class:`sqlalchemy.types.Integer`)
+    position = Column(Integer(), primary_key=True, autoincrement=False)
+    #: The binary data of the chunk
+    #: (:class:`sqlalchemy.types.LargeBinary`)
+    data = Column(LargeBinary())
+
+
+def _update_metadata(obj: DBStoredFile, now: datetime) -> None:
+    if obj.chunk_size is None and obj.data_id is None:
+        # The metadata of chunked blobs is set while their data is written
+        data = obj.data or b""
+        obj.content_length = len(data)
+        obj.content_hash = hashlib.sha256(data).hexdigest()
+    obj.last_modified = now
 
 
 def set_metadata(event: Union[ObjectUpdate, ObjectInsert]) -> None:
@@ -217,20 +487,202 @@ def set_metadata(event: Union[ObjectUpdate, ObjectInsert]) -> None:
     :param event: event that triggered this handler.
     :type event: :class:`ObjectInsert` or :class:`ObjectUpdate`
     """
-    obj = event.object
-    obj.content_length = obj.data and len(obj.data) or 0
-    obj.last_modified = datetime.now()
+    _update_metadata(event.object, datetime.now())
+
+
+def _set_metadata_batch(event: BatchEvent) -> None:
+    now = datetime.now()
+    for obj in event.objects:
+        _update_metadata(obj, now)
+
+
+set_metadata.batch = _set_metadata_batch
+
+
+class BlobCache:
+    """ A directory with copies of blobs, used by :class:`DBFileStorage` to
+    serve blobs without reading them from the database.
+
+    The total size of the files is limited to ``max_size`` bytes, the least
+    recently used files are removed when it is exceeded.  Files are never
+    changed once they are in the cache, their keys include the modification
+    date of the blob.
+
+    The directory may be shared by several processes.  The size of the cache
+    is taken from the directory whenever a file is added, and the time a file
+    was last used is recorded as its modification time.
+    """
+
+    def __init__(
+        self, directory: str, max_size: Union[int, str] = BLOB_CACHE_SIZE
+    ) -> None:
+        self.directory = directory
+        self.max_size = int(max_size)
+
+        os.makedirs(directory, exist_ok=True)
+        self._evict()
+
+    @property
+    def size(self) -> int:
+        """ The total size of the cached files in bytes. """
+
+        return sum(size for (mtime, key, size) in self._entries())
+
+    @staticmethod
+    def key(f: DBStoredFile) -> str:
+        """ Return the key of the copy of the current version of ``f``. """
+
+        return f"{f.file_id}-{f.last_modified:%Y%m%d%H%M%S%f}"
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def open(self, key: str) -> Optional[IO]:
+        """ Open the cached file for ``key`` or return ``None`` if there
+        is none. """
+
+        try:
+            f = open(self.path(key), "rb")
+        except FileNotFoundError:
+            return None
+        self._touch(key)
+        return f
+
+    def fill(self, key: str) -> "BlobCacheFill":
+        """ Start writing the file for ``key``, see :class:`BlobCacheFill`. """
+
+        return BlobCacheFill(self, key)
+
+    def add(self, key: str, blocks: Iterable[bytes]) -> Optional[IO]:
+        """ Write the data given as an iterable of ``blocks`` to the cache and
+        return the new file opened for reading, or ``None`` if it is larger
+        than the cache. """
+
+        fill = self.fill(key)
+        for block in blocks:
+            if not fill.write(block):
+                return None
+        fill.commit()
+        return self.open(key)
+
+    def discard(self, file_id: str) -> None:
+        """ Remove all cached versions of the blob with the given id. """
+
+        prefix = f"{file_id}-"
+        for (mtime, key, size) in self._entries():
+            if key.startswith(prefix):
+                self._remove(key)
+
+    def _entries(self) -> List[Tuple[float, str, int]]:
+        # ``(mtime, key, size)`` of the cached files, without those that are
+        # still being written
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith("."):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, entry.name, stat.st_size))
+        return entries
+
+    def _touch(self, key: str) -> None:
+        # File systems record modification times with a coarse resolution,
+        # which would make recently used files look as old as others
+        now = time.time()
+        try:
+            os.utime(self.path(key), (now, now))
+        except OSError:  # pragma: no cover
+            # removed by another process in the meantime
+            pass
+
+    def _remove(self, key: str) -> None:
+        try:
+            os.unlink(self.path(key))
+        except OSError:
+            # removed by another process already
+            pass
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries())
+        size = sum(size for (mtime, key, size) in entries)
+        for (mtime, key, file_size) in entries:
+            if size <= self.max_size:
+                break
+            self._remove(key)
+            size -= file_size
+
+
+class BlobCacheFill:
+    """ A copy of a blob that is written to a :class:`BlobCache` while the blob
+    is read.  The copy is added to the cache by :meth:`commit`, until then it
+    is kept in a temporary file in the cache's directory. """
+
+    def __init__(self, cache: BlobCache, key: str) -> None:
+        self.cache = cache
+        self.key = key
+        #: Number of bytes written so far
+        self.size = 0
+        fd, self._temp = tempfile.mkstemp(dir=cache.directory, prefix=".")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes) -> bool:
+        """ Append ``data`` to the copy.  Return ``False`` and abort if the
+        copy became larger than the cache. """
+
+        self.size += len(data)
+        if self.size > self.cache.max_size:
+            self.abort()
+            return False
+        self._file.write(data)
+        return True
+
+    def commit(self) -> None:
+        """ Add the copy to the cache and remove the least recently used
+        files if the cache became too large. """
+
+        self._file.close()
+        os.replace(self._temp, self.cache.path(self.key))
+        self.cache._touch(self.key)
+        self.cache._evict()
+
+    def abort(self) -> None:
+        """ Remove the incomplete copy. """
+
+        self._file.close()
+        try:
+            os.unlink(self._temp)
+        except OSError:  # pragma: no cover
+            pass
 
 
 class DBFileStorage(FileStorage):
     """Implementation of :class:`depot.io.interfaces.FileStorage`,
 
     Uses `kotti.filedepot.DBStoredFile` to store blob data in an SQL database.
+    Content is written in chunks of ``chunk_size`` bytes, which can be set
+    with the ``kotti.depot.N.chunk_size`` setting.  Blobs that fit into a
+    single chunk are stored in the ``blobs`` table, larger ones in the
+    ``blob_chunks`` table.
+
+    If a ``cache_dir`` is given, blobs are copied to a :class:`BlobCache` in
+    that directory when they're first read in full and served from there
+    afterwards.
+    Its size is limited to ``cache_size`` bytes.
     """
 
+    def __init__(
+        self,
+        chunk_size: Union[int, str] = BLOB_CHUNK_SIZE,
+        cache_dir: Optional[str] = None,
+        cache_size: Union[int, str] = BLOB_CACHE_SIZE,
+    ) -> None:
+        self.chunk_size = int(chunk_size)
+        self.cache = BlobCache(cache_dir, cache_size) if cache_dir else None
+
     # noinspection PyMethodOverriding
-    @staticmethod
-    def get(file_id: str) -> DBStoredFile:
+    def get(self, file_id: str) -> DBStoredFile:
         """Returns the file given by the file_id
 
         :param file_id: the unique id associated to the file
@@ -242,6 +694,13 @@ class DBFileStorage(FileStorage):
         f = DBSession.query(DBStoredFile).filter_by(file_id=file_id).first()
         if f is None:
             raise OSError
+        if (
+            self.cache is not None
+            and f.last_modified is not None
+            and (f.content_length or 0) <= self.cache.max_size
+            and f not in DBSession.dirty
+        ):
+            f._cache_entry = (self.cache, self.cache.key(f))
         return f
 
     def create(
@@ -268,15 +727,11 @@ class DBFileStorage(FileStorage):
         """
         new_file_id = str(uuid.uuid1())
         content, filename, content_type = self.fileinfo(content, filename, content_type)
-        if hasattr(content, "read"):
-            content = content.read()
 
         fstore = DBStoredFile(
-            data=content,
-            file_id=new_file_id,
-            filename=filename,
-            content_type=content_type,
+            file_id=new_file_id, filename=filename, content_type=content_type
         )
+        self._write(fstore, content)
         DBSession.add(fstore)
         return new_file_id
 
@@ -321,10 +776,48 @@ class DBFileStorage(FileStorage):
         if content_type is not None:
             fstore.content_type = content_type
 
-        if hasattr(content, "read"):
-            content = content.read()
+        self._write(fstore, content)
 
-        fstore.data = content
+    def _write(self, fstore: DBStoredFile, content: Union[bytes, IO]) -> None:
+        """Stream ``content`` into ``fstore`` with a buffer of ``chunk_size``
+        bytes.  The content length and hash are computed on the fly.
+        """
+
+        if not hasattr(content, "read"):
+            content = BytesIO(content)
+        session = DBSession()
+        chunks = BlobChunk.__table__
+        if fstore.chunk_size is not None:
+            session.execute(chunks.delete().where(chunks.c.file_id == fstore.file_id))
+            mark_changed(session)
+
+        digest = hashlib.sha256()
+        chunk = content.read(self.chunk_size)
+        following = content.read(self.chunk_size) if chunk else b""
+        if following:
+            position = length = 0
+            while chunk:
+                session.execute(
+                    chunks.insert().values(
+                        file_id=fstore.file_id, position=position, data=chunk
+                    )
+                )
+                digest.update(chunk)
+                length += len(chunk)
+                position += 1
+                chunk, following = following, content.read(self.chunk_size)
+            mark_changed(session)
+            fstore.chunk_size = self.chunk_size
+            fstore.data = None
+        else:
+            digest.update(chunk)
+            length = len(chunk)
+            fstore.chunk_size = None
+            fstore.data = chunk
+
+        fstore.content_length = length
+        fstore.content_hash = digest.hexdigest()
+        fstore.last_modified = datetime.now()
 
     def delete(self, file_or_id: str) -> None:
         """Deletes a file. If the file didn't exist it will just do nothing.
@@ -334,7 +827,19 @@ class DBFileStorage(FileStorage):
 
         file_id = self._get_file_id(file_or_id)
 
+        # Files of a DedupFileStorage are in the same table and may be
+        # deleted through any DBFileStorage, e.g. by sweep_orphaned_files
+        query = DBSession.query(DBStoredFile.data_id).filter_by(file_id=file_id)
+        data_ids = [data_id for (data_id,) in query if data_id is not None]
         DBSession.query(DBStoredFile).filter_by(file_id=file_id).delete()
+        DBSession.query(BlobChunk).filter_by(file_id=file_id).delete()
+        if data_ids:
+            session = DBSession()
+            for data_id in data_ids:
+                release_blob(session, data_id)
+            mark_changed(session)
+        if self.cache is not None:
+            self.cache.discard(file_id)
 
     def exists(self, file_or_id: str) -> bool:
         """Returns if a file or its ID still exist.
@@ -347,9 +852,33 @@ class DBFileStorage(FileStorage):
 
         return bool(DBSession.query(DBStoredFile).filter_by(file_id=file_id).count())
 
+    # noinspection PyMethodOverriding
     @staticmethod
-    def list(*args) -> None:
-        raise NotImplementedError("list() method is unimplemented.")
+    def list(offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """Returns the ids of the files in the storage, ordered by id.
+
+        All instances share the ``blobs`` table, so these include the files
+        of other :class:`DBFileStorage` depots, but not the blobs that hold
+        the data of the files of a :class:`DedupFileStorage`.
+
+        :param offset: Number of ids to skip.
+        :type offset: int
+
+        :param limit: Maximum number of ids to return, ``None`` for all.
+        :type limit: int
+
+        :result: File ids
+        :rtype: list
+        """
+
+        query = (
+            DBSession.query(DBStoredFile.file_id)
+            .filter(DBStoredFile.refcount.is_(None))
+            .order_by(DBStoredFile.file_id)
+            .offset(offset)
+            .limit(limit)
+        )
+        return [file_id for (file_id,) in query]
 
     @staticmethod
     def _get_file_id(file_or_id: Union[DBStoredFile, str]) -> str:
@@ -358,40 +887,450 @@ class DBFileStorage(FileStorage):
         return file_or_id
 
 
+class DedupFileStorage(DBFileStorage):
+    """A :class:`DBFileStorage` that stores identical data only once.
+
+    Files are stored like the files of :class:`DBFileStorage`, with a unique
+    id and their own filename and content type, but without data.  Their
+    data is kept in a separate blob whose file id is the SHA-256 hash of the
+    data (see :attr:`DBStoredFile.data_id`).  The blob counts the files that
+    reference it and is deleted with the last one.
+
+    As the files themselves are created and deleted in the current
+    transaction, the reference counts follow the commits and rollbacks that
+    depot's :class:`~depot.fields.sqlalchemy._SQLAMutationTracker` handles.
+    """
+
+    def _write(self, fstore: DBStoredFile, content: Union[bytes, IO]) -> None:
+        """Make ``fstore`` reference the blob with the data of ``content``,
+        which is created if there is none yet.
+
+        File-like content is spooled to a temporary file (in memory up to
+        ``chunk_size`` bytes) while it's hashed, so that it's only written to
+        the database if there is no blob with the same data.  The blob is
+        inserted in a savepoint; if a concurrent transaction inserted it first
+        the unique ``file_id`` makes the insert fail and its refcount is
+        incremented instead.
+        """
+
+        digest = hashlib.sha256()
+        if hasattr(content, "read"):
+            spool = tempfile.SpooledTemporaryFile(max_size=self.chunk_size)
+            for block in iter(lambda: content.read(self.chunk_size), b""):
+                digest.update(block)
+                spool.write(block)
+            spool.seek(0)
+            content = spool
+        else:
+            digest.update(content)
+        data_id = digest.hexdigest()
+
+        session = DBSession()
+        blobs = session.query(DBStoredFile).filter_by(file_id=data_id)
+        while True:
+            if blobs.update(
+                {DBStoredFile.refcount: DBStoredFile.refcount + 1},
+                synchronize_session=False,
+            ):
+                blob = blobs.with_entities(
+                    DBStoredFile.chunk_size, DBStoredFile.content_length
+                ).first()
+                break
+            if hasattr(content, "seek"):
+                content.seek(0)
+            try:
+                with session.begin_nested():
+                    blob = DBStoredFile(file_id=data_id, refcount=1)
+                    super()._write(blob, content)
+                    session.add(blob)
+                break
+            except IntegrityError:
+                # A concurrent transaction created the blob, reference it
+                pass
+
+        old_data_id = fstore.data_id
+        if old_data_id is not None:
+            release_blob(session, old_data_id)
+            mark_changed(session)
+        elif fstore.chunk_size is not None:
+            chunks = BlobChunk.__table__
+            session.execute(chunks.delete().where(chunks.c.file_id == fstore.file_id))
+            mark_changed(session)
+
+        fstore.data = None
+        fstore.data_id = data_id
+        fstore.chunk_size = blob.chunk_size
+        fstore.content_length = blob.content_length
+        fstore.content_hash = data_id
+        fstore.last_modified = datetime.now()
+
+
+class SharedDepotFile(Base):
+    """Reference count of a depot file that is referenced by more than one
+    field, e.g. after :func:`kotti.resources.copy_subtree` has copied a
+    :class:`~kotti.resources.File`.  Files without a row are referenced once.
+    """
+
+    __tablename__ = "shared_depot_files"
+
+    #: Depot path of the file, i.e. ``<depot name>/<file id>``
+    #: (:class:`sqlalchemy.types.String`)
+    path = Column(String(200), primary_key=True)
+    #: Number of fields that reference the file
+    #: (:class:`sqlalchemy.types.Integer`)
+    refcount = Column(Integer(), nullable=False)
+
+
+_RELEASED_FILES_KEY = "kotti.filedepot.released_files"
+
+
+def share_files(paths: Iterable[str]) -> None:
+    """Add a reference to each of the given depot files.  Files are shared
+    this way instead of being duplicated when content is copied.  A file is
+    only deleted from its depot once all references have been released.
+
+    :param paths: Depot paths (``<depot name>/<file id>``), as found in
+                  :attr:`depot.fields.upload.UploadedFile.files`.  A path
+                  may occur more than once.
+    :type paths: iterable of str
+    """
+
+    table = SharedDepotFile.__table__
+    session = DBSession()
+    for path, count in Counter(paths).items():
+        result = session.execute(
+            table.update()
+            .where(table.c.path == path)
+            .values(refcount=table.c.refcount + count)
+        )
+        if not result.rowcount:
+            session.execute(table.insert().values(path=path, refcount=count + 1))
+    mark_changed(session)
+
+
+def release_files(session: Session, obj: Base, prop: str) -> None:
+    """Queue the depot files of the field ``prop`` of ``obj`` for deletion
+    on commit, like depot does for objects deleted through the ORM.  Used for
+    rows that are deleted without the ORM.
+
+    :param session: The session ``obj`` belongs to.
+    :type session: :class:`sqlalchemy.orm.Session`
+
+    :param obj: Object that is about to be deleted.
+
+    :param prop: Name of the field that holds the file.
+    :type prop: str
+    """
+
+    value = getattr(obj, prop)
+    if value is not None:
+        session._depot_old = getattr(session, "_depot_old", set())
+        session._depot_old.update(value.files)
+        _track_released(session, inspect(obj), prop, value)
+
+
+def _track_released(session, state, prop, value):
+    # Remember every (object, field, file) whose reference is released in the
+    # current transaction.  Depot itself only keeps a set of the files, which
+    # would count a file that is referenced by two deleted objects only once.
+    released = session.info.setdefault(_RELEASED_FILES_KEY, set())
+    key = state.key or id(state)
+    released.update((key, prop, path) for path in value.files)
+
+
+# noinspection PyUnusedLocal
+def _track_released_before_flush(session, flush_context, instances):
+    for obj in session.deleted:
+        for prop in _SQLAMutationTracker.mapped_entities.get(obj.__class__, ()):
+            value = getattr(obj, prop)
+            if value is not None:
+                _track_released(session, inspect(obj), prop, value)
+    for obj in session.dirty:
+        for prop in _SQLAMutationTracker.mapped_entities.get(obj.__class__, ()):
+            for value in get_history(obj, prop).deleted:
+                if value is not None:
+                    _track_released(session, inspect(obj), prop, value)
+
+
+# noinspection PyUnusedLocal
+def _track_released_after_flush(session, flush_context):
+    # Objects deleted through a relationship only show up after the flush
+    for state in flush_context.states:
+        if not state.deleted:
+            continue
+        obj = state.obj()
+        for prop in _SQLAMutationTracker.mapped_entities.get(obj.__class__, ()):
+            value = getattr(obj, prop)
+            if value is not None:
+                _track_released(session, state, prop, value)
+
+
 # noinspection PyUnusedLocal
-def migrate_storage(from_storage: str, to_storage: str) -> None:
+def _forget_released(session, previous_transaction):
+    session.info.pop(_RELEASED_FILES_KEY, None)
+
+
+def release_shared_files(session: Session) -> None:
+    """Decrement the reference counts of shared files that were released in
+    the current transaction and keep them in their depot while they are
+    still referenced.  Executed before depot deletes the released files on
+    commit.
+
+    :param session: The session that is about to be committed.
+    :type session: :class:`sqlalchemy.orm.Session`
+    """
+
+    session.flush()
+    released = session.info.pop(_RELEASED_FILES_KEY, ())
+    old = getattr(session, "_depot_old", None)
+    if not released or not old:
+        return
+
+    counts = Counter(path for key, prop, path in released)
+    table = SharedDepotFile.__table__
+    rows = session.execute(
+        select([table.c.path, table.c.refcount]).where(
+            table.c.path.in_(list(counts))
+        )
+    ).fetchall()
+    for path, refcount in rows:
+        refcount -= counts[path]
+        if refcount > 0:
+            # Still referenced by other fields
+            old.discard(path)
+        if refcount > 1:
+            session.execute(
+                table.update().where(table.c.path == path).values(refcount=refcount)
+            )
+        else:
+            session.execute(table.delete().where(table.c.path == path))
+
+
+#: Number of objects :func:`migrate_storage` migrates per transaction
+MIGRATE_BATCH_SIZE = 100
+
+
+def _copy_file(from_storage: str, to_storage: str, file_id: str) -> Tuple[str, int]:
+    # Streams the file into the new storage, returns its id and size
+    f = DepotManager.get(from_storage).get(file_id)
+    try:
+        new_file_id = DepotManager.get(to_storage).create(
+            f, f.filename, f.content_type
+        )
+        return new_file_id, f.content_length or 0
+    finally:
+        f.close()
+
+
+def _copy_file_in_thread(from_storage: str, to_storage: str, file_id: str):
+    import transaction
+
+    try:
+        return _copy_file(from_storage, to_storage, file_id)
+    finally:
+        # Release the thread's session that DBFileStorage reads from
+        transaction.abort()
+
+
+def _migrated_value(value: UploadedFile, new_paths: Dict[str, str]) -> UploadedFile:
+    """ Return a copy of the ``value`` of a file field that refers to the
+    new paths of its files.  This includes values added by filters that refer
+    to the files, e.g. thumbnail paths and URLs. """
+
+    replacements = {}
+    for old_path in value["files"]:
+        new_path = new_paths[old_path]
+        replacements[old_path] = new_path
+        replacements[old_path.split("/", 1)[1]] = new_path.split("/", 1)[1]
+
+    data = {}
+    for key, item in value.items():
+        if isinstance(item, str):
+            if item in replacements:
+                item = replacements[item]
+            else:
+                for old_path in value["files"]:
+                    item = item.replace(old_path, replacements[old_path])
+        data[key] = item
+    data["depot_name"] = data["path"].split("/", 1)[0]
+    data["files"] = [replacements[path] for path in value["files"]]
+    data["_public_url"] = DepotManager.get_file(data["path"]).public_url
+    return type(value)(data)
+
+
+def migrate_storage(
+    from_storage: str,
+    to_storage: str,
+    batch_size: int = MIGRATE_BATCH_SIZE,
+    workers: int = 1,
+    checkpoint: Optional[str] = None,
+    dry_run: bool = False,
+) -> Tuple[int, int]:
+    """ Move the files of all file fields that are stored in ``from_storage``
+    to ``to_storage``.
+
+    Objects are migrated in batches of ``batch_size`` and each batch is
+    committed, so that memory usage is bounded and an interrupted migration
+    can be restarted.  Files are streamed from one storage to the other, by
+    ``workers`` threads in parallel.  Files that are referenced by more than
+    one field (see :func:`share_files`) are copied once.
+
+    :param from_storage: Name of the depot to move files from.
+    :type from_storage: str
+
+    :param to_storage: Name of the depot to move files to.
+    :type to_storage: str
+
+    :param batch_size: Number of objects migrated per transaction.
+    :type batch_size: int
+
+    :param workers: Number of threads that copy files.  Files are always
+                    copied in the main thread if ``to_storage`` is a
+                    :class:`DBFileStorage`, whose files must be created in the
+                    transaction that is committed.
+    :type workers: int
+
+    :param checkpoint: Path of a file that records the last migrated object
+                       of every class after each batch.  A migration that is
+                       started with the same file resumes after these.
+    :type checkpoint: str
+
+    :param dry_run: Only count the files to migrate and their size.
+    :type dry_run: bool
+
+    :result: The number of files that were (or would be) copied and their
+             total size in bytes.
+    :rtype: tuple
+    """
+    import transaction
+
     log = logging.getLogger(__name__)
 
-    old_default = DepotManager._default_depot
-    DepotManager._default_depot = to_storage
+    if isinstance(DepotManager.get(to_storage), DBFileStorage):
+        workers = 1
+    pool = ThreadPoolExecutor(workers) if workers > 1 and not dry_run else None
 
-    for klass, props in _SQLAMutationTracker.mapped_entities.items():
-        log.info("Migrating %r", klass)
+    progress = {}
+    if checkpoint is not None and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            progress = json.load(f)
 
-        mapper = klass._sa_class_manager.mapper
+    started = time.time()
+    copied = size = 0
+    # New paths of files that are referenced by more than one field, and
+    # those of them that have been assigned to a field already
+    shared = {}
+    assigned = set()
 
-        # use type column to avoid polymorphism issues, getting the same
-        # Node item multiple times.
-        type_ = camel_case_to_name(klass.__name__)
-        for instance in DBSession.query(klass).filter_by(type=type_):
-            for prop in props:
-                uf = getattr(instance, prop)
-                if not uf:
-                    continue
-                pk = mapper.primary_key_from_instance(instance)
-                log.info("Migrating %s for %r with pk %r", prop, klass, pk)
-
-                filename = uf["filename"]
-                content_type = uf["content_type"]
-                data = _to_fieldstorage(
-                    fp=uf.file,
-                    filename=filename,
-                    mimetype=content_type,
-                    size=uf.file.content_length,
+    for klass, props in sorted(
+        _SQLAMutationTracker.mapped_entities.items(), key=lambda item: str(item[0])
+    ):
+        mapper = inspect(klass)
+        [pk] = mapper.primary_key
+        pk_attr = mapper.get_property_by_column(pk).key
+        name = f"{klass.__module__}.{klass.__name__}"
+        query = DBSession.query(klass).order_by(pk)
+        if hasattr(klass, "type"):
+            # use type column to avoid polymorphism issues, getting the same
+            # Node item multiple times.
+            query = query.filter_by(type=camel_case_to_name(klass.__name__))
+        total = query.count()
+        log.info("Migrating %s of %d %r objects", ", ".join(props), total, klass)
+
+        done = 0
+        last_id = progress.get(name)
+        while True:
+            batch = query if last_id is None else query.filter(pk > last_id)
+            instances = batch.limit(batch_size).all()
+            if not instances:
+                break
+            last_id = getattr(instances[-1], pk_attr)
+
+            values = [
+                (instance, prop, getattr(instance, prop))
+                for instance in instances
+                for prop in props
+            ]
+            values = [
+                (instance, prop, value)
+                for (instance, prop, value) in values
+                if value is not None and value["depot_name"] == from_storage
+            ]
+            paths = list(
+                dict.fromkeys(
+                    path
+                    for (instance, prop, value) in values
+                    for path in value["files"]
+                    if path not in shared
                 )
-                setattr(instance, prop, data)
+            )
+            shared_paths = {
+                path
+                for (path,) in DBSession.query(SharedDepotFile.path).filter(
+                    SharedDepotFile.path.in_(paths)
+                )
+            }
+
+            if dry_run:
+                for path in paths:
+                    size += DepotManager.get_file(path).content_length or 0
+                    if path in shared_paths:
+                        shared[path] = None
+            else:
+                file_ids = [path.split("/", 1)[1] for path in paths]
+                args = (repeat(from_storage), repeat(to_storage), file_ids)
+                if pool is not None:
+                    results = pool.map(_copy_file_in_thread, *args)
+                else:
+                    results = map(_copy_file, *args)
+                new_paths = {}
+                for path, (new_file_id, file_size) in zip(paths, results):
+                    new_paths[path] = f"{to_storage}/{new_file_id}"
+                    if path in shared_paths:
+                        shared[path] = new_paths[path]
+                    size += file_size
+
+                # Delete the new files if the batch is rolled back, like depot
+                # does for files it creates
+                session = DBSession()
+                session._depot_new = getattr(session, "_depot_new", set())
+                session._depot_new.update(new_paths.values())
+
+                new_paths.update(shared)
+                for instance, prop, value in values:
+                    value = _migrated_value(value, new_paths)
+                    setattr(instance, prop, value)
+                    for path in value["files"]:
+                        if path not in shared.values():
+                            continue
+                        if path in assigned:
+                            share_files([path])
+                        assigned.add(path)
+
+                transaction.commit()
+                if checkpoint is not None:
+                    progress[name] = last_id
+                    with open(checkpoint, "w") as f:
+                        json.dump(progress, f)
+            copied += len(paths)
+
+            done += len(instances)
+            elapsed = time.time() - started
+            log.info(
+                "%d/%d %r objects, %d files (%.1f MB) in %.0f s, %.1f MB/s",
+                done,
+                total,
+                klass,
+                copied,
+                size / 1024 / 1024,
+                elapsed,
+                size / 1024 / 1024 / elapsed if elapsed else 0,
+            )
 
-    DepotManager._default_depot = old_default
+    if pool is not None:
+        pool.shutdown()
+
+    return copied, size
 
 
 def migrate_storages_command():  # pragma: no cover
@@ -400,19 +1339,350 @@ def migrate_storages_command():  # pragma: no cover
     Usage:
       kotti-migrate-storage <config_uri> \
           --from-storage <name> \
-          --to-storage <name>
+          --to-storage <name> \
+          [--batch-size <n>] [--workers <n>] [--checkpoint <file>] [--dry-run]
 
     Options:
       -h --help                 Show this screen.
-      --from-storage <name>   The storage name that has blob data to migrate
-      --to-storage <name>     The storage name where we want to put the blobs
+      --from-storage <name>     The storage name that has blob data to migrate
+      --to-storage <name>       The storage name where we want to put the blobs
+      --batch-size <n>          Number of objects migrated per transaction
+                                [default: 100]
+      --workers <n>             Number of threads that copy blobs [default: 4]
+      --checkpoint <file>       File that records the progress, to resume an
+                                interrupted migration
+      --dry-run                 Only report the number and size of the blobs
+                                that would be migrated
     """
-    return command(
-        lambda args: migrate_storage(
-            from_storage=args["--from-storage"], to_storage=args["--to-storage"]
-        ),
-        __doc__,
+
+    def migrate(args):
+        copied, size = migrate_storage(
+            from_storage=args["--from-storage"],
+            to_storage=args["--to-storage"],
+            batch_size=int(args["--batch-size"]),
+            workers=int(args["--workers"]),
+            checkpoint=args["--checkpoint"],
+            dry_run=args["--dry-run"],
+        )
+        if args["--dry-run"]:
+            print(f"{copied} blobs ({size / 1024 / 1024:.1f} MB) would be migrated.")
+        else:
+            print(f"Migrated {copied} blobs ({size / 1024 / 1024:.1f} MB).")
+
+    return command(migrate, __doc__)
+
+
+#: Number of files :func:`sweep_orphaned_files` checks per transaction
+SWEEP_BATCH_SIZE = 100
+
+#: Minimum age in seconds of the files :func:`sweep_orphaned_files` deletes
+SWEEP_MIN_AGE = 24 * 60 * 60
+
+
+def _file_field_columns() -> List[Column]:
+    """ Return the columns of all file fields, each one only once, even if
+    subclasses of the class that maps it have file fields as well. """
+
+    columns = []
+    for klass, props in _SQLAMutationTracker.mapped_entities.items():
+        mapper = inspect(klass)
+        for prop in props:
+            for column in mapper.get_property(prop).columns:
+                if column not in columns:
+                    columns.append(column)
+    return columns
+
+
+def _create_referenced_files_table(connection: Connection, batch_size: int) -> Table:
+    """ Create a temporary table that holds the ids of the files that are
+    referenced by file fields or shared between them (see :func:`share_files`).
+
+    The tables of the file fields and ``shared_depot_files`` are read once,
+    in pages of ``batch_size`` rows ordered by primary key.  The table has an
+    index on ``file_id``, so that listed files can be anti-joined against it
+    batch by batch.
+    """
+
+    table = Table(
+        "kotti_referenced_files",
+        MetaData(),
+        Column("file_id", String(200), index=True),
+        prefixes=["TEMPORARY"],
     )
+    table.create(connection)
+
+    shared = SharedDepotFile.__table__
+    for column in _file_field_columns() + [shared.c.path]:
+        [pk] = column.table.primary_key.columns
+        columns = [pk] if column is pk else [pk, column]
+        query = select(columns).order_by(pk).limit(batch_size)
+        last_id = None
+        while True:
+            page = query if last_id is None else query.where(pk > last_id)
+            rows = connection.execute(page).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            if column is shared.c.path:
+                paths = [row[-1] for row in rows]
+            else:
+                paths = [path for row in rows if row[-1] for path in row[-1]["files"]]
+            file_ids = {path.split("/", 1)[1] for path in paths}
+            if file_ids:
+                connection.execute(
+                    table.insert(), [{"file_id": file_id} for file_id in file_ids]
+                )
+    return table
+
+
+def sweep_orphaned_files(
+    storages: Optional[Iterable[str]] = None,
+    batch_size: int = SWEEP_BATCH_SIZE,
+    min_age: int = SWEEP_MIN_AGE,
+    dry_run: bool = False,
+) -> Tuple[int, int]:
+    """ Delete the files that no file field references anymore, e.g. because
+    the transaction that created them was rolled back.
+
+    The ids of the referenced files are collected in a temporary table first,
+    in one pass over the file fields.  The files of every storage are then
+    listed in batches of ``batch_size``, each batch is anti-joined against
+    that table and its orphaned files are deleted in one transaction.  Files
+    that were modified less than ``min_age`` seconds ago are kept, as they
+    may belong to a transaction that isn't committed yet.  The files of all
+    :class:`DBFileStorage` depots are in the same table and swept together.
+
+    :param storages: Names of the depots to sweep, all depots if ``None``.
+    :type storages: iterable of str
+
+    :param batch_size: Number of files checked per transaction.
+    :type batch_size: int
+
+    :param min_age: Minimum age in seconds of the files to delete.
+    :type min_age: int
+
+    :param dry_run: Only count the orphaned files and their size.
+    :type dry_run: bool
+
+    :result: The number of files that were (or would be) deleted and their
+             total size in bytes.
+    :rtype: tuple
+    """
+
+    # Storages record modification times in local time or in UTC
+    cutoff = min(datetime.now(), datetime.utcnow()) - timedelta(seconds=min_age)
+
+    # The temporary table must outlive the transactions of the batches, so it
+    # is created on a connection of its own, unless the session is bound to a
+    # connection already
+    bind = DBSession.get_bind()
+    connection = bind if isinstance(bind, Connection) else bind.connect()
+    referenced_files = _create_referenced_files_table(connection, batch_size)
+    try:
+        return _sweep(
+            connection, referenced_files, storages, batch_size, cutoff, dry_run
+        )
+    finally:
+        referenced_files.drop(connection)
+        if connection is not bind:
+            connection.close()
+
+
+def _sweep(
+    connection: Connection,
+    referenced_files: Table,
+    storages: Optional[Iterable[str]],
+    batch_size: int,
+    cutoff: datetime,
+    dry_run: bool,
+) -> Tuple[int, int]:
+    """ Delete the files that are not in ``referenced_files`` and were
+    modified before ``cutoff``, see :func:`sweep_orphaned_files`. """
+    import transaction
+
+    log = logging.getLogger(__name__)
+    deleted = size = 0
+    blobs_swept = False
+
+    for name in storages or sorted(DepotManager._depots):
+        storage = DepotManager.get(name)
+        if isinstance(storage, DBFileStorage):
+            if blobs_swept:
+                # It lists the files of the depot that was swept already
+                continue
+            blobs_swept = True
+            list_files = storage.list
+        else:
+            # Other storages don't support paging
+            file_ids = sorted(storage.list())
+
+            def list_files(offset, limit, file_ids=file_ids):
+                return file_ids[offset : offset + limit]
+
+        offset = 0
+        while True:
+            file_ids = list_files(offset, batch_size)
+            if not file_ids:
+                break
+            offset += len(file_ids)
+
+            query = select([referenced_files.c.file_id]).where(
+                referenced_files.c.file_id.in_(file_ids)
+            )
+            referenced = {file_id for (file_id,) in connection.execute(query)}
+            for file_id in file_ids:
+                if file_id in referenced:
+                    continue
+                try:
+                    f = storage.get(file_id)
+                except OSError:
+                    continue
+                try:
+                    if f.last_modified is not None and f.last_modified > cutoff:
+                        continue
+                    file_size = f.content_length or 0
+                finally:
+                    f.close()
+                if not dry_run:
+                    storage.delete(file_id)
+                    if isinstance(storage, DBFileStorage):
+                        # The following files move up in the listing
+                        offset -= 1
+                deleted += 1
+                size += file_size
+
+            if not dry_run:
+                transaction.commit()
+            log.info(
+                "%s: %d orphaned files (%.1f MB)",
+                name,
+                deleted,
+                size / 1024 / 1024,
+            )
+
+    return deleted, size
+
+
+def sweep_orphaned_files_command():  # pragma: no cover
+    __doc__ = """ Delete blobs that are not referenced by any file field
+
+    Usage:
+      kotti-depot-gc <config_uri> [--storage <name>]... \
+          [--batch-size <n>] [--min-age <seconds>] [--dry-run]
+
+    Options:
+      -h --help                 Show this screen.
+      --storage <name>          The storage to sweep, all storages if omitted
+      --batch-size <n>          Number of blobs checked per transaction
+                                [default: 100]
+      --min-age <seconds>       Keep blobs that were modified more recently
+                                [default: 86400]
+      --dry-run                 Only report the number and size of the blobs
+                                that would be deleted
+    """
+
+    def sweep(args):
+        deleted, size = sweep_orphaned_files(
+            storages=args["--storage"],
+            batch_size=int(args["--batch-size"]),
+            min_age=int(args["--min-age"]),
+            dry_run=args["--dry-run"],
+        )
+        if args["--dry-run"]:
+            print(f"{deleted} blobs ({size / 1024 / 1024:.1f} MB) would be deleted.")
+        else:
+            print(f"Deleted {deleted} blobs, reclaimed {size / 1024 / 1024:.1f} MB.")
+
+    return command(sweep, __doc__)
+
+
+#: Maximum number of byte ranges served in a single response.  Requests for
+#: more ranges are answered with the whole file.
+MAX_BYTE_RANGES = 20
+
+_BYTE_RANGE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def parse_byte_ranges(
+    header: Optional[str], length: int
+) -> Optional[List[Tuple[int, int]]]:
+    """Parse the value of a ``Range`` header into a list of ``(start, stop)``
+    tuples (``stop`` is exclusive) for a file of ``length`` bytes.  Ranges
+    that can't be satisfied are left out.
+
+      >>> parse_byte_ranges('bytes=0-9, 20-, -5, 100-200', 50)
+      [(0, 10), (20, 50), (45, 50)]
+
+    :result: ``None`` if the header is missing or invalid or asks for more
+             than :data:`MAX_BYTE_RANGES` ranges.
+    :rtype: list of tuples or None
+    """
+
+    if not header or "=" not in header:
+        return None
+    unit, specs = header.split("=", 1)
+    specs = specs.split(",")
+    if unit.strip().lower() != "bytes" or len(specs) > MAX_BYTE_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        match = _BYTE_RANGE.match(spec)
+        if match is None or match.groups() == ("", ""):
+            return None
+        first, last = match.groups()
+        if not first:
+            start, stop = max(length - int(last), 0), length
+        else:
+            start = int(first)
+            stop = length if not last else min(int(last) + 1, length)
+            if last and int(last) < start:
+                return None
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+
+def _seekable_file(f) -> Optional[object]:
+    """Return an object with ``seek`` and ``read`` methods for the stored file
+    ``f``.  Depot's local and in memory files aren't seekable themselves, for
+    these the file object they read from is used.
+    """
+
+    if f.seekable():
+        return f
+    if hasattr(f, "_file"):
+        f.read(0)  # open the underlying file
+        if f._file is not None and f._file.seekable():
+            return f._file
+    return None
+
+
+def _read_ranges(f, ranges, block_size=_BLOCK_SIZE, boundary=None, headers=None):
+    """Yield the bytes of the ``ranges`` of the seekable file ``f``, in blocks
+    of at most ``block_size`` bytes.  If a ``boundary`` is given the ranges are
+    formatted as the parts of a ``multipart/byteranges`` body and
+    ``headers[i]`` is the header of part ``i``.
+    """
+
+    try:
+        for idx, (start, stop) in enumerate(ranges):
+            if boundary is not None:
+                yield headers[idx]
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                data = f.read(min(block_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+            if boundary is not None:
+                yield b"\r\n"
+        if boundary is not None:
+            yield b"--" + boundary + b"--\r\n"
+    finally:
+        f.close()
 
 
 class StoredFileResponse(Response):
@@ -426,7 +1696,7 @@ class StoredFileResponse(Response):
         f: MemoryStoredFile,
         request: Request,
         disposition: str = "attachment",
-        cache_max_age: int = 604800,
+        cache_max_age: int = CACHE_MAX_AGE,
         content_type: None = None,
         content_encoding: None = None,
     ) -> None:
@@ -476,6 +1746,7 @@ class StoredFileResponse(Response):
         if app_iter is None:
             app_iter = FileIter(f)
         self.app_iter = app_iter
+        self.stored_file = f
 
         # assignment of content_length must come after assignment of app_iter
         self.content_length = f.content_length
@@ -490,6 +1761,97 @@ class StoredFileResponse(Response):
         content_disposition = make_content_disposition(disposition, f.filename)
 
         self.content_disposition = content_disposition
+        self.accept_ranges = "bytes"
+
+    def app_iter_range(self, start: int, stop: int) -> Iterable[bytes]:
+        """Return an ``app_iter`` for the bytes from ``start`` to ``stop``
+        that seeks to ``start`` instead of reading the file up to there.
+        """
+
+        f = _seekable_file(self.stored_file)
+        if f is None:
+            return super().app_iter_range(start, stop)
+        return _read_ranges(f, [(start, stop)])
+
+    def conditional_response_app(self, environ, start_response):
+        """Extend WebOb's handling of ``Range`` headers, which only supports
+        a single range, with requests for multiple ranges.  These are
+        answered with a ``multipart/byteranges`` body.
+        """
+
+        req = BaseRequest(environ)
+        method = environ.get("REQUEST_METHOD", "GET")
+        header = req.headers.get("Range", "")
+        if (
+            "," not in header
+            or method not in ("GET", "HEAD")
+            or self.status_code != 200
+            or self.content_length is None
+            or self.content_range is not None
+            or self._not_modified(req)
+            or self not in req.if_range
+        ):
+            return super().conditional_response_app(environ, start_response)
+        ranges = parse_byte_ranges(header, self.content_length)
+        f = _seekable_file(self.stored_file) if ranges else None
+        if ranges is None or (ranges and f is None):
+            return super().conditional_response_app(environ, start_response)
+
+        content_type = self.headers["Content-Type"]
+        headerlist = [
+            (name, value)
+            for (name, value) in self._abs_headerlist(environ)
+            if name.lower() not in ("content-length", "content-type")
+        ]
+        if not ranges:
+            body = b"Requested range not satisfiable"
+            headerlist += [
+                ("Content-Type", "text/plain"),
+                ("Content-Length", str(len(body))),
+                ("Content-Range", str(ContentRange(None, None, self.content_length))),
+            ]
+            start_response("416 Requested Range Not Satisfiable", headerlist)
+            return [] if method == "HEAD" else [body]
+
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            headerlist += [
+                ("Content-Type", content_type),
+                ("Content-Length", str(stop - start)),
+                ("Content-Range", str(ContentRange(start, stop, self.content_length))),
+            ]
+            app_iter = _read_ranges(f, ranges)
+        else:
+            boundary = uuid.uuid4().hex.encode("ascii")
+            part_headers = [
+                b"--%s\r\nContent-Type: %s\r\nContent-Range: %s\r\n\r\n"
+                % (
+                    boundary,
+                    content_type.encode("latin-1"),
+                    str(ContentRange(start, stop, self.content_length)).encode(),
+                )
+                for (start, stop) in ranges
+            ]
+            # Each part ends with CRLF, the body with the closing delimiter
+            length = sum(len(header) for header in part_headers)
+            length += sum(stop - start + 2 for (start, stop) in ranges)
+            length += len(boundary) + 6
+            headerlist += [
+                ("Content-Type", f"multipart/byteranges; boundary={boundary.decode()}"),
+                ("Content-Length", str(length)),
+            ]
+            app_iter = _read_ranges(f, ranges, boundary=boundary, headers=part_headers)
+
+        start_response("206 Partial Content", headerlist)
+        if method == "HEAD":
+            f.close()
+            return []
+        return app_iter
+
+    def _not_modified(self, req: BaseRequest) -> bool:
+        """ Whether WebOb answers the request with ``304 Not Modified``. """
+
+        return not_modified(req, self.etag, self.last_modified)
 
     @staticmethod
     def _get_type_and_encoding(
@@ -510,14 +1872,60 @@ class StoredFileResponse(Response):
 
     @staticmethod
     def generate_etag(f: MemoryStoredFile) -> str:
+        content_hash = getattr(f, "content_hash", None)
+        if content_hash:
+            return f'"{content_hash}"'
         return f'"{f.last_modified}-{f.content_length}"'
 
 
+def not_modified(
+    request: BaseRequest, etag: Optional[str], last_modified: Optional[datetime]
+) -> bool:
+    """ Whether ``request`` is a conditional request that is answered with
+    ``304 Not Modified`` for a resource with the given (unquoted) ``etag`` and
+    ``last_modified`` date, following the rules of WebOb's conditional
+    responses.
+    """
+
+    if request.if_none_match and etag:
+        return etag in request.if_none_match
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def not_modified_response(request: Request, f) -> Optional[Response]:
+    """ Return a ``304 Not Modified`` response for a conditional ``request``
+    that can be answered from the metadata of the stored file ``f`` alone, or
+    ``None`` if the file must be served.
+
+    The validators are the same :class:`StoredFileResponse` sends, so neither
+    the file's data nor a full response is needed to revalidate it.
+    """
+
+    if not (request.if_none_match or request.if_modified_since):
+        return None
+    etag = StoredFileResponse.generate_etag(f)
+    last_modified = f.last_modified
+    if last_modified is not None:
+        # HTTP dates have a resolution of seconds
+        last_modified = parse_date(serialize_date(last_modified))
+    if not not_modified(request, etag[1:-1], last_modified):
+        return None
+
+    response = HTTPNotModified()
+    response.etag = etag
+    response.last_modified = last_modified
+    response.cache_expires = CACHE_MAX_AGE
+    response.cache_control.public = True
+    return response
+
+
 def uploaded_file_response(
     self: Request,
     uploaded_file: UploadedFile,
     disposition: str = "inline",
-    cache_max_age: int = 604800,
+    cache_max_age: int = CACHE_MAX_AGE,
 ) -> StoredFileResponse:
     return StoredFileResponse(
         uploaded_file.file, self, disposition=disposition, cache_max_age=cache_max_age
@@ -610,6 +2018,11 @@ class TweenFactory:
             response = HTTPMovedPermanently(public_url)
             return response
 
+        # revalidation requests are answered from the file's metadata
+        response = not_modified_response(request, f)
+        if response is not None:
+            return response
+
         # file is not directly accessible for user agents, serve it ourselves
         if path[-1] == "download":
             disposition = "attachment"
@@ -627,6 +2040,7 @@ def adjust_for_engine(conn: Connection, branch: bool) -> None:
         from sqlalchemy.dialects.mysql.base import LONGBLOB
 
         DBStoredFile.__table__.c.data.type = LONGBLOB()
+        BlobChunk.__table__.c.data.type = LONGBLOB()
 
     # sqlite's Unicode columns return a buffer which can't be encoded by
     # a json encoder. We have to convert to a unicode string so that the value
@@ -640,8 +2054,6 @@ def adjust_for_engine(conn: Connection, branch: bool) -> None:
         return self._upload_type.decode(value)
 
     if conn.engine.dialect.name == "sqlite":  # pragma: no cover
-        from depot.fields.sqlalchemy import UploadedFileField
-
         UploadedFileField.process_result_value = patched_processed_result_value
 
 
@@ -723,6 +2135,12 @@ def includeme(config: Configurator) -> None:
     objectevent_listeners[(ObjectInsert, DBStoredFile)].append(set_metadata)
     objectevent_listeners[(ObjectUpdate, DBStoredFile)].append(set_metadata)
 
+    # Keep track of released files that might be shared with other fields
+    event.listen(DBSession, "before_flush", _track_released_before_flush)
+    event.listen(DBSession, "after_flush_postexec", _track_released_after_flush)
+    event.listen(DBSession, "after_soft_rollback", _forget_released)
+    event.listen(DBSession, "before_commit", release_shared_files)
+
     # depot's _SQLAMutationTracker._session_committed is executed on
     # after_commit, that's too late for DBFileStorage to interact with the
     # session
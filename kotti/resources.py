@@ -9,6 +9,7 @@ Inheritance Diagram
 """
 import abc
 import datetime
+import hashlib
 import os
 import warnings
 from cgi import FieldStorage
@@ -21,17 +22,20 @@ from typing import Any
 from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 from depot.fields.sqlalchemy import UploadedFileField
 from depot.fields.sqlalchemy import _SQLAMutationTracker
 from depot.fields.upload import UploadedFile
 from pyramid.decorator import reify
+from pyramid.threadlocal import get_current_request
 from pyramid.traversal import resource_path
 from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy import Unicode
@@ -39,7 +43,9 @@ from sqlalchemy import UnicodeText
 from sqlalchemy import UniqueConstraint
 from sqlalchemy import bindparam
 from sqlalchemy import event
+from sqlalchemy import func
 from sqlalchemy import inspect
+from sqlalchemy import literal
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.declarative import DeclarativeMeta
@@ -48,17 +54,22 @@ from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.ext.orderinglist import OrderingList
 from sqlalchemy.ext.orderinglist import ordering_list
 from sqlalchemy.orm import backref
+from sqlalchemy.orm import lazyload
 from sqlalchemy.orm import object_mapper
 from sqlalchemy.orm import relation
+from sqlalchemy.orm import validates
 from sqlalchemy.orm.attributes import Event
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.scoping import scoped_session
 from sqlalchemy.sql import and_
+from sqlalchemy.sql import or_
 from sqlalchemy.sql import select
 from sqlalchemy.util import classproperty
 from sqlalchemy.util.langhelpers import _symbol
 from transaction import commit
 from zope.interface import implementer
+from zope.sqlalchemy import mark_changed
 
 from kotti import Base
 from kotti import DBSession
@@ -74,6 +85,7 @@ from kotti.interfaces import INode
 from kotti.migrate import stamp_heads
 from kotti.request import Request
 from kotti.security import PersistentACLMixin
+from kotti.security import invalidate_principal_caches
 from kotti.security import view_permitted
 from kotti.sqla import ACLType
 from kotti.sqla import JsonType
@@ -89,6 +101,30 @@ from kotti.util import camel_case_to_name
 from kotti.util import get_paste_items
 
 
+def hash_path(path: Optional[str]) -> Optional[str]:
+    """Compute the value of :attr:`Node.path_hash` for a given path.
+
+    :param path: A node's path, e.g. ``/a/b/``
+    :type path: str
+
+    :result: Hex digest of the path's MD5 hash or ``None``
+    :rtype: str
+    """
+
+    if path is None:
+        return None
+    return hashlib.md5(path.encode("utf-8")).hexdigest()
+
+
+def _paths_maintained() -> bool:
+    """Return whether :attr:`Node.path` is updated when nodes are renamed or
+    moved, which :mod:`kotti.events` sets up."""
+
+    from kotti.events import _set_path_for_new_name
+
+    return event.contains(Node.name, "set", _set_path_for_new_name)
+
+
 class ContainerMixin(MutableMapping):
     """Containers form the API of a Node that's used for subitem
     access and in traversal.
@@ -98,7 +134,11 @@ class ContainerMixin(MutableMapping):
         return iter(self.children)
 
     def __len__(self):
-        return len(self.keys())
+        if "_children" in self.__dict__ or self.id is None:
+            return len(self._children)
+        baked_query = bakery(lambda session: session.query(func.count(Node.id)))
+        baked_query += lambda q: q.filter(Node.parent_id == bindparam("parent_id"))
+        return baked_query(DBSession()).params(parent_id=self.id).scalar()
 
     def __setitem__(self, key: str, node: "Node") -> None:
         node.name = key
@@ -106,17 +146,25 @@ class ContainerMixin(MutableMapping):
         self.children.reorder()
 
     def __delitem__(self, key: str) -> None:
-        node = self[key]
-        self.children.remove(node)
-        DBSession.delete(node)
+        delete_subtree(self[key])
 
     def keys(self) -> List[str]:
-        """
+        """Only the names are queried, the children are not loaded unless
+        they have been loaded before.
+
         :result: children names
         :rtype: list
         """
 
-        return [child.name for child in self.children]
+        if "_children" in self.__dict__ or self.id is None:
+            return [child.name for child in self._children]
+        baked_query = bakery(lambda session: session.query(Node.name))
+        baked_query += lambda q: q.filter(
+            Node.parent_id == bindparam("parent_id")
+        ).order_by(Node.position)
+        return [
+            name for (name,) in baked_query(DBSession()).params(parent_id=self.id)
+        ]
 
     def values(self) -> OrderingList:
         return self.children
@@ -159,7 +207,26 @@ class ContainerMixin(MutableMapping):
                 raise KeyError(path)
 
         # We have a path with more than one element, so let's be a
-        # little clever about fetching the requested node:
+        # little clever about fetching the requested node.  Use the indexed
+        # path hash and only join the lineage for nodes whose paths have not
+        # been set (yet) or aren't maintained (see kotti.events):
+        if self.path is not None and _paths_maintained():
+            node_path = self.path + "/".join(path) + "/"
+            path_query = baked_query + (
+                lambda q: q.filter(
+                    Node.path_hash == bindparam("path_hash"),
+                    Node.path == bindparam("path"),
+                )
+            )
+            node = (
+                path_query(db_session)
+                .params(path_hash=hash_path(node_path), path=node_path)
+                .first()
+            )
+            if node is None:
+                raise KeyError(path)
+            return node
+
         nodes = Node.__table__
         conditions = [nodes.c.id == self.id]
         alias = nodes
@@ -199,7 +266,151 @@ class ContainerMixin(MutableMapping):
         :rtype: list
         """
 
-        return [c for c in self.children if request.has_permission(permission, c)]
+        from kotti.acl_index import view_filter
+
+        condition = view_filter(request, permission)
+        if condition is not None:
+            return (
+                DBSession.query(Node)
+                .filter(Node.parent_id == self.id, condition)
+                .order_by(Node.position)
+                .all()
+            )
+        return request.filter_permitted(self.children, permission)
+
+    def children_page(
+        self,
+        after: Optional[Tuple[int, int]] = None,
+        limit: int = 50,
+        permission: Optional[str] = None,
+        sort: str = "position",
+        request: Optional[Request] = None,
+    ) -> "List[Node]":
+        """Return one page of children, ordered by position.
+
+        Pages are selected by position and id (keyset pagination) instead of
+        by offset, so that loading a page of a container with many children
+        takes the same time no matter how deep into the container it is.
+        The id breaks ties between children that share a position.
+
+        :param after: ``(position, id)`` of the last child of the previous
+                      page, ``None`` for the first page
+        :type after: tuple
+
+        :param limit: Maximum number of children to return
+        :type limit: int
+
+        :param permission: If given, only children for which the user
+                           initiating the request has this permission are
+                           returned
+        :type permission: str
+
+        :param sort: ``position`` for ascending or ``-position`` for
+                     descending order
+        :type sort: str
+
+        :param request: current request, defaults to the current threadlocal
+                        request
+        :type request: :class:`kotti.request.Request`
+
+        :result: List of child nodes, which has less than ``limit`` items
+                 only if it is the last page
+        :rtype: list
+        """
+
+        from kotti.acl_index import view_filter
+
+        if sort not in ("position", "-position"):
+            raise ValueError(f"Unsupported sort order: {sort!r}")
+        if permission is not None and request is None:
+            request = get_current_request()
+
+        condition = None
+        if permission is not None:
+            condition = view_filter(request, permission)
+        if condition is not None:
+            query = DBSession.query(Node).filter(Node.parent_id == self.id, condition)
+            if sort == "position":
+                if after is not None:
+                    query = query.filter(
+                        or_(
+                            Node.position > after[0],
+                            and_(Node.position == after[0], Node.id > after[1]),
+                        )
+                    )
+                query = query.order_by(Node.position, Node.id)
+            else:
+                if after is not None:
+                    query = query.filter(
+                        or_(
+                            Node.position < after[0],
+                            and_(Node.position == after[0], Node.id < after[1]),
+                        )
+                    )
+                query = query.order_by(Node.position.desc(), Node.id.desc())
+            return query.limit(limit).all()
+
+        baked_query = bakery(lambda session: session.query(Node))
+        baked_query += lambda q: q.filter(Node.parent_id == bindparam("parent_id"))
+        if sort == "position":
+            after_query = baked_query + (
+                lambda q: q.filter(
+                    or_(
+                        Node.position > bindparam("position"),
+                        and_(
+                            Node.position == bindparam("position"),
+                            Node.id > bindparam("id"),
+                        ),
+                    )
+                )
+            )
+            baked_query += lambda q: q.order_by(Node.position, Node.id)
+            after_query += lambda q: q.order_by(Node.position, Node.id)
+        else:
+            after_query = baked_query + (
+                lambda q: q.filter(
+                    or_(
+                        Node.position < bindparam("position"),
+                        and_(
+                            Node.position == bindparam("position"),
+                            Node.id < bindparam("id"),
+                        ),
+                    )
+                )
+            )
+            baked_query += lambda q: q.order_by(Node.position.desc(), Node.id.desc())
+            after_query += lambda q: q.order_by(Node.position.desc(), Node.id.desc())
+        baked_query += lambda q: q.limit(bindparam("limit"))
+        after_query += lambda q: q.limit(bindparam("limit"))
+
+        page = []
+        while len(page) < limit:
+            if after is None:
+                batch = (
+                    baked_query(DBSession())
+                    .params(parent_id=self.id, limit=limit)
+                    .all()
+                )
+            else:
+                batch = (
+                    after_query(DBSession())
+                    .params(
+                        parent_id=self.id,
+                        position=after[0],
+                        id=after[1],
+                        limit=limit,
+                    )
+                    .all()
+                )
+            if permission is not None:
+                permitted = request.filter_permitted(batch, permission)
+            else:
+                permitted = batch
+            page.extend(permitted[: limit - len(page)])
+            if len(batch) < limit:
+                break
+            after = (batch[-1].position, batch[-1].id)
+        return page
 
 
 class LocalGroup(Base):
@@ -245,6 +456,30 @@ class LocalGroup(Base):
         )
 
 
+class ViewACE(Base):
+    """Entry of the materialized index of effective ``view`` permissions.  It
+    states that ``principal_name`` is allowed or denied to view a node, unless
+    an entry with a lower ``rank`` for another principal of the user decides
+    otherwise.  The index is maintained by :mod:`kotti.acl_index` if the
+    ``kotti.acl_index`` setting is enabled.
+    """
+
+    __tablename__ = "view_aces"
+
+    #: ID of the node
+    #: (:class:`sqlalchemy.types.Integer`)
+    node_id = Column(ForeignKey("nodes.id", ondelete="CASCADE"), primary_key=True)
+    #: Name of the principal (user, group or role)
+    #: (:class:`sqlalchemy.types.Unicode`)
+    principal_name = Column(Unicode(100), primary_key=True)
+    #: Precedence of the entry, lower ranks win
+    #: (:class:`sqlalchemy.types.Integer`)
+    rank = Column(Integer, nullable=False)
+    #: Whether the principal is allowed or denied to view the node
+    #: (:class:`sqlalchemy.types.Boolean`)
+    allowed = Column(Boolean, nullable=False)
+
+
 class NodeMeta(DeclarativeMeta, abc.ABCMeta):
     """ """
 
@@ -253,7 +488,10 @@ class NodeMeta(DeclarativeMeta, abc.ABCMeta):
 class Node(Base, ContainerMixin, PersistentACLMixin, metaclass=NodeMeta):
     """Basic node in the persistance hierarchy."""
 
-    __table_args__ = (UniqueConstraint("parent_id", "name"),)
+    __table_args__ = (
+        UniqueConstraint("parent_id", "name"),
+        Index("ix_nodes_parent_id_position", "parent_id", "position", "id"),
+    )
     __mapper_args__ = dict(
         polymorphic_on="type", polymorphic_identity="node", with_polymorphic="*"
     )
@@ -283,6 +521,10 @@ class Node(Base, ContainerMixin, PersistentACLMixin, metaclass=NodeMeta):
     #: The path can be used to efficiently filter for child objects
     #: (:class:`sqlalchemy.types.Unicode`).
     path = Column(Unicode(2000), index=True)
+    #: Fixed width hash of :attr:`path`, which is kept in sync automatically.
+    #: Its index is used for path lookups, because the index on ``path`` is
+    #: not available on all databases (:class:`sqlalchemy.types.String`).
+    path_hash = Column(String(32), index=True)
 
     parent = relation(
         "Node",
@@ -296,11 +538,17 @@ class Node(Base, ContainerMixin, PersistentACLMixin, metaclass=NodeMeta):
     )
 
     local_groups = relation(
-        LocalGroup, backref=backref("node"), cascade="all", lazy="joined"
+        LocalGroup, backref=backref("node"), cascade="all", lazy="selectin"
     )
 
     __hash__ = Base.__hash__
 
+    # noinspection PyUnusedLocal
+    @validates("path")
+    def _validate_path(self, key: str, value: Optional[str]) -> Optional[str]:
+        self.path_hash = hash_path(value)
+        return value
+
     def __init__(
         self,
         name: str = None,
@@ -353,9 +601,9 @@ class Node(Base, ContainerMixin, PersistentACLMixin, metaclass=NodeMeta):
     )
 
     def clear(self) -> None:
+        """Delete all children of the node (and their descendants)."""
 
-        for node in DBSession.query(Node).filter(Node.parent == self):
-            DBSession.delete(node)
+        delete_subtree(self, include_self=False)
 
     def copy(self, **kwargs) -> "Node":
         """
@@ -857,6 +1105,363 @@ class File(SaveDataMixin, Content):
     )
 
 
+#: Number of nodes that :func:`delete_subtree` and :func:`copy_subtree` load
+#: per query to notify the event listeners.
+BULK_BATCH_SIZE = 500
+
+# Relationships that are handled by :func:`delete_subtree` and
+# :func:`copy_subtree`.
+_bulk_relationships = {"parent", "_children", "local_groups", "_tags"}
+
+# Implementations of ``copy`` that :func:`copy_subtree` reproduces.
+_bulk_copy_methods = {Node.copy, Content.copy, SaveDataMixin.copy}
+
+
+def _bulk_supported(node: Node, copy: bool = False) -> bool:
+    from kotti import events
+
+    # The subtree is selected by path, which is only maintained by the
+    # handlers in kotti.events.
+    if not events._WIRED_SQLALCHMEY or node.id is None or node.path is None:
+        return False
+
+    # Add-ons may map classes with relationships that cascade to tables we
+    # don't know about or that customize copying.  Let the ORM handle those.
+    for mapper in inspect(Node).self_and_descendants:
+        for prop in mapper.relationships:
+            if prop.key not in _bulk_relationships and (copy or prop.cascade.delete):
+                return False
+        cls = mapper.class_
+        if copy and (
+            cls.copy not in _bulk_copy_methods
+            or cls.copy_properties_blacklist != Node.copy_properties_blacklist
+        ):
+            return False
+    return True
+
+
+def delete_subtree(node: Node, include_self: bool = True) -> None:
+    """Delete a node and all of its descendants.
+
+    Instead of relying on the ORM's cascades, which load and delete every
+    descendant, its local groups and tag assignments one by one, the rows are
+    removed with a few set-based ``DELETE`` statements that select the
+    subtree with the :func:`~kotti.traversal.tree_engine`.
+    :class:`~kotti.events.ObjectDelete` and
+    :class:`~kotti.events.ObjectAfterDelete` events are still sent for every
+    deleted node, which are loaded in batches of :data:`BULK_BATCH_SIZE` for
+    this.  Blobs of deleted files are removed from the depot and tags that
+    aren't assigned to any content anymore are deleted when the transaction
+    is committed.
+
+    :param node: Root of the subtree to delete.
+    :type node: :class:`Node`
+
+    :param include_self: Delete ``node`` itself or only its descendants.
+    :type include_self: bool
+    """
+
+    from kotti import acl_index
+    from kotti import events
+    from kotti.events import ObjectDelete
+    from kotti.events import delete_orphaned_tags_later
+    from kotti.events import notify
+    from kotti.filedepot import release_files
+    from kotti.traversal import tree_engine
+
+    session = DBSession()
+    session.flush()
+
+    if not _bulk_supported(node):
+        children = list(node.children)
+        if include_self:
+            if node.parent is not None:
+                node.parent.children.remove(node)
+            children = [node]
+        for child in children:
+            session.delete(child)
+        return
+
+    nodes = Node.__table__
+    condition = tree_engine().in_subtree(nodes.c.id, node)
+    if not include_self:
+        condition = and_(condition, nodes.c.id != node.id)
+    rows = session.execute(select([nodes.c.id, nodes.c.path]).where(condition))
+    paths = dict(rows.fetchall())
+    if not paths:
+        return
+    ids = list(paths)
+    parent = node if not include_self else node.parent
+
+    request = get_current_request()
+    deleted = []
+    for offset in range(0, len(ids), BULK_BATCH_SIZE):
+        batch = (
+            session.query(Node)
+            .options(lazyload(Node.local_groups))
+            .filter(Node.id.in_(ids[offset : offset + BULK_BATCH_SIZE]))
+            .all()
+        )
+        for obj in batch:
+            notify(ObjectDelete(obj, request))
+            for prop in _SQLAMutationTracker.mapped_entities.get(obj.__class__, ()):
+                release_files(session, obj, prop)
+        deleted.extend(batch)
+
+    subtree_ids = select([nodes.c.id]).where(condition)
+    tags_to_contents = TagsToContents.__table__
+    tagged = tags_to_contents.c.content_id.in_(subtree_ids)
+    tag_ids = [
+        tag_id
+        for (tag_id,) in session.execute(
+            select([tags_to_contents.c.tag_id]).where(tagged).distinct()
+        )
+    ]
+    if tag_ids:
+        session.execute(tags_to_contents.delete().where(tagged))
+        delete_orphaned_tags_later(tag_ids, session)
+    local_groups = LocalGroup.__table__
+    result = session.execute(
+        local_groups.delete().where(local_groups.c.node_id.in_(subtree_ids))
+    )
+    if result.rowcount:
+        invalidate_principal_caches()
+    if acl_index.enabled:
+        view_aces = ViewACE.__table__
+        session.execute(
+            view_aces.delete().where(view_aces.c.node_id.in_(subtree_ids))
+        )
+
+    # Delete the rows from the tables of all Node subclasses first...
+    tables = {mapper.local_table for mapper in inspect(Node).self_and_descendants}
+    for table in reversed(metadata.sorted_tables):
+        if table in tables and table is not nodes:
+            [pk] = table.primary_key.columns
+            session.execute(table.delete().where(pk.in_(subtree_ids)))
+
+    # ... and the nodes themselves last, one level at a time and deepest
+    # first, so that no foreign key constraint on ``parent_id`` is violated
+    # on databases that check them for every row.
+    levels = {}
+    for node_id, path in paths.items():
+        levels.setdefault(path.count("/"), []).append(node_id)
+    for level in sorted(levels, reverse=True):
+        level_ids = levels[level]
+        for offset in range(0, len(level_ids), BULK_BATCH_SIZE):
+            batch_ids = level_ids[offset : offset + BULK_BATCH_SIZE]
+            session.execute(nodes.delete().where(nodes.c.id.in_(batch_ids)))
+    mark_changed(session)
+
+    # Send the ObjectAfterDelete events like the ORM's after_delete hook.
+    connection = session.connection()
+    for obj in deleted:
+        events._after_delete(inspect(obj).mapper, connection, obj)
+
+    # Remove everything that was deleted from the session and from the
+    # (loaded) children collection of the subtree's parent.
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, LocalGroup):
+            owner_id = obj.__dict__.get("node_id")
+        elif isinstance(obj, TagsToContents):
+            owner_id = obj.__dict__.get("content_id")
+        else:
+            continue
+        if owner_id in paths:
+            session.expunge(obj)
+    for obj in deleted:
+        if obj in session:
+            session.expunge(obj)
+
+    if parent is not None and "_children" in parent.__dict__:
+        set_committed_value(
+            parent,
+            "_children",
+            [child for child in parent._children if child.id not in paths],
+        )
+
+
+def copy_subtree(node: Node, parent: Node, name: str) -> Node:
+    """Copy a node and all of its descendants into ``parent``.
+
+    This is the equivalent of ``parent[name] = node.copy()``.  Instead of
+    loading and copying every descendant in Python, the rows are copied with
+    one ``INSERT ... SELECT`` statement per table (and per level of the
+    subtree for the ``nodes`` table) that rewrites the paths of the copies.
+    Like with :meth:`Node.copy`, tag assignments are copied, local groups
+    aren't.  Files are not duplicated, the copies reference the same depot
+    files as the originals (see :func:`kotti.filedepot.share_files`).
+    :class:`~kotti.events.ObjectInsert` events are sent for every copy, which
+    are loaded in batches of :data:`BULK_BATCH_SIZE` for this.
+
+    :param node: Root of the subtree to copy.
+    :type node: :class:`Node`
+
+    :param parent: The container to add the copy to.
+    :type parent: :class:`Node`
+
+    :param name: Name of the copy in ``parent``.
+    :type name: str
+
+    :result: The copy of ``node``.
+    :rtype: :class:`Node`
+    """
+
+    from kotti import acl_index
+    from kotti.events import notify_inserted
+    from kotti.filedepot import share_files
+    from kotti.traversal import invalidate_path_cache
+    from kotti.traversal import tree_engine
+
+    session = DBSession()
+    session.flush()
+
+    if not _bulk_supported(node, copy=True) or not _bulk_supported(parent):
+        copy = node.copy()
+        parent[name] = copy
+        return copy
+
+    nodes = Node.__table__
+    engine = tree_engine()
+    old_path = node.path
+    new_path = f"{parent.path}{name}/"
+
+    def subtree(alias):
+        # The new path is below the old one when a node is pasted into one
+        # of its descendants.  Leave the copies out in that case.
+        return and_(
+            engine.in_subtree(alias.c.id, node),
+            ~alias.c.path.startswith(new_path, autoescape=True),
+        )
+
+    def moved(path):
+        return literal(new_path, Unicode) + func.substr(path, len(old_path) + 1)
+
+    def copy_of(old, new):
+        path = moved(old.c.path)
+        return and_(new.c.path_hash == func.md5(path), new.c.path == path)
+
+    levels = {}
+    for node_id, path in session.execute(
+        select([nodes.c.id, nodes.c.path]).where(subtree(nodes))
+    ):
+        if node_id != node.id:
+            levels.setdefault(path.count("/"), []).append(node_id)
+
+    # Copy the node itself into its new parent...
+    columns = [column for column in nodes.c if column is not nodes.c.id]
+    names = [column.name for column in columns]
+    position = session.execute(
+        select([func.max(nodes.c.position)]).where(nodes.c.parent_id == parent.id)
+    ).scalar()
+    values = {
+        "parent_id": parent.id,
+        "name": name,
+        "position": 0 if position is None else position + 1,
+        "path": new_path,
+        "path_hash": hash_path(new_path),
+    }
+    session.execute(
+        nodes.insert().from_select(
+            names,
+            select(
+                [
+                    literal(values[c.name], c.type) if c.name in values else c
+                    for c in columns
+                ]
+            ).where(nodes.c.id == node.id),
+        )
+    )
+
+    # ... then its descendants, one level at a time so that the copies of
+    # their parents exist already ...
+    old, old_parent, new_parent = nodes.alias(), nodes.alias(), nodes.alias()
+    values = {
+        "parent_id": new_parent.c.id,
+        "path": moved(old.c.path),
+        "path_hash": func.md5(moved(old.c.path)),
+    }
+    rows = select([values.get(c.name, old.c[c.name]) for c in columns]).select_from(
+        old.join(old_parent, old.c.parent_id == old_parent.c.id).join(
+            new_parent, copy_of(old_parent, new_parent)
+        )
+    )
+    for level in sorted(levels):
+        level_ids = levels[level]
+        for offset in range(0, len(level_ids), BULK_BATCH_SIZE):
+            batch_ids = level_ids[offset : offset + BULK_BATCH_SIZE]
+            session.execute(
+                nodes.insert().from_select(
+                    names, rows.where(old.c.id.in_(batch_ids))
+                )
+            )
+
+    # ... and finally the rows of all Node subclasses and the tag assignments.
+    old, new = nodes.alias(), nodes.alias()
+    tables = {mapper.local_table for mapper in inspect(Node).self_and_descendants}
+    for table in metadata.sorted_tables:
+        if table in tables and table is not nodes:
+            [pk] = table.primary_key.columns
+            key = pk
+        elif table is TagsToContents.__table__:
+            key = table.c.content_id
+        else:
+            continue
+        session.execute(
+            table.insert().from_select(
+                [c.name for c in table.c],
+                select([new.c.id if c is key else c for c in table.c])
+                .select_from(
+                    table.join(old, old.c.id == key).join(new, copy_of(old, new))
+                )
+                .where(subtree(old)),
+            )
+        )
+
+    copy = (
+        session.query(Node)
+        .filter(Node.path_hash == hash_path(new_path), Node.path == new_path)
+        .one()
+    )
+    copies = select([nodes.c.id]).where(engine.in_subtree(nodes.c.id, copy))
+
+    # Add references to the depot files of the copies.
+    files = []
+    columns = set()
+    for cls, props in _SQLAMutationTracker.mapped_entities.items():
+        if not issubclass(cls, Node):
+            continue
+        for prop in props:
+            [column] = inspect(cls).get_property(prop).columns
+            if column in columns:
+                continue
+            columns.add(column)
+            [pk] = column.table.primary_key.columns
+            for (value,) in session.execute(
+                select([column]).where(pk.in_(copies))
+            ):
+                if value is not None:
+                    files.extend(value.files)
+    if files:
+        share_files(files)
+    mark_changed(session)
+
+    ids = [node_id for (node_id,) in session.execute(copies)]
+    request = get_current_request()
+    for offset in range(0, len(ids), BULK_BATCH_SIZE):
+        batch = (
+            session.query(Node)
+            .filter(Node.id.in_(ids[offset : offset + BULK_BATCH_SIZE]))
+            .all()
+        )
+        notify_inserted(batch, request)
+    invalidate_path_cache(new_path)
+
+    acl_index.update([copy.id])
+    if "_children" in parent.__dict__:
+        set_committed_value(parent, "_children", list(parent._children) + [copy])
+    return copy
+
+
 def get_root(request: Optional[Request] = None) -> Node:
     """Call the function defined by the ``kotti.root_factory`` setting and
        return its result.
@@ -929,6 +1534,69 @@ class DefaultRootCache:
 default_get_root = DefaultRootCache()
 
 
+#: Strategies for loading the columns of :class:`Node` subclasses that can be
+#: selected with the ``kotti.polymorphic_loading`` setting
+polymorphic_loading_strategies = ("joined", "selectin", "lazy")
+
+
+def configure_polymorphic_loading(strategy: str) -> None:
+    """Configure how queries for :class:`Node` load the columns of subclasses.
+
+    ``joined`` (default)
+        Queries for :class:`Node` join the tables of *all* subclasses, i.e.
+        every installed content type adds an outer join to them.
+
+    ``selectin``
+        Queries for :class:`Node` only select the ``nodes`` table.  The
+        columns of subclasses are loaded with one additional query per
+        subclass that occurs in the result.
+
+    ``lazy``
+        Queries for :class:`Node` only select the ``nodes`` table.  The
+        columns of subclasses are loaded per object when they are accessed.
+
+    Queries that use ``with_polymorphic`` explicitly are not affected.  Only
+    subclasses that exist when this is called are configured, which is why
+    :func:`initialize_sql` calls it after all add-ons have been included.
+
+    SQLAlchemy only offers to set the mapper's ``with_polymorphic`` when the
+    class is mapped, i.e. before the settings are known.  The mapper is
+    therefore changed with the private ``Mapper._set_with_polymorphic`` of
+    SQLAlchemy 1.4, which ``setup.py`` pins.  ``joined`` doesn't need it,
+    other strategies raise :class:`NotImplementedError` if it's missing.
+
+    :param strategy: One of :data:`polymorphic_loading_strategies`
+    :type strategy: str
+    """
+
+    if strategy not in polymorphic_loading_strategies:
+        raise ValueError(f"Unknown polymorphic loading strategy: {strategy!r}")
+
+    mapper = inspect(Node)
+    with_polymorphic = ("*", None) if strategy == "joined" else None
+    if mapper.with_polymorphic != with_polymorphic:
+        set_with_polymorphic = getattr(mapper, "_set_with_polymorphic", None)
+        if set_with_polymorphic is None:
+            raise NotImplementedError(
+                f"The {strategy!r} polymorphic loading strategy is not "
+                f"supported with this version of SQLAlchemy"
+            )
+        set_with_polymorphic("*" if strategy == "joined" else None)
+    for sub_mapper in mapper.self_and_descendants:
+        if sub_mapper is not mapper:
+            sub_mapper.polymorphic_load = "selectin" if strategy == "selectin" else None
+
+    # Statements that have been compiled already don't know about the change:
+    bakery.cache.clear()
+    if metadata.bind is not None:
+        metadata.bind.clear_compiled_cache()
+
+
+# noinspection PyUnusedLocal
+def _register_sqlite_functions(dbapi_connection, connection_record) -> None:
+    dbapi_connection.create_function("md5", 1, hash_path)
+
+
 def _adjust_for_engine(engine: Engine) -> None:
     if engine.dialect.name == "mysql":  # pragma: no cover
         # We disable the Node.path index for Mysql; in some conditions
@@ -937,9 +1605,16 @@ def _adjust_for_engine(engine: Engine) -> None:
         Node.__table__.indexes = {
             index for index in Node.__table__.indexes if index.name != "ix_nodes_path"
         }
+    elif engine.dialect.name == "sqlite":
+        # PostgreSQL and MySQL have a builtin ``md5()`` function, which is used
+        # to maintain Node.path_hash in bulk updates.  Provide it for SQLite,
+        # too.
+        if not event.contains(engine, "connect", _register_sqlite_functions):
+            event.listen(engine, "connect", _register_sqlite_functions)
 
 
 def initialize_sql(engine: Engine, drop_all: bool = False) -> scoped_session:
+    _adjust_for_engine(engine)
     DBSession.registry.clear()
     DBSession.configure(bind=engine)
     metadata.bind = engine
@@ -954,7 +1629,7 @@ def initialize_sql(engine: Engine, drop_all: bool = False) -> scoped_session:
     if tables:
         tables = [metadata.tables[name] for name in tables.split()]
 
-    _adjust_for_engine(engine)
+    configure_polymorphic_loading(settings["kotti.polymorphic_loading"])
 
     # Allow migrations to set the 'head' stamp in case the database is
     # initialized freshly:
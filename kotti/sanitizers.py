@@ -136,14 +136,29 @@ def _setup_listeners(settings):
         _class = DottedNameResolver().resolve(classname)
 
         def _create_handler(attributename, sanitizers):
+            def sanitize_value(value):
+                for sanitizer_name in sanitizers.split(","):
+                    value = settings["kotti.sanitizers"][sanitizer_name](value)
+                return value
+
             def handler(event):
                 value = getattr(event.object, attributename)
                 if value is None:
                     return
-                for sanitizer_name in sanitizers.split(","):
-                    value = settings["kotti.sanitizers"][sanitizer_name](value)
-                setattr(event.object, attributename, value)
-
+                setattr(event.object, attributename, sanitize_value(value))
+
+            def batch(event):
+                # Sanitize equal values, e.g. empty bodies, only once.
+                sanitized = {}
+                for obj in event.objects:
+                    value = getattr(obj, attributename)
+                    if value is None:
+                        continue
+                    if value not in sanitized:
+                        sanitized[value] = sanitize_value(value)
+                    setattr(obj, attributename, sanitized[value])
+
+            handler.batch = batch
             return handler
 
         objectevent_listeners[(ObjectInsert, _class)].append(
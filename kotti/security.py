@@ -1,6 +1,7 @@
 from collections.abc import MutableMapping
 from contextlib import contextmanager
 from datetime import datetime
+from itertools import chain
 from typing import Dict
 from typing import Iterable
 from typing import Iterator
@@ -14,13 +15,17 @@ import bcrypt
 from pyramid.location import lineage
 from pyramid.security import PermitsResult
 from pyramid.security import view_execution_permitted
+from repoze.lru import ExpiringLRUCache
 from sqlalchemy import Boolean
 from sqlalchemy import Column
 from sqlalchemy import DateTime
 from sqlalchemy import Integer
 from sqlalchemy import Unicode
 from sqlalchemy import bindparam
+from sqlalchemy import event
 from sqlalchemy import func
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.query import Query
 from sqlalchemy.sql.expression import and_
@@ -240,6 +245,9 @@ def reset() -> None:
     reset_roles()
     reset_sharing_roles()
     reset_user_management_roles()
+    for cache in (principal_groups_cache, group_closure_cache):
+        if cache is not None:
+            cache.clear()
 
 
 class PersistentACLMixin:
@@ -264,6 +272,41 @@ def _cachekey_list_groups_raw(
     return name, context_id
 
 
+def load_local_groups(nodes: Iterable[object]) -> None:
+    """Load the local groups of all ``nodes`` whose local groups have not been
+    loaded yet with a single query.
+
+    Queries for :class:`~kotti.resources.Node` load local groups with an
+    additional query per result, unless told otherwise.  Use this function
+    before accessing the local groups of nodes that have been loaded
+    separately, e.g. the items of a lineage.
+    """
+
+    from kotti.resources import LocalGroup
+    from kotti.resources import Node
+
+    unloaded = {}
+    for node in nodes:
+        if (
+            isinstance(node, Node)
+            and "local_groups" not in node.__dict__
+            and inspect(node).has_identity
+        ):
+            unloaded[node.id] = node
+    if not unloaded:
+        return
+
+    local_groups = {node_id: [] for node_id in unloaded}
+    for local_group in (
+        DBSession.query(LocalGroup)
+        .filter(LocalGroup.node_id.in_(list(unloaded)))
+        .order_by(LocalGroup.id)
+    ):
+        local_groups[local_group.node_id].append(local_group)
+    for node_id, node in unloaded.items():
+        set_committed_value(node, "local_groups", local_groups[node_id])
+
+
 @request_cache(_cachekey_list_groups_raw)
 def list_groups_raw(name, context):
     """A set of group names in given ``context`` for ``name``.
@@ -275,6 +318,7 @@ def list_groups_raw(name, context):
     from kotti.resources import Node
 
     if isinstance(context, Node):
+        load_local_groups([context])
         return {
             r.group_name for r in context.local_groups if r.principal_name == name
         }
@@ -310,19 +354,28 @@ def list_groups_ext(name, context=None, _seen=None, _inherited=None):
     recursing = _inherited is not None
     _inherited = _inherited or set()
 
+    cache_key = None
+    if not recursing and _seen is None:
+        cache_key = _group_closure_key(name, context)
+        if cache_key is not None:
+            cached = group_closure_cache.get(cache_key)
+            if cached is not None:
+                return list(cached[0]), list(cached[1])
+
     # Add groups from principal db:
-    principal = get_principals().get(name)
-    if principal is not None:
-        groups.update(principal.groups)
+    principal_groups = _principal_groups(name)
+    if principal_groups is not None:
+        groups.update(principal_groups)
         if context is not None or (context is None and _seen is not None):
-            _inherited.update(principal.groups)
+            _inherited.update(principal_groups)
 
     if _seen is None:
         _seen = {name}
 
     # Add local groups:
     if context is not None:
-        items = lineage(context)
+        items = list(lineage(context))
+        load_local_groups(items)
         for idx, item in enumerate(items):
             group_names = [i for i in list_groups_raw(name, item) if i not in _seen]
             groups.update(group_names)
@@ -336,9 +389,118 @@ def list_groups_ext(name, context=None, _seen=None, _inherited=None):
         groups.update(g)
         _inherited.update(i)
 
+    if cache_key is not None:
+        group_closure_cache.put(cache_key, (tuple(groups), tuple(_inherited)))
     return list(groups), list(_inherited)
 
 
+#: Process wide caches for :func:`list_groups_ext`, which are configured by
+#: :func:`includeme` from the ``kotti.principal_cache_size`` and
+#: ``kotti.principal_cache_timeout`` settings and are ``None`` if disabled.
+#: ``principal_groups_cache`` maps principal names to the groups that are
+#: assigned to them in the principals database (or ``None`` for unknown
+#: principals), ``group_closure_cache`` maps principal names and contexts to
+#: the result of :func:`list_groups_ext`.  Changes only clear the caches of
+#: the process that makes them, other processes keep using cached groups
+#: until they expire.
+principal_groups_cache = None
+group_closure_cache = None
+
+_PRINCIPALS_CHANGED_KEY = "kotti.security.principals_changed"
+_marker = object()
+
+
+def _cacheable_session() -> bool:
+    """Results may only be cached process wide if they don't depend on
+    changes of the current transaction, which aren't visible to others."""
+
+    session = DBSession()
+    return not (
+        session.info.get(_PRINCIPALS_CHANGED_KEY)
+        or session.new
+        or session.dirty
+        or session.deleted
+    )
+
+
+def _principal_groups(name: str) -> Optional[Tuple[str, ...]]:
+    use_cache = principal_groups_cache is not None and _cacheable_session()
+    if use_cache:
+        groups = principal_groups_cache.get(name, _marker)
+        if groups is not _marker:
+            return groups
+
+    principal = get_principals().get(name)
+    groups = tuple(principal.groups) if principal is not None else None
+    if use_cache:
+        principal_groups_cache.put(name, groups)
+    return groups
+
+
+def _group_closure_key(name: str, context: object) -> Optional[Tuple]:
+    from kotti.resources import Node
+
+    if group_closure_cache is None:
+        return None
+    if context is None:
+        context_key = None
+    elif (
+        isinstance(context, Node)
+        and context.path is not None
+        and inspect(context).has_identity
+    ):
+        # The path is part of the key, because moving a node changes the
+        # local groups that it inherits.
+        context_key = (context.id, context.path)
+    else:
+        return None
+    if not _cacheable_session():
+        return None
+    return name, context_key
+
+
+def invalidate_principal_caches() -> None:
+    """Clear the process wide caches of group assignments.  Flushing changed
+    group memberships or local groups does this automatically, call it after
+    changing them with bulk statements.  Requests that read the old groups
+    meanwhile may fill the caches again, which are therefore cleared once
+    more after the commit or rollback.
+    """
+
+    DBSession().info[_PRINCIPALS_CHANGED_KEY] = True
+    for cache in (principal_groups_cache, group_closure_cache):
+        if cache is not None:
+            cache.clear()
+
+
+# noinspection PyUnusedLocal
+def _before_flush(session, flush_context, instances):
+    from kotti.resources import LocalGroup
+
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, LocalGroup) or (
+            isinstance(obj, Principal) and _groups_changed(session, obj)
+        ):
+            invalidate_principal_caches()
+            break
+
+
+def _groups_changed(session, principal):
+    # Other changes to principals, e.g. of the last login date on every
+    # login, don't affect the caches.
+    if principal in session.dirty:
+        return inspect(principal).attrs.groups.history.has_changes()
+    return True
+
+
+# noinspection PyUnusedLocal
+def _after_transaction(session, *args):
+    if session.info.pop(_PRINCIPALS_CHANGED_KEY, False):
+        for cache in (principal_groups_cache, group_closure_cache):
+            if cache is not None:
+                cache.clear()
+
+
 def set_groups(name: str, context: "Node", groups_to_set: Iterable[str] = ()) -> None:
     """Set the list of groups for principal with given ``name`` and in
     given ``context``.
@@ -419,7 +581,8 @@ def principals_with_local_roles(
     items = [context]
 
     if inherit:
-        items = lineage(context)
+        items = list(lineage(context))
+    load_local_groups(items)
 
     for item in items:
         principals.update(
@@ -572,3 +735,28 @@ class Principals(MutableMapping):
 
 def principals_factory() -> Principals:
     return Principals()
+
+
+def includeme(config):
+    """Pyramid includeme hook.
+
+    :param config: app config
+    :type config: :class:`pyramid.config.Configurator`
+    """
+
+    global principal_groups_cache, group_closure_cache
+
+    settings = config.get_settings()
+    size = int(settings["kotti.principal_cache_size"])
+    if size > 0:
+        timeout = int(settings["kotti.principal_cache_timeout"])
+        principal_groups_cache = ExpiringLRUCache(size, default_timeout=timeout)
+        group_closure_cache = ExpiringLRUCache(size, default_timeout=timeout)
+    else:
+        principal_groups_cache = group_closure_cache = None
+
+    if not event.contains(DBSession, "before_flush", _before_flush):
+        event.listen(DBSession, "before_flush", _before_flush)
+    for name in ("after_commit", "after_rollback"):
+        if not event.contains(DBSession, name, _after_transaction):
+            event.listen(DBSession, name, _after_transaction)
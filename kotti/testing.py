@@ -46,6 +46,9 @@ class DummyRequest(testing.DummyRequest):
     user = None
     referrer = None
 
+    def filter_permitted(self, nodes, permission):
+        return [node for node in nodes if self.has_permission(permission, node)]
+
     @staticmethod
     def is_response(ob):
         return (
@@ -22,6 +22,7 @@ Fixture dependencies
       "db_session" -> "browser";
       "db_session" -> "filedepot";
       "db_session" -> "root";
+      "db_session" -> "sql_statements";
       "depot_tween" -> "webtest";
       "dummy_mailer" -> "app";
       "dummy_mailer";
@@ -206,6 +207,37 @@ def db_session(config, content, connection):
     transaction.abort()
 
 
+@fixture
+def sql_statements(db_session):
+    """returns a context manager that records the SQL statements executed
+    in its block::
+
+        with sql_statements() as statements:
+            root.keys()
+        assert len(statements) == 1
+    """
+    from contextlib import contextmanager
+
+    from sqlalchemy import event
+
+    engine = db_session.get_bind().engine
+
+    @contextmanager
+    def record():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    return record
+
+
 @fixture
 def dummy_request(config, request, monkeypatch):
     """returns a dummy request object after registering it as
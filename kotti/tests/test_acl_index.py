@@ -0,0 +1,210 @@
+from pytest import fixture
+
+from kotti.testing import DummyRequest
+
+
+@fixture
+def acl_index(config, db_session):
+    from kotti import acl_index
+
+    config.get_settings()["kotti.acl_index"] = "true"
+    acl_index.includeme(config)
+    acl_index.refresh()
+    yield acl_index
+    config.get_settings()["kotti.acl_index"] = "false"
+    acl_index.includeme(config)
+
+
+@fixture
+def tree(db_session, root, events):
+    from pyramid.security import ALL_PERMISSIONS
+    from pyramid.security import Allow
+    from pyramid.security import Deny
+    from pyramid.security import Everyone
+
+    from kotti.resources import Content
+    from kotti.security import get_principals
+    from kotti.security import set_groups
+
+    principals = get_principals()
+    principals["bob"] = {"name": "bob", "title": "Bob"}
+    principals["alice"] = {"name": "alice", "title": "Alice"}
+    principals["group:staff"] = {"name": "group:staff", "title": "Staff"}
+    principals["alice"].groups = ["group:staff"]
+
+    root["private"] = Content(
+        __acl__=[
+            (Allow, "role:owner", ["view", "edit"]),
+            (Deny, Everyone, ALL_PERMISSIONS),
+        ]
+    )
+    root["private"]["child"] = Content()
+    root["public"] = Content(__acl__=[(Deny, "bob", "view")])
+    root["public"]["child"] = Content(__acl__=[(Allow, "bob", "view")])
+    root["staff"] = Content(
+        __acl__=[(Allow, "role:viewer", "view"), (Deny, Everyone, "view")]
+    )
+    root["staff"]["child"] = Content()
+    set_groups("bob", root["private"], ["role:owner"])
+    set_groups("group:staff", root["staff"], ["role:viewer"])
+    db_session.flush()
+    return root
+
+
+def _request(userid=None):
+    class Request(DummyRequest):
+        authenticated_userid = userid
+
+    return Request()
+
+
+def _viewable_by_policy(userid):
+    """ Ids of the nodes the user may view according to the ACL
+    authorization policy, the way Kotti's authentication policy calls it. """
+
+    from pyramid.authorization import ACLAuthorizationPolicy
+    from pyramid.security import Authenticated
+    from pyramid.security import Everyone
+
+    from kotti import DBSession
+    from kotti.resources import Node
+    from kotti.security import list_groups
+
+    # ACLs loaded from the database start with the default entry for admins.
+    DBSession.expire_all()
+    policy = ACLAuthorizationPolicy()
+    ids = set()
+    for node in DBSession.query(Node):
+        principals = [Everyone]
+        if userid is not None:
+            principals.extend([Authenticated, userid])
+            principals.extend(list_groups(userid, node))
+        if policy.permits(node, principals, "view"):
+            ids.add(node.id)
+    return ids
+
+
+def _viewable_by_index(userid):
+    from kotti import DBSession
+    from kotti.acl_index import view_filter
+    from kotti.resources import Node
+
+    condition = view_filter(_request(userid))
+    return {id for (id,) in DBSession.query(Node.id).filter(condition)}
+
+
+def _assert_consistent():
+    for userid in (None, "admin", "bob", "alice"):
+        assert _viewable_by_index(userid) == _viewable_by_policy(userid), userid
+
+
+class TestACLIndex:
+    def test_disabled(self, db_session, root):
+        from kotti.acl_index import view_filter
+
+        assert view_filter(_request()) is None
+
+    def test_other_permission(self, acl_index):
+        assert acl_index.view_filter(_request(), "edit") is None
+
+    def test_matches_policy(self, acl_index, tree):
+        _assert_consistent()
+        bob = _viewable_by_index("bob")
+        assert tree["private"]["child"].id in bob
+        assert tree["public"].id not in bob
+        assert tree["public"]["child"].id in bob
+        assert tree["staff"].id not in bob
+        assert tree["staff"]["child"].id in _viewable_by_index("alice")
+        assert tree["private"].id not in _viewable_by_index("alice")
+
+    def test_acl_changed(self, acl_index, tree, db_session):
+        from pyramid.security import Allow
+        from pyramid.security import Everyone
+
+        tree["staff"].__acl__ = [(Allow, Everyone, "view")]
+        db_session.flush()
+        _assert_consistent()
+        assert tree["staff"]["child"].id in _viewable_by_index(None)
+
+    def test_moved(self, acl_index, tree, db_session):
+        child = tree["public"]["child"]
+        tree["private"]["moved"] = child
+        db_session.flush()
+        _assert_consistent()
+
+    def test_local_groups_changed(self, acl_index, tree, db_session):
+        from kotti.security import set_groups
+
+        set_groups("alice", tree["private"], ["role:owner"])
+        set_groups("bob", tree["private"], [])
+        db_session.flush()
+        _assert_consistent()
+        assert tree["private"].id in _viewable_by_index("alice")
+        assert tree["private"].id not in _viewable_by_index("bob")
+
+    def test_group_membership_changed(self, acl_index, tree, db_session):
+        from kotti.security import get_principals
+
+        get_principals()["group:staff"].groups = ["role:owner"]
+        db_session.flush()
+        _assert_consistent()
+
+    def test_group_edges(self, acl_index, tree, db_session, sql_statements):
+        from kotti.security import get_principals
+
+        get_principals()["group:staff"].groups = ["role:owner"]
+        db_session.flush()
+        with sql_statements() as statements:
+            edges = acl_index._group_edges()
+        assert edges == {("group:staff", "role:owner")}
+        # Only the names and groups of the groups are loaded
+        [statement] = statements
+        assert "principals.password" not in statement
+
+    def test_added(self, acl_index, tree, db_session):
+        from kotti.resources import Content
+
+        tree["staff"]["new"] = Content()
+        db_session.flush()
+        _assert_consistent()
+        assert tree["staff"]["new"].id in _viewable_by_index("alice")
+
+    def test_delete_and_copy_subtree(self, acl_index, tree, db_session):
+        from kotti.resources import ViewACE
+        from kotti.resources import copy_subtree
+        from kotti.resources import delete_subtree
+
+        copy = copy_subtree(tree["staff"], tree["public"], "copy")
+        _assert_consistent()
+        assert copy["child"].id in _viewable_by_index("admin")
+
+        child_id = tree["staff"]["child"].id
+        delete_subtree(tree["staff"])
+        assert db_session.query(ViewACE).filter_by(node_id=child_id).count() == 0
+        _assert_consistent()
+
+    def test_children_with_permission(self, acl_index, tree):
+        request = _request("bob")
+        children = tree["public"].children_with_permission(request)
+        assert [child.name for child in children] == ["child"]
+        page = tree.children_page(permission="view", request=_request("alice"))
+        assert [child.name for child in page] == ["public", "staff"]
+
+    def test_group_deleted(self, acl_index, tree, db_session):
+        from kotti.events import UserDeleted
+        from kotti.events import notify
+        from kotti.security import get_principals
+
+        principals = get_principals()
+        principals["group:editors"] = {"name": "group:editors", "title": "E"}
+        principals["group:editors"].groups = ["group:staff"]
+        principals["bob"].groups = ["group:editors"]
+        db_session.flush()
+        assert tree["staff"]["child"].id in _viewable_by_index("bob")
+
+        group = principals["group:staff"]
+        del principals["group:staff"]
+        notify(UserDeleted(group))
+        db_session.flush()
+        _assert_consistent()
+        assert tree["staff"]["child"].id not in _viewable_by_index("bob")
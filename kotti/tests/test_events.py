@@ -137,6 +137,85 @@ class TestEvents:
         assert handler not in listeners[ObjectEvent]
         assert handler in objectevent_listeners[(ObjectEvent, Document)]
 
+    @mark.user("bob")
+    def test_bulk_mode(self, root, db_session, events, workflow, dummy_request):
+        from kotti.events import BatchEvent
+        from kotti.events import ObjectInsert
+        from kotti.events import bulk_mode
+        from kotti.events import objectevent_listeners
+        from kotti.resources import Document
+        from kotti.security import list_groups
+        from kotti.security import list_groups_raw
+
+        calls, batches = [], []
+
+        def handler(event):
+            calls.append(event.object)
+
+        def batch_handler(event):
+            pass
+
+        batch_handler.batch = batches.append
+        objectevent_listeners[(ObjectInsert, Document)].append(handler)
+        objectevent_listeners[(ObjectInsert, Document)].append(batch_handler)
+
+        with bulk_mode():
+            folder = root["folder"] = Document()
+            for idx in range(3):
+                folder[f"doc-{idx}"] = Document()
+            db_session.flush()
+
+        assert len(calls) == 4
+        assert len(batches) == 1
+        assert isinstance(batches[0], BatchEvent)
+        assert batches[0].event_type is ObjectInsert
+        assert len(batches[0].objects) == 4
+
+        assert folder.owner == "bob"
+        assert list_groups_raw("bob", folder) == {"role:owner"}
+        for doc in folder.values():
+            assert doc.owner == "bob"
+            assert doc.state == "private"
+            assert doc.creation_date is not None
+            assert list_groups("bob", doc) == ["role:owner"]
+            assert list_groups_raw("bob", doc) == set()
+
+        # Outside of bulk mode events are sent one by one again.
+        folder["doc-3"] = Document()
+        db_session.flush()
+        assert len(calls) == 5
+        assert len(batches) == 1
+        db_session.expire_all()
+        for doc in folder.values():
+            assert list(doc.__acl__) == list(folder["doc-3"].__acl__)
+
+    def test_dispatch_cache(self):
+        from kotti.events import ObjectEvent
+        from kotti.events import ObjectEventDispatcher
+        from kotti.events import ObjectInsert
+        from kotti.resources import Content
+        from kotti.resources import Document
+
+        dispatcher = ObjectEventDispatcher()
+        dispatcher[(ObjectEvent, Content)].append(lambda event: "content")
+        event = ObjectInsert(Document())
+        assert dispatcher(event) == ["content"]
+
+        dispatcher[(ObjectInsert, Document)].append(lambda event: "document")
+        assert dispatcher(event) == ["content", "document"]
+        dispatcher[(ObjectInsert, None)].append(lambda event: "all")
+        assert dispatcher(event) == ["content", "document", "all"]
+        assert dispatcher(ObjectEvent(Content())) == ["content"]
+
+        dispatcher[(ObjectInsert, Document)].pop()
+        assert dispatcher(event) == ["content", "all"]
+        dispatcher[(ObjectEvent, Content)] = [lambda event: "replaced"]
+        assert dispatcher(event) == ["replaced", "all"]
+        del dispatcher[(ObjectInsert, None)]
+        assert dispatcher(event) == ["replaced"]
+        dispatcher.clear()
+        assert dispatcher(event) == []
+
     def test_set_modification_date(self, root, db_session, events):
 
         from time import sleep
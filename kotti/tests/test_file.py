@@ -220,6 +220,31 @@ class TestDepotStore:
             storage.get(id)
         assert storage.delete.called
 
+    @pytest.mark.parametrize("factory", [File])
+    def test_delete_parent(
+        self, factory, db_session, root, filedepot, image_asset, app
+    ):
+        from kotti.resources import Document
+
+        storage = filedepot.get()
+
+        f = factory(data=image_asset, name="content", title="content")
+        id = f.data["file_id"]
+        root["folder"] = Document()
+        root["folder"]["content"] = f
+        db_session.flush()
+
+        storage.get(id)
+
+        del root["folder"]
+        import transaction
+
+        transaction.commit()
+
+        with pytest.raises(IOError):
+            storage.get(id)
+        assert storage.delete.called
+
 
 class TestUploadedFileResponse:
     def _create_file(
@@ -359,3 +384,68 @@ class TestStoredFileResponse:
 
         response = e.value
         assert response.headers["Location"] == "http://example.com"
+
+    def _get(self, f, **headers):
+        from webob import Request
+
+        resp = StoredFileResponse(f, None)
+        return Request.blank("/", headers=headers).get_response(resp)
+
+    def test_range(self, filedepot, dummy_request):
+        f = self._create_file(b"0123456789")
+        resp = StoredFileResponse(f.data.file, dummy_request)
+        assert resp.headers["Accept-Ranges"] == "bytes"
+
+        result = self._get(f.data.file, Range="bytes=2-5")
+        assert result.status_int == 206
+        assert result.headers["Content-Range"] == "bytes 2-5/10"
+        assert result.body == b"2345"
+
+    def test_multiple_ranges(self, filedepot, dummy_request):
+        f = self._create_file(b"0123456789")
+
+        result = self._get(f.data.file, Range="bytes=0-1, -2")
+        assert result.status_int == 206
+        content_type, boundary = result.headers["Content-Type"].split("; boundary=")
+        assert content_type == "multipart/byteranges"
+        assert result.body == (
+            b"--%(b)s\r\nContent-Type: image/png\r\n"
+            b"Content-Range: bytes 0-1/10\r\n\r\n01\r\n"
+            b"--%(b)s\r\nContent-Type: image/png\r\n"
+            b"Content-Range: bytes 8-9/10\r\n\r\n89\r\n"
+            b"--%(b)s--\r\n" % {b"b": boundary.encode()}
+        )
+        assert int(result.headers["Content-Length"]) == len(result.body)
+
+        result = self._get(f.data.file, Range="bytes=2-3, 100-")
+        assert result.status_int == 206
+        assert result.headers["Content-Range"] == "bytes 2-3/10"
+        assert result.body == b"23"
+
+        result = self._get(f.data.file, Range="bytes=100-, 200-")
+        assert result.status_int == 416
+        assert result.headers["Content-Range"] == "bytes */10"
+
+    def test_if_range(self, filedepot, dummy_request):
+        f = self._create_file(b"0123456789")
+        etag = StoredFileResponse(f.data.file, dummy_request).etag
+
+        result = self._get(f.data.file, Range="bytes=0-1,4-5", **{"If-Range": '"x"'})
+        assert result.status_int == 200
+        assert result.body == b"0123456789"
+
+        result = self._get(f.data.file, Range="bytes=0-1,4-5", **{"If-Range": etag})
+        assert result.status_int == 206
+
+    def test_range_db_stored_file(self, db_session, dummy_request):
+        from kotti.filedepot import DBFileStorage
+
+        storage = DBFileStorage(chunk_size=4)
+        file_id = storage.create(b"0123456789", "f.txt", "text/plain")
+        db_session.flush()
+
+        result = self._get(storage.get(file_id), Range="bytes=3-8")
+        assert result.body == b"345678"
+        result = self._get(storage.get(file_id), Range="bytes=7-, 1-2")
+        assert b"\r\n\r\n789\r\n" in result.body
+        assert b"\r\n\r\n12\r\n" in result.body
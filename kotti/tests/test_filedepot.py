@@ -1,7 +1,14 @@
 import datetime
+import hashlib
+import json
+import os
+from io import BytesIO
 
 import pytest
+from mock import patch
 
+from kotti import DBSession
+from kotti.filedepot import BlobCache
 from kotti.filedepot import DBFileStorage
 from kotti.filedepot import DBStoredFile
 from kotti.resources import File
@@ -49,6 +56,38 @@ class TestDBStoredFile:
         db_session.flush()
         assert f.content_length == 0
 
+    def test_read_slices(self, db_session, events, setup_app, sql_statements):
+        f = DBStoredFile("fileid", data=b"0123456789")
+        db_session.add(f)
+        db_session.flush()
+        db_session.expire(f)
+
+        with sql_statements() as statements:
+            assert f.read(4) == b"0123"
+            assert f.read(4) == b"4567"
+            assert f.tell() == 8
+            f.seek(-3, 2)
+            assert f.tell() == 7
+            assert f.read() == b"789"
+            assert f.read(4) == b""
+            f.seek(2)
+            assert f.read(0) == b""
+            assert f.read(3) == b"234"
+
+        assert "data" not in f.__dict__
+        assert all("blobs.data AS" not in statement for statement in statements)
+
+    def test_read_after_commit(self, db_session, events, setup_app):
+        import transaction
+
+        file_id = DBFileStorage().create(b"content here", "f.txt", "text/plain")
+        transaction.commit()
+        f = DBFileStorage().get(file_id)
+        transaction.commit()
+
+        assert f.read(7) == b"content"
+        assert f.read() == b" here"
+
     def test_content_length(self, db_session, events, setup_app):
         f = DBStoredFile("fileid", data=b"content")
         db_session.add(f)
@@ -60,6 +99,7 @@ class TestDBStoredFile:
         db_session.flush()
 
         assert f.content_length == len(b"content changed")
+        assert f.content_hash == hashlib.sha256(b"content changed").hexdigest()
 
     def test_last_modified(self, monkeypatch, db_session, events, setup_app):
         from kotti import filedepot
@@ -103,9 +143,166 @@ class TestDBFileStorage:
         fs = db_session.query(DBStoredFile).filter_by(file_id=file_id).one()
         assert fs.data == b"content here"
 
-    def test_list(self):
-        with pytest.raises(NotImplementedError):
-            DBFileStorage().list()
+    def test_create_chunked(self, db_session, events):
+        from kotti.filedepot import BlobChunk
+
+        class Upload(BytesIO):
+            sizes = []
+
+            def read(self, size=-1):
+                self.sizes.append(size)
+                return super().read(size)
+
+        storage = DBFileStorage(chunk_size="4")
+        file_id = storage.create(Upload(b"0123456789"), "f.txt", "text/plain")
+        assert set(Upload.sizes) == {4}
+        db_session.flush()
+
+        fs = storage.get(file_id)
+        assert fs.chunk_size == 4
+        assert fs.data is None
+        assert fs.content_length == 10
+        assert fs.content_hash == hashlib.sha256(b"0123456789").hexdigest()
+        assert db_session.query(BlobChunk).filter_by(file_id=file_id).count() == 3
+
+        db_session.expire(fs)
+        assert fs.read(3) == b"012"
+        assert fs.read(3) == b"345"
+        assert fs.read() == b"6789"
+        fs.seek(-3, 2)
+        assert fs.read(2) == b"78"
+        fs.seek(0)
+        assert fs.read() == b"0123456789"
+
+    def test_create_fits_one_chunk(self, db_session):
+        storage = DBFileStorage(chunk_size=4)
+        file_id = storage.create(b"0123", "f.txt", "text/plain")
+        fs = storage.get(file_id)
+        assert fs.chunk_size is None
+        assert fs.data == b"0123"
+
+    def test_replace_and_delete_chunked(self, db_session, events):
+        from kotti.filedepot import BlobChunk
+
+        storage = DBFileStorage(chunk_size=4)
+        file_id = storage.create(b"0123456789", "f.txt", "text/plain")
+        chunks = db_session.query(BlobChunk).filter_by(file_id=file_id)
+
+        storage.replace(file_id, b"01234")
+        db_session.flush()
+        fs = storage.get(file_id)
+        assert chunks.count() == 2
+        assert fs.read() == b"01234"
+        assert fs.content_length == 5
+
+        storage.replace(file_id, b"012")
+        db_session.flush()
+        assert chunks.count() == 0
+        assert fs.read() == b"012"
+        assert fs.content_length == 3
+
+        storage.replace(file_id, b"0123456789")
+        db_session.flush()
+        storage.delete(file_id)
+        assert chunks.count() == 0
+
+        file_id = storage.create(b"0123456789", "f.txt", "text/plain")
+        db_session.flush()
+        db_session.delete(storage.get(file_id))
+        db_session.flush()
+        assert db_session.query(BlobChunk).count() == 0
+
+    def test_cache(self, db_session, events, tmpdir):
+        storage = DBFileStorage(chunk_size=4, cache_dir=str(tmpdir), cache_size=100)
+        file_id = storage.create(b"0123456789", "f.txt", "text/plain")
+        db_session.flush()
+        db_session.expire_all()
+
+        fs = storage.get(file_id)
+        assert fs.read(3) == b"012"
+        assert storage.cache.size == 0
+        assert fs.read() == b"3456789"
+        assert tmpdir.listdir() == [tmpdir.join(storage.cache.key(fs))]
+        fs.seek(-2, 2)
+        assert fs.tell() == 8
+        assert fs.read() == b"89"
+        fs.close()
+
+        # cache hits don't read from the database
+        fs = storage.get(file_id)
+        fs.seek(0)
+        with patch.object(DBStoredFile, "_read_db", side_effect=AssertionError):
+            assert os.read(fs.fileno(), 4) == b"0123"
+            assert fs.read() == b"456789"
+
+        storage.replace(file_id, b"new")
+        db_session.flush()
+        assert storage.get(file_id).read() == b"new"
+        assert len(tmpdir.listdir()) == 2
+        storage.delete(file_id)
+        assert tmpdir.listdir() == []
+
+    def test_larger_than_cache(self, db_session, events, tmpdir):
+        storage = DBFileStorage(chunk_size=40, cache_dir=str(tmpdir), cache_size=10)
+        file_id = storage.create(b"x" * 100, "f.txt", "text/plain")
+        db_session.flush()
+        db_session.expire_all()
+
+        fs = storage.get(file_id)
+        assert fs._cache_entry is None
+
+        # A failed copy to the cache isn't repeated on every read
+        fs._cache_entry = (storage.cache, storage.cache.key(fs))
+        with patch.object(BlobCache, "open", autospec=True) as mocked:
+            mocked.return_value = None
+            assert b"".join(iter(lambda: fs.read(10), b"")) == b"x" * 100
+        assert mocked.call_count == 1
+        assert tmpdir.listdir() == []
+
+    def test_cache_not_filled_by_ranges(self, db_session, events, tmpdir):
+        storage = DBFileStorage(chunk_size=4, cache_dir=str(tmpdir), cache_size=100)
+        file_id = storage.create(b"0123456789", "f.txt", "text/plain")
+        db_session.flush()
+        db_session.expire_all()
+
+        # reading from elsewhere than the start
+        fs = storage.get(file_id)
+        fs.seek(5)
+        assert fs.read() == b"56789"
+        fs.close()
+        assert tmpdir.listdir() == []
+
+        # reading from the start, but not to the end
+        db_session.expunge_all()
+        fs = storage.get(file_id)
+        assert fs.read(2) == b"01"
+        fs.seek(6)
+        assert fs.read() == b"6789"
+        db_session.expunge_all()
+        fs = storage.get(file_id)
+        assert fs.read(2) == b"01"
+        fs.close()
+        assert tmpdir.listdir() == []
+
+        db_session.expunge_all()
+        fs = storage.get(file_id)
+        assert b"".join(iter(lambda: fs.read(3), b"")) == b"0123456789"
+        fs.close()
+        assert tmpdir.listdir() == [tmpdir.join(storage.cache.key(fs))]
+
+    def test_no_cache(self, db_session):
+        import io
+
+        file_id = self.make_one()
+        with pytest.raises(io.UnsupportedOperation):
+            DBFileStorage().get(file_id).fileno()
+
+    def test_list(self, db_session):
+        assert DBFileStorage().list() == []
+        file_ids = sorted(self.make_one() for i in range(3))
+        assert DBFileStorage().list() == file_ids
+        assert DBFileStorage().list(1, 1) == file_ids[1:2]
+        assert DBFileStorage().list(2, 5) == file_ids[2:]
 
     def test_exists(self, db_session):
         assert DBFileStorage().exists("1") is False
@@ -167,6 +364,54 @@ class TestDBFileStorage:
             DepotManager.get().get(file_id)
 
 
+class TestBlobCache:
+    def test_lru_eviction(self, tmpdir):
+        from kotti.filedepot import BlobCache
+
+        cache = BlobCache(str(tmpdir.join("cache")), max_size=10)
+        assert cache.add("a", [b"aaa", b"a"]).read() == b"aaaa"
+        cache.add("b", [b"bbbb"]).close()
+        assert cache.open("a").read() == b"aaaa"
+        cache.add("c", [b"cccc"]).close()
+        assert cache.size == 8
+        assert cache.open("b") is None
+        assert sorted(os.listdir(cache.directory)) == ["a", "c"]
+
+        # too large for the cache
+        assert cache.add("d", [b"dddddd", b"dddddd"]) is None
+        assert sorted(os.listdir(cache.directory)) == ["a", "c"]
+
+        # existing files are picked up
+        cache = BlobCache(cache.directory, max_size="4")
+        assert cache.size == 4
+        assert len(os.listdir(cache.directory)) == 1
+
+    def test_removed_by_other_process(self, tmpdir):
+        from kotti.filedepot import BlobCache
+
+        cache = BlobCache(str(tmpdir), max_size=10)
+        cache.add("a-1", [b"a"]).close()
+        cache.add("a-2", [b"a"]).close()
+        os.unlink(cache.path("a-1"))
+        assert cache.open("a-1") is None
+        assert cache.size == 1
+        cache.discard("a")
+        assert cache.size == 0
+        assert tmpdir.listdir() == []
+
+    def test_shared_directory(self, tmpdir):
+        from kotti.filedepot import BlobCache
+
+        cache1 = BlobCache(str(tmpdir), max_size=10)
+        cache2 = BlobCache(str(tmpdir), max_size=10)
+        cache1.add("a", [b"aaaa"]).close()
+        cache2.add("b", [b"bbbb"]).close()
+        assert cache1.open("b").read() == b"bbbb"
+        cache2.add("c", [b"cccc"]).close()
+        assert cache1.size == cache2.size == 8
+        assert sorted(os.listdir(str(tmpdir))) == ["b", "c"]
+
+
 class TestMigrateBetweenStorage:
     def _create_content(self, db_session, root, image1, image2):
         data = [
@@ -255,6 +500,368 @@ class TestMigrateBetweenStorage:
         shutil.rmtree(tmp_location)
 
 
+class TestMigrateStorageBatches:
+    @pytest.fixture
+    def depots(self, app, no_filedepots, tmpdir):
+        from kotti.filedepot import configure_filedepot
+
+        configure_filedepot(
+            {
+                "kotti.depot.0.backend": "depot.io.local.LocalFileStorage",
+                "kotti.depot.0.name": "old",
+                "kotti.depot.0.storage_path": str(tmpdir.join("old")),
+                "kotti.depot.1.backend": "depot.io.local.LocalFileStorage",
+                "kotti.depot.1.name": "new",
+                "kotti.depot.1.storage_path": str(tmpdir.join("new")),
+            }
+        )
+        return tmpdir
+
+    @staticmethod
+    def _create_content(db_session, root):
+        import transaction
+
+        for i in range(4):
+            root[f"file{i}"] = File(data=b"x" * i, filename=f"file{i}.txt")
+        db_session.flush()
+        transaction.commit()
+
+    @staticmethod
+    def _files():
+        from kotti.resources import Node
+
+        return {f.name: f for f in DBSession.query(File).order_by(Node.id)}
+
+    def test_resume(self, db_session, root, depots):
+        import transaction
+
+        from kotti import filedepot
+        from kotti.filedepot import migrate_storage
+
+        self._create_content(db_session, root)
+        checkpoint = str(depots.join("checkpoint.json"))
+        copy_file = filedepot._copy_file
+
+        def fail_on_third(*args):
+            if fail_on_third.calls == 2:
+                raise OSError
+            fail_on_third.calls += 1
+            return copy_file(*args)
+
+        fail_on_third.calls = 0
+        with patch.object(filedepot, "_copy_file", fail_on_third):
+            with pytest.raises(OSError):
+                migrate_storage("old", "new", batch_size=2, checkpoint=checkpoint)
+        transaction.abort()
+        files = self._files()
+        assert [f.data["depot_name"] for f in files.values()] == ["new"] * 2 + [
+            "old"
+        ] * 2
+        with open(checkpoint) as f:
+            assert list(json.load(f).values()) == [files["file1"].id]
+
+        assert migrate_storage("old", "new", batch_size=2, checkpoint=checkpoint) == (
+            2,
+            5,
+        )
+        files = self._files()
+        assert {f.data["depot_name"] for f in files.values()} == {"new"}
+        assert files["file3"].data.file.read() == b"xxx"
+        assert len(depots.join("new").listdir()) == 4
+        assert depots.join("old").listdir() == []
+
+    def test_dry_run(self, db_session, root, depots):
+        from kotti.filedepot import migrate_storage
+
+        self._create_content(db_session, root)
+        assert migrate_storage("old", "new", dry_run=True) == (4, 6)
+        assert {f.data["depot_name"] for f in self._files().values()} == {"old"}
+
+    def test_workers_and_shared_files(self, db_session, root, depots):
+        import transaction
+
+        from kotti.filedepot import SharedDepotFile
+        from kotti.filedepot import migrate_storage
+        from kotti.resources import copy_subtree
+        from kotti.resources import get_root
+
+        self._create_content(db_session, root)
+        root = get_root()
+        copy_subtree(root["file3"], root, "copy")
+        transaction.commit()
+
+        assert migrate_storage("old", "new", batch_size=3, workers=2) == (4, 6)
+        files = self._files()
+        assert files["copy"].data["path"] == files["file3"].data["path"]
+        assert files["copy"].data.file.read() == b"xxx"
+        shared = db_session.query(SharedDepotFile).one()
+        assert (shared.path, shared.refcount) == (files["copy"].data["path"], 2)
+        assert len(depots.join("new").listdir()) == 4
+        assert depots.join("old").listdir() == []
+
+
+class TestSharedDepotFiles:
+    @staticmethod
+    def _copy(db_session, root, image_asset):
+        from kotti.resources import Document
+        from kotti.resources import copy_subtree
+
+        root["folder"] = Document()
+        root["folder"]["file"] = File(data=image_asset, filename="file.jpg")
+        db_session.flush()
+        copy = copy_subtree(root["folder"]["file"], root["folder"], "copy")
+        return root["folder"]["file"], copy
+
+    @staticmethod
+    def _refcount(db_session, f):
+        from kotti.filedepot import SharedDepotFile
+
+        shared = db_session.query(SharedDepotFile).get(f.data.files[0])
+        return shared and shared.refcount
+
+    def test_copy_shares_file(self, db_session, root, filedepot, image_asset, app):
+        f, copy = self._copy(db_session, root, image_asset)
+        assert copy.data.file_id == f.data.file_id
+        assert copy.data.file.read() == f.data.file.read()
+        assert self._refcount(db_session, f) == 2
+
+        from kotti.resources import copy_subtree
+
+        copy_subtree(f, root, "another-copy")
+        assert self._refcount(db_session, f) == 3
+
+    def test_release(self, db_session, root, filedepot, image_asset, app):
+        import transaction
+        from kotti.resources import Node
+
+        storage = filedepot.get()
+        f, copy = self._copy(db_session, root, image_asset)
+        file_id = f.data.file_id
+        del root["folder"]["copy"]
+        transaction.commit()
+
+        storage.get(file_id)
+        f = db_session.query(Node).filter_by(name="file").one()
+        assert self._refcount(db_session, f) is None
+
+        del f.parent["file"]
+        transaction.commit()
+        with pytest.raises(IOError):
+            storage.get(file_id)
+
+    def test_release_all(self, db_session, root, filedepot, image_asset, app):
+        import transaction
+        from kotti.filedepot import SharedDepotFile
+
+        storage = filedepot.get()
+        f, copy = self._copy(db_session, root, image_asset)
+        file_id = f.data.file_id
+        db_session.delete(copy)
+        del root["folder"]
+        transaction.commit()
+
+        with pytest.raises(IOError):
+            storage.get(file_id)
+        assert db_session.query(SharedDepotFile).count() == 0
+
+    def test_replace(self, db_session, root, filedepot, image_asset, app):
+        import transaction
+
+        storage = filedepot.get()
+        f, copy = self._copy(db_session, root, image_asset)
+        file_id = f.data.file_id
+        copy.data = b"new data"
+        transaction.commit()
+
+        assert storage.get(file_id).read()
+
+
+@pytest.fixture
+def dedup_depot(db_session, depot_tween):
+    from depot.manager import DepotManager
+
+    from kotti.filedepot import DedupFileStorage
+
+    DepotManager._depots = {"dedup": DedupFileStorage(chunk_size=4)}
+    DepotManager._default_depot = "dedup"
+
+    yield DepotManager.get()
+
+    db_session.rollback()
+    DepotManager._clear()
+
+
+class TestDedupFileStorage:
+    @staticmethod
+    def _refcount(db_session, data):
+        from hashlib import sha256
+
+        data_id = sha256(data).hexdigest()
+        return (
+            db_session.query(DBStoredFile.refcount).filter_by(file_id=data_id).scalar()
+        )
+
+    def test_create_and_delete(self, db_session, events, dedup_depot):
+        from kotti.filedepot import BlobChunk
+
+        file_id = dedup_depot.create(b"0123456789", "f.txt", "text/plain")
+        other_id = dedup_depot.create(BytesIO(b"0123456789"), "g.txt")
+        assert other_id != file_id
+        assert self._refcount(db_session, b"0123456789") == 2
+        assert db_session.query(BlobChunk).count() == 3
+
+        db_session.flush()
+        db_session.expire_all()
+        f = dedup_depot.get(file_id)
+        assert f.filename == "f.txt"
+        assert f.content_length == 10
+        assert f.read() == b"0123456789"
+        f.seek(-3, 2)
+        assert f.read(2) == b"78"
+        assert dedup_depot.get(other_id).filename == "g.txt"
+        assert dedup_depot.get(other_id).read() == b"0123456789"
+
+        dedup_depot.delete(file_id)
+        assert not dedup_depot.exists(file_id)
+        assert self._refcount(db_session, b"0123456789") == 1
+
+        dedup_depot.replace(other_id, b"012")
+        db_session.flush()
+        assert dedup_depot.get(other_id).read() == b"012"
+        assert self._refcount(db_session, b"0123456789") is None
+        assert db_session.query(BlobChunk).count() == 0
+
+        db_session.delete(dedup_depot.get(other_id))
+        db_session.flush()
+        assert db_session.query(DBStoredFile).count() == 0
+
+    def test_concurrent_create(self, db_session, events, dedup_depot):
+        from sqlalchemy.orm import Query
+
+        file_id = dedup_depot.create(b"0123456789", "f.txt")
+        db_session.flush()
+
+        # The blob is created by another transaction between the update of
+        # its refcount and the insert
+        update = Query.update
+        with patch.object(Query, "update", autospec=True) as mocked:
+            mocked.side_effect = lambda *args, **kw: (
+                0 if mocked.call_count == 1 else update(*args, **kw)
+            )
+            other_id = dedup_depot.create(BytesIO(b"0123456789"), "g.txt")
+        db_session.flush()
+        assert mocked.call_count == 2
+        assert self._refcount(db_session, b"0123456789") == 2
+        assert db_session.query(DBStoredFile).count() == 3
+        assert dedup_depot.get(other_id).read() == b"0123456789"
+
+        dedup_depot.delete(file_id)
+        dedup_depot.delete(other_id)
+        assert db_session.query(DBStoredFile).count() == 0
+
+    def test_fields(self, db_session, root, app, dedup_depot):
+        import transaction
+
+        from kotti.resources import copy_subtree
+        from kotti.resources import get_root
+
+        root["a"] = File(data=b"data", filename="f.txt")
+        root["b"] = File(data=b"data", filename="f.txt")
+        db_session.flush()
+        copy_subtree(root["b"], root, "c")
+        root["d"] = root["b"].copy()
+        transaction.commit()
+        assert self._refcount(db_session, b"data") == 3
+
+        root = get_root()
+        root["a"].data = b"data"
+        del root["b"]
+        transaction.commit()
+        assert self._refcount(db_session, b"data") == 3
+
+        root = get_root()
+        del root["a"]
+        del root["c"]
+        transaction.commit()
+        assert self._refcount(db_session, b"data") == 1
+
+        del get_root()["d"]
+        transaction.commit()
+        assert self._refcount(db_session, b"data") is None
+
+
+class TestSweepOrphanedFiles:
+    @pytest.fixture
+    def depots(self, app, no_filedepots, tmpdir):
+        from kotti.filedepot import DedupFileStorage
+        from kotti.filedepot import configure_filedepot
+
+        configure_filedepot(
+            {
+                "kotti.depot.0.backend": "kotti.filedepot.DBFileStorage",
+                "kotti.depot.0.name": "db",
+                "kotti.depot.1.backend": "depot.io.local.LocalFileStorage",
+                "kotti.depot.1.name": "local",
+                "kotti.depot.1.storage_path": str(tmpdir),
+            }
+        )
+        no_filedepots._depots["dedup"] = DedupFileStorage()
+        return no_filedepots
+
+    def test_sweep(self, db_session, root, depots):
+        import transaction
+
+        from kotti.filedepot import share_files
+        from kotti.filedepot import sweep_orphaned_files
+        from kotti.resources import copy_subtree
+        from kotti.resources import get_root
+
+        root["a"] = File(data=b"data", filename="a.txt")
+        db_session.flush()
+        copy_subtree(root["a"], root, "b")
+        orphans = [
+            depots.get("db").create(b"db"),
+            depots.get("local").create(b"local"),
+            depots.get("dedup").create(b"data"),
+        ]
+        shared_id = depots.get("local").create(b"shared")
+        share_files([f"local/{shared_id}"])
+        transaction.commit()
+
+        assert sweep_orphaned_files() == (0, 0)
+        assert sweep_orphaned_files(min_age=0, dry_run=True) == (3, 11)
+        assert sweep_orphaned_files(storages=["local"], min_age=0) == (1, 5)
+        assert sweep_orphaned_files(min_age=0, batch_size=1) == (2, 6)
+        assert not any(depots.get("db").exists(file_id) for file_id in orphans)
+        assert not depots.get("local").exists(orphans[1])
+        assert depots.get("local").exists(shared_id)
+        assert DBSession.query(DBStoredFile).count() == 1
+
+        root = get_root()
+        assert root["a"].data.file.read() == b"data"
+        assert root["b"].data.file.read() == b"data"
+        assert sweep_orphaned_files(min_age=0) == (0, 0)
+
+    def test_dedup_data(self, db_session, root, depots):
+        import transaction
+
+        from kotti.filedepot import sweep_orphaned_files
+        from kotti.resources import get_root
+
+        depots._default_depot = "dedup"
+        root["a"] = File(data=b"data", filename="a.txt")
+        depots.get("dedup").create(b"data")
+        transaction.commit()
+        refcount = DBSession.query(DBStoredFile.refcount).filter(
+            DBStoredFile.refcount.isnot(None)
+        )
+        assert refcount.scalar() == 2
+
+        assert sweep_orphaned_files(min_age=0) == (1, 4)
+        assert refcount.scalar() == 1
+        assert get_root()["a"].data.file.read() == b"data"
+
+
 class TestTween:
     @pytest.mark.user("admin")
     def test_tween(self, webtest, filedepot, root, image_asset, db_session):
@@ -278,3 +885,48 @@ class TestTween:
         # test 404
         resp = webtest.app.get("/depot/non_existing/fileid", status=404)
         assert resp.status_code == 404
+
+    def test_not_modified(self, webtest, filedepot, root, image_asset, db_session):
+        from kotti.resources import File
+
+        root["img"] = File(data=image_asset.read(), title="Image")
+        db_session.flush()
+        url = "/depot/" + root["img"].data["path"]
+
+        resp = webtest.app.get(url)
+        assert resp.status_code == 200
+        etag = resp.headers["ETag"]
+        last_modified = resp.headers["Last-Modified"]
+
+        with patch("kotti.filedepot.StoredFileResponse.__init__") as init:
+            resp = webtest.app.get(url, headers={"If-None-Match": etag}, status=304)
+            assert resp.headers["ETag"] == etag
+            assert resp.headers["Last-Modified"] == last_modified
+            assert resp.cache_control.public
+            assert resp.body == b""
+            resp = webtest.app.get(
+                url, headers={"If-Modified-Since": last_modified}, status=304
+            )
+            assert not init.called
+
+        resp = webtest.app.get(url, headers={"If-None-Match": '"other"'})
+        assert resp.status_code == 200
+        assert resp.body == root["img"].data.file.read()
+
+    def test_not_modified_db_stored_file(self, db_session):
+        from webob import Request
+
+        from kotti.filedepot import not_modified_response
+
+        storage = DBFileStorage()
+        file_id = storage.create(b"content", "file.txt", "text/plain")
+        db_session.flush()
+        db_session.expire_all()
+        f = storage.get(file_id)
+
+        assert not_modified_response(Request.blank("/"), f) is None
+        request = Request.blank("/", headers={"If-None-Match": f'"{f.content_hash}"'})
+        response = not_modified_response(request, f)
+        assert response.status_code == 304
+        assert response.etag == f.content_hash
+        assert "data" not in f.__dict__
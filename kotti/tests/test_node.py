@@ -1,3 +1,5 @@
+import warnings
+
 from mock import Mock
 from mock import patch
 from pyramid.security import ALL_PERMISSIONS
@@ -156,6 +158,90 @@ class TestNode:
             root["child4"] = child44
             db_session.flush()
 
+    def test_keys_and_len_without_loading_children(self, db_session, root):
+        from kotti.resources import Node
+
+        root["b"] = Node()
+        root["a"] = Node()
+        db_session.flush()
+        db_session.expire(root, ["_children"])
+
+        assert root.keys() == ["b", "a"]
+        assert len(root) == 2
+        assert "_children" not in root.__dict__
+
+        root["c"] = Node()
+        assert root.keys() == ["b", "a", "c"]
+        assert len(root) == 3
+
+    def test_children_page(self, db_session, root):
+        from kotti.resources import Node
+
+        for index in range(5):
+            root[f"child{index}"] = Node()
+        db_session.flush()
+
+        page = root.children_page(limit=2)
+        assert [c.name for c in page] == ["child0", "child1"]
+        page = root.children_page(after=(page[-1].position, page[-1].id), limit=2)
+        assert [c.name for c in page] == ["child2", "child3"]
+        page = root.children_page(after=(page[-1].position, page[-1].id), limit=2)
+        assert [c.name for c in page] == ["child4"]
+
+        page = root.children_page(limit=3, sort="-position")
+        assert [c.name for c in page] == ["child4", "child3", "child2"]
+        page = root.children_page(after=(page[-1].position, page[-1].id), sort="-position")
+        assert [c.name for c in page] == ["child1", "child0"]
+
+        with raises(ValueError):
+            root.children_page(sort="name")
+
+    def test_children_page_same_position(self, db_session, root):
+        from kotti.resources import Node
+
+        for index in range(5):
+            Node(name=f"child{index}", parent=root, position=0)
+        db_session.flush()
+        db_session.expire(root)
+
+        names = []
+        page = root.children_page(limit=2)
+        while page:
+            names.extend(c.name for c in page)
+            page = root.children_page(after=(page[-1].position, page[-1].id), limit=2)
+        assert names == [f"child{index}" for index in range(5)]
+
+        page = root.children_page(limit=3, sort="-position")
+        page += root.children_page(
+            after=(page[-1].position, page[-1].id), limit=3, sort="-position"
+        )
+        assert [c.name for c in page] == [f"child{index}" for index in range(4, -1, -1)]
+
+    def test_children_page_with_permission(self, db_session, root):
+        from kotti.resources import Node
+
+        class Request:
+            def has_permission(self, permission, context):
+                assert permission == "view"
+                return context.name in ("child0", "child3", "child4")
+
+            def filter_permitted(self, nodes, permission):
+                return [n for n in nodes if self.has_permission(permission, n)]
+
+        for index in range(6):
+            root[f"child{index}"] = Node()
+
+        request = Request()
+        page = root.children_page(limit=2, permission="view", request=request)
+        assert [c.name for c in page] == ["child0", "child3"]
+        page = root.children_page(
+            after=(page[-1].position, page[-1].id),
+            limit=2,
+            permission="view",
+            request=request,
+        )
+        assert [c.name for c in page] == ["child4"]
+
     def test_node_copy_name(self, db_session, root):
 
         copy_of_root = root.copy(name="copy_of_root")
@@ -253,6 +339,61 @@ class TestPath:
         subchild = root["child-1"]["subchild"] = Node()
         assert subchild.path == "/child-1/subchild/"
 
+    def test_path_hash(self, db_session, root, events):
+        from kotti.resources import Node
+        from kotti.resources import hash_path
+
+        assert root.path_hash == hash_path("/")
+        child = root["child-1"] = Node()
+        subchild = child["subchild"] = Node()
+        assert subchild.path_hash == hash_path("/child-1/subchild/")
+        db_session.flush()
+
+        child.name = "renamed"
+        assert subchild.path_hash == hash_path("/renamed/subchild/")
+        subchild.parent = root
+        assert subchild.path_hash == hash_path("/subchild/")
+
+    def test_md5_for_sqlite(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        from sqlalchemy.exc import OperationalError
+
+        from kotti.resources import _adjust_for_engine
+        from kotti.resources import _register_sqlite_functions
+        from kotti.resources import hash_path
+
+        # Other engines are left alone
+        engine = create_engine("sqlite://")
+        with raises(OperationalError):
+            engine.execute("SELECT md5('/a/')")
+        assert not event.contains(Engine, "connect", _register_sqlite_functions)
+
+        engine = create_engine("sqlite://")
+        _adjust_for_engine(engine)
+        _adjust_for_engine(engine)
+        assert engine.execute("SELECT md5('/a/')").scalar() == hash_path("/a/")
+
+    def test_getitem_path_hash(self, db_session, root, events, sql_statements):
+        from kotti.resources import Node
+
+        child = root["child-1"] = Node()
+        subchild = child["subchild"] = Node()
+        db_session.flush()
+        del root.__dict__["_children"]
+        assert root["child-1", "subchild"] is subchild
+
+        # A miss doesn't fall back to joining the lineage
+        with sql_statements() as statements:
+            with raises(KeyError):
+                root["child-1", "missing"]
+        assert len(statements) == 1
+
+        # Descendants of nodes without a path are still found
+        root.path = None
+        assert root["child-1", "subchild"] is subchild
+
     def test_object_moved(self, db_session, root, events):
         from kotti.resources import Node
 
@@ -303,6 +444,45 @@ class TestPath:
         assert subchild.path == "/renamed-1/renamed/subchild/"
         assert child1.path == "/renamed-1/"
 
+    def test_parent_renamed_bulk_update(self, db_session, root, events, sql_statements):
+        from kotti.resources import Node
+        from kotti.resources import hash_path
+
+        folder = root["folder"] = Node()
+        for idx in range(20):
+            folder[f"child-{idx}"] = Node()
+            folder[f"child-{idx}"]["grandchild"] = Node()
+        other = root["folderx"] = Node()
+        db_session.flush()
+        grandchild_id = folder["child-3"]["grandchild"].id
+        db_session.expire_all()
+        loaded = db_session.query(Node).filter(Node.name == "child-1").one()
+
+        with sql_statements() as statements:
+            folder.name = "renamed"
+            db_session.flush()
+
+        assert len([s for s in statements if s.startswith("UPDATE")]) == 2
+        assert loaded.path == "/renamed/child-1/"
+        assert loaded not in db_session.dirty
+        db_session.expire_all()
+        grandchild = db_session.query(Node).get(grandchild_id)
+        assert grandchild.path == "/renamed/child-3/grandchild/"
+        assert grandchild.path_hash == hash_path(grandchild.path)
+        assert other.path == "/folderx/"
+
+    def test_renamed_like_wildcards(self, db_session, root, events):
+        from kotti.resources import Node
+
+        root["a_b"] = Node()
+        root["axb"] = Node()
+        root["axb"]["child"] = Node()
+        db_session.flush()
+        root["a_b"].name = "c"
+        db_session.flush()
+        db_session.expire_all()
+        assert root["axb"]["child"].path == "/axb/child/"
+
     @mark.parametrize("flush", [True, False])
     def test_parent_copied(self, db_session, root, events, flush):
         from kotti.resources import Node
@@ -411,6 +591,77 @@ class TestPath:
         child3 = Node("child-3", parent=child2)
         assert child3.path == "/parent/child-1/child-2/child-3/"
 
+
+class TestDeleteSubtree:
+    @staticmethod
+    def _tree(root, db_session):
+        from kotti.resources import Document
+        from kotti.resources import LocalGroup
+
+        folder = root["folder"] = Document()
+        for idx in range(20):
+            child = folder[f"child-{idx}"] = Document(tags=["child", f"tag-{idx}"])
+            child["grandchild"] = Document()
+            db_session.add(LocalGroup(child, "bob", "role:editor"))
+            db_session.flush()
+        root["folderx"] = Document(tags=["child"])
+        db_session.flush()
+        return folder
+
+    def test_delete(self, db_session, root, events, sql_statements):
+        import transaction
+        from kotti import events as kotti_events
+        from kotti.resources import LocalGroup
+        from kotti.resources import Node
+        from kotti.resources import Tag
+        from kotti.resources import TagsToContents
+
+        self._tree(root, db_session)
+        loaded = root["folder"]["child-1"]["grandchild"]
+        deleted, after_deleted = [], []
+        listeners = kotti_events.objectevent_listeners
+        listeners[(kotti_events.ObjectDelete, Node)].append(deleted.append)
+        with warnings.catch_warnings(record=True):
+            listeners[(kotti_events.ObjectAfterDelete, Node)].append(
+                after_deleted.append
+            )
+
+        with sql_statements() as statements:
+            del root["folder"]
+
+        assert len(deleted) == len(after_deleted) == 41
+        assert len([s for s in statements if s.startswith("DELETE")]) < 10
+        assert loaded not in db_session
+        assert root.keys() == ["folderx"]
+        db_session.flush()
+        assert db_session.query(Node).count() == 2
+        assert db_session.query(LocalGroup).filter_by(principal_name="bob").all() == []
+        assert db_session.query(TagsToContents).count() == 1
+        # Orphaned tags are deleted when the transaction is committed.
+        assert db_session.query(Tag).count() == 21
+        transaction.commit()
+        assert [tag.title for tag in db_session.query(Tag)] == ["child"]
+
+    def test_clear(self, db_session, root, events):
+        from kotti.resources import Node
+
+        folder = self._tree(root, db_session)
+        folder.clear()
+        assert folder.children == []
+        assert folder in db_session
+        db_session.flush()
+        assert db_session.query(Node).count() == 3
+
+    def test_like_wildcards(self, db_session, root, events):
+        from kotti.resources import Node
+
+        root["a_b"] = Node()
+        root["axb"] = Node()
+        root["axb"]["child"] = Node()
+        db_session.flush()
+        del root["a_b"]
+        assert root["axb"]["child"].path == "/axb/child/"
+
     def test_node_lineage_not_loaded_new_parent(self, db_session, root, events):
 
         from kotti.resources import Node
@@ -440,6 +691,99 @@ class TestPath:
         assert child3.path == "/parent/child-1/child-2/child-3/"
 
 
+class TestCopySubtree:
+    def test_copy(self, db_session, root, events, sql_statements):
+        from kotti import events as kotti_events
+        from kotti.resources import Node
+        from kotti.resources import copy_subtree
+
+        folder = TestDeleteSubtree._tree(root, db_session)
+        folder["child-1"]["grandchild"].body = "<p>Body</p>"
+        db_session.flush()
+        inserted = []
+        kotti_events.objectevent_listeners[(kotti_events.ObjectInsert, Node)].append(
+            inserted.append
+        )
+
+        with sql_statements() as statements:
+            copy = copy_subtree(folder, root, "copy")
+
+        assert len(inserted) == 41
+        assert len([s for s in statements if s.startswith("INSERT")]) < 10
+        assert root.keys() == ["folder", "folderx", "copy"]
+        assert copy.path == "/copy/"
+        assert copy.position == 2
+        assert copy.keys() == folder.keys()
+        child = copy["child-1"]
+        assert child is not folder["child-1"]
+        assert child.path == "/copy/child-1/"
+        assert child.tags == ["child", "tag-1"]
+        assert child.local_groups == []
+        assert child["grandchild"].body == "<p>Body</p>"
+        assert child["grandchild"].path == "/copy/child-1/grandchild/"
+        assert folder["child-1"].local_groups != []
+        db_session.flush()
+        assert db_session.query(Node).count() == 1 + 42 + 41
+
+    def test_copy_into_descendant(self, db_session, root, events):
+        from kotti.resources import Document
+        from kotti.resources import Node
+        from kotti.resources import copy_subtree
+
+        root["a"] = Document()
+        root["a"]["b"] = Document()
+        db_session.flush()
+        copy = copy_subtree(root["a"], root["a"]["b"], "c")
+        assert copy.path == "/a/b/c/"
+        assert [n.path for n in db_session.query(Node).order_by(Node.path)] == [
+            "/",
+            "/a/",
+            "/a/b/",
+            "/a/b/c/",
+            "/a/b/c/b/",
+        ]
+
+
+class TestPolymorphicLoading:
+    @mark.parametrize("strategy", ["selectin", "lazy"])
+    def test_strategy(self, db_session, root, strategy):
+        from kotti.resources import Document
+        from kotti.resources import Node
+        from kotti.resources import configure_polymorphic_loading
+
+        root["doc"] = Document(body="<p>Body</p>")
+        db_session.flush()
+        db_session.expunge_all()
+
+        configure_polymorphic_loading(strategy)
+        try:
+            statement = str(db_session.query(Node).statement)
+            assert "documents" not in statement
+            [doc] = db_session.query(Node).filter(Node.name == "doc").all()
+            assert isinstance(doc, Document)
+            assert doc.body == "<p>Body</p>"
+        finally:
+            configure_polymorphic_loading("joined")
+        assert "documents" in str(db_session.query(Node).statement)
+
+    def test_unknown_strategy(self):
+        from kotti.resources import configure_polymorphic_loading
+
+        with raises(ValueError):
+            configure_polymorphic_loading("eager")
+
+    def test_without_private_mapper_api(self):
+        from mock import patch
+        from sqlalchemy.orm import Mapper
+
+        from kotti.resources import configure_polymorphic_loading
+
+        with patch.object(Mapper, "_set_with_polymorphic", None):
+            configure_polymorphic_loading("joined")
+            with raises(NotImplementedError):
+                configure_polymorphic_loading("selectin")
+
+
 class TestLocalGroup:
     def test_copy(self, db_session, root):
         from kotti.resources import LocalGroup
@@ -369,6 +369,62 @@ class TestNodeMove:
         transaction.commit()
 
 
+class TestContentsJson:
+    def test_pages(self, root):
+        from kotti.resources import Document
+        from kotti.views.edit.actions import contents_json
+
+        for index in range(3):
+            root[f"child{index}"] = Document(title=f"Child {index}")
+
+        request = DummyRequest(params={"format": "json", "limit": "2"})
+        result = contents_json(root, request)
+        assert [item["name"] for item in result["items"]] == ["child0", "child1"]
+        assert result["items"][0]["title"] == "Child 0"
+        assert result["items"][0]["type"] == "Document"
+        assert result["items"][0]["url"] == "http://example.com/child0/"
+        assert result["next"] == f"{root['child1'].position},{root['child1'].id}"
+
+        request = DummyRequest(params={"limit": "2", "after": result["next"]})
+        result = contents_json(root, request)
+        assert [item["name"] for item in result["items"]] == ["child2"]
+        assert result["next"] is None
+
+        request = DummyRequest(params={"sort": "-position"})
+        result = contents_json(root, request)
+        assert [item["name"] for item in result["items"]] == [
+            "child2",
+            "child1",
+            "child0",
+        ]
+
+    def test_max_page_size(self, root):
+        from kotti import get_settings
+        from kotti.resources import Document
+        from kotti.views.edit.actions import contents_json
+
+        get_settings()["kotti.contents_max_page_size"] = "1"
+        root["child0"] = Document()
+        root["child1"] = Document()
+
+        request = DummyRequest(params={"limit": "10"})
+        result = contents_json(root, request)
+        assert [item["name"] for item in result["items"]] == ["child0"]
+        assert result["next"] == f"{root['child0'].position},{root['child0'].id}"
+
+    def test_bad_request(self, root):
+        from kotti.views.edit.actions import contents_json
+
+        for params in (
+            {"limit": "0"},
+            {"after": "x"},
+            {"after": "1"},
+            {"sort": "name"},
+        ):
+            with raises(HTTPBadRequest):
+                contents_json(root, DummyRequest(params=params))
+
+
 class TestNodeShowHide:
     def test_show_hide(self, root):
         from kotti.resources import Document
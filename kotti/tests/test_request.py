@@ -8,3 +8,67 @@ class TestExtendingRequest:
 
         assert providedBy(req) == implementedBy(Request)
         assert req.marker == "exists"
+
+
+class TestFilterPermitted:
+    def _request(self, config, userid):
+        from pyramid.authentication import AuthTktAuthenticationPolicy
+        from pyramid.authorization import ACLAuthorizationPolicy
+
+        from kotti.request import Request
+        from kotti.security import list_groups_callback
+
+        class AuthenticationPolicy(AuthTktAuthenticationPolicy):
+            def unauthenticated_userid(self, request):
+                return userid
+
+        config.set_authorization_policy(ACLAuthorizationPolicy())
+        config.set_authentication_policy(
+            AuthenticationPolicy("secret", callback=list_groups_callback)
+        )
+        config.commit()
+        request = Request.blank("/")
+        request.registry = config.registry
+        return request
+
+    def test_same_as_has_permission(self, config, db_session, root):
+        from pyramid.security import ALL_PERMISSIONS
+        from pyramid.security import Allow
+        from pyramid.security import Deny
+        from pyramid.security import Everyone
+
+        from kotti.resources import Content
+        from kotti.security import get_principals
+        from kotti.security import set_groups
+
+        get_principals()["bob"] = {"name": "bob", "title": "Bob"}
+        root["folder"] = folder = Content(
+            __acl__=[
+                (Allow, "role:editor", "edit"),
+                (Deny, Everyone, ALL_PERMISSIONS),
+            ]
+        )
+        for index in range(10):
+            folder[f"child{index}"] = Content()
+        folder["child3"].__acl__ = [(Allow, "bob", "edit")]
+        folder["child7"].__acl__ = [(Allow, Everyone, "view")]
+        set_groups("bob", folder["child5"], ["role:editor"])
+        db_session.flush()
+
+        for userid in (None, "bob"):
+            request = self._request(config, userid)
+            for permission in ("view", "edit"):
+                nodes = [root, folder] + folder.values()
+                expected = [n for n in nodes if request.has_permission(permission, n)]
+                assert request.filter_permitted(nodes, permission) == expected
+        assert [n.name for n in request.filter_permitted(folder.values(), "edit")] == [
+            "child3",
+            "child5",
+        ]
+
+    def test_no_authentication_policy(self, config, root):
+        from kotti.request import Request
+
+        request = Request.blank("/")
+        request.registry = config.registry
+        assert request.filter_permitted([root], "view") == [root]
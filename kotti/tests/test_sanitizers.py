@@ -134,3 +134,22 @@ def test_sanitize(app, dummy_request):
     _verify_no_html(api.sanitize(unsanitized, "no_html"))
     _verify_minimal_html(api.sanitize(unsanitized, "minimal_html"))
     _verify_xss_protection(api.sanitize(unsanitized, "xss_protection"))
+
+
+def test_listeners_bulk_mode(app, root, db_session):
+
+    from kotti.events import bulk_mode
+    from kotti.resources import Document
+
+    with bulk_mode():
+        for idx in range(3):
+            root[f"d{idx}"] = Document(
+                title="<h1>Title</h1>", description=unsanitized, body=unsanitized
+            )
+        db_session.flush()
+
+    for idx in range(3):
+        doc = root[f"d{idx}"]
+        assert doc.title == "Title"
+        _verify_no_html(doc.description)
+        _verify_xss_protection(doc.body)
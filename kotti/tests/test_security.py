@@ -329,6 +329,38 @@ class TestGroups:
         assert bobsgroup_all == ["role:editor"]
         assert bobsgroup_inherited == []
 
+    def test_load_local_groups(self, db_session, root, sql_statements):
+        from sqlalchemy.orm import lazyload
+        from kotti.resources import LocalGroup
+        from kotti.resources import Node
+        from kotti.security import load_local_groups
+        from kotti.security import principals_with_local_roles
+        from kotti.security import set_groups
+
+        root["a"] = Node()
+        root["a"]["b"] = Node()
+        set_groups("bob", root["a"], ["role:editor"])
+        set_groups("frank", root["a"]["b"], ["role:editor"])
+        db_session.flush()
+        db_session.expunge_all()
+
+        nodes = db_session.query(Node).options(lazyload(Node.local_groups)).all()
+        assert not any("local_groups" in node.__dict__ for node in nodes)
+        b = [node for node in nodes if node.name == "b"][0]
+
+        with sql_statements() as statements:
+            principals = principals_with_local_roles(b)
+        assert set(principals) == {"bob", "frank"}
+        assert len(statements) == 1
+
+        # Local groups that are added before loading are kept, but not doubled
+        a = b.parent
+        db_session.expire(a, ["local_groups"])
+        LocalGroup(a, "alice", "role:owner")
+        db_session.flush()
+        load_local_groups([a])
+        assert sorted(lg.principal_name for lg in a.local_groups) == ["alice", "bob"]
+
     def test_local_roles_db_cascade(self, db_session, root):
         from kotti.resources import LocalGroup
         from kotti.resources import Node
@@ -348,6 +380,111 @@ class TestGroups:
         assert db_session.query(LocalGroup).count() == 0
 
 
+class TestPrincipalCaches:
+    @staticmethod
+    def _setup(config, root):
+        import transaction
+        from kotti.resources import Node
+        from kotti.resources import get_root
+        from kotti.security import get_principals
+        from kotti.security import set_groups
+
+        config.get_settings()["kotti.principal_cache_size"] = "1000"
+        config.include("kotti.security")
+        get_principals()["bob"] = {"name": "bob", "groups": ["group:staff"]}
+        root["child"] = Node()
+        set_groups("group:staff", root["child"], ["role:editor"])
+        transaction.commit()
+        return get_root()["child"]
+
+    def test_hit_without_sql(self, config, db_session, root, sql_statements):
+        from kotti.security import list_groups_ext
+
+        child = self._setup(config, root)
+        expected = list_groups_ext("bob", child)
+        assert set(expected[0]) == {"group:staff", "role:editor"}
+
+        with sql_statements() as statements:
+            result = list_groups_ext("bob", child)
+        assert result == expected
+        assert statements == []
+
+    def test_not_cached_with_pending_changes(self, config, db_session, root):
+        from kotti.security import get_principals
+        from kotti.security import group_closure_cache
+        from kotti.security import list_groups
+        from kotti.security import set_groups
+
+        child = self._setup(config, root)
+        assert "role:editor" in list_groups("bob", child)
+
+        get_principals()["bob"].groups = []
+        assert list_groups("bob", child) == []
+        set_groups("bob", child, ["role:owner"])
+        assert list_groups("bob", child) == ["role:owner"]
+        assert group_closure_cache.data == {}
+
+    def test_invalidated_on_commit(self, config, db_session, root):
+        import transaction
+        from kotti.resources import get_root
+        from kotti.security import list_groups
+        from kotti.security import set_groups
+
+        child = self._setup(config, root)
+        assert "role:editor" in list_groups("bob", child)
+        set_groups("group:staff", child, [])
+        transaction.commit()
+        assert list_groups("bob", get_root()["child"]) == ["group:staff"]
+
+    def test_invalidated_on_user_deleted(self, config, db_session, root, events):
+        import transaction
+        from kotti.events import UserDeleted
+        from kotti.events import notify
+        from kotti.resources import get_root
+        from kotti.security import get_principals
+        from kotti.security import list_groups
+
+        child = self._setup(config, root)
+        assert "role:editor" in list_groups("bob", child)
+        transaction.commit()
+
+        principals = get_principals()
+        group = principals["bob"]
+        del principals["bob"]
+        notify(UserDeleted(group))
+        transaction.commit()
+        assert list_groups("bob", get_root()["child"]) == []
+
+    def test_not_invalidated_on_login(self, config, db_session, root, events):
+        import transaction
+        from datetime import datetime
+        from kotti import security
+        from kotti.security import get_principals
+        from kotti.security import list_groups_ext
+
+        child = self._setup(config, root)
+        list_groups_ext("bob", child)
+        transaction.commit()
+        assert security.group_closure_cache.data
+
+        bob = get_principals()["bob"]
+        bob.last_login_date = datetime.now()
+        db_session.flush()
+        assert security.group_closure_cache.data
+
+        bob.groups = ["group:staff", "group:other"]
+        db_session.flush()
+        assert not security.group_closure_cache.data
+
+    def test_disabled(self, config, db_session, root):
+        from kotti import security
+
+        # The caches are disabled by default
+        config.include("kotti.security")
+        assert security.principal_groups_cache is None
+        assert security.group_closure_cache is None
+
+
 class TestPrincipals:
     def get_principals(self):
         from kotti.security import get_principals
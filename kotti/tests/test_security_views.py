@@ -129,6 +129,30 @@ class TestUserDelete:
             get_principals()["group:bobsgroup"]
         assert bob.groups == []
 
+    def test_deleted_group_removed_with_bulk_statements(
+        self, events, extra_principals, root, db_session
+    ):
+        from kotti.security import get_principals
+        from kotti.views.users import user_delete
+
+        principals = get_principals()
+        principals["bob"].groups = ["group:bobsgroup", "group:franksgroup"]
+        principals["frank"].groups = ["group:bobsgroups"]
+        principals["group:franksgroup"].groups = ["group:bobsgroup"]
+        db_session.flush()
+        db_session.expunge(principals["frank"])
+        bob = principals["bob"]
+
+        request = DummyRequest()
+        request.params["name"] = "group:bobsgroup"
+        request.params["delete"] = "delete"
+        user_delete(root, request)
+
+        assert bob.groups == ["group:franksgroup"]
+        assert principals["group:franksgroup"].groups == []
+        assert principals["frank"].groups == ["group:bobsgroups"]
+        assert bob not in db_session.dirty
+
     def test_deleted_group_removed_from_localgroups(
         self, events, extra_principals, root
     ):
@@ -162,6 +186,26 @@ class TestUserDelete:
         user_delete(root, request)
         assert root["content_1"].owner is None
 
+    def test_reset_owner_of_unloaded_content(
+        self, events, extra_principals, root, db_session
+    ):
+        from kotti.resources import Content
+        from kotti.resources import get_root
+        from kotti.views.users import user_delete
+
+        root["content_1"] = Content(owner="bob")
+        root["content_2"] = Content(owner="frank")
+        db_session.flush()
+        db_session.expunge_all()
+
+        request = DummyRequest()
+        request.params["name"] = "bob"
+        request.params["delete"] = "delete"
+        user_delete(get_root(), request)
+        db_session.expire_all()
+        assert get_root()["content_1"].owner is None
+        assert get_root()["content_2"].owner == "frank"
+
 
 # noinspection PyAttributeOutsideInit
 class TestSetPassword:
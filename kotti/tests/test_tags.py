@@ -1,4 +1,5 @@
 import colander
+import transaction
 from mock import Mock
 
 from kotti.testing import DummyRequest
@@ -76,6 +77,7 @@ class TestTags:
         root["content_2"].tags = ["tag 2"]
         assert Tag.query.count() == 2
         del root["content_1"]
+        transaction.commit()
         assert Tag.query.one().title == "tag 2"
 
     def test_delete_tag_assignment_doesnt_touch_content(self, root, db_session):
@@ -97,6 +99,7 @@ class TestTags:
 
         assert Tag.query.count() == 1
         db_session.delete(TagsToContents.query.one())
+        transaction.commit()
         assert Tag.query.count() == 0
 
     def test_copy_content_copy_tags(self, root, db_session):
@@ -167,9 +170,51 @@ class TestTags:
         request = DummyRequest()
         request.POST["delete"] = "delete"
         NodeActions(root["folder_1"], request).delete_node()
+        transaction.commit()
         assert Tag.query.count() == 0
         assert TagsToContents.query.count() == 0
 
+    def test_orphaned_tags_deleted_once_per_transaction(
+        self, root, events, db_session, sql_statements
+    ):
+        from kotti.resources import Content
+        from kotti.resources import Tag
+
+        for idx in range(5):
+            root[f"content_{idx}"] = Content(tags=[f"tag {idx}", "shared"])
+            db_session.flush()
+        root["other"] = Content(tags=["shared"])
+        db_session.flush()
+
+        with sql_statements() as statements:
+            for idx in range(5):
+                db_session.delete(root[f"content_{idx}"])
+            db_session.flush()
+            assert Tag.query.count() == 6
+            transaction.commit()
+
+        assert len([s for s in statements if s.startswith("DELETE FROM tags ")]) == 1
+        assert [tag.title for tag in Tag.query] == ["shared"]
+
+    def test_sweep_orphaned_tags(self, root, db_session):
+        from kotti.events import sweep_orphaned_tags
+        from kotti.resources import Content
+        from kotti.resources import Tag
+
+        root["content"] = Content(tags=["used"])
+        db_session.add(Tag(title="orphan 1"))
+        db_session.add(Tag(title="orphan 2"))
+        db_session.flush()
+        orphan_1 = Tag.query.filter_by(title="orphan 1").one()
+        used = Tag.query.filter_by(title="used").one()
+
+        assert sweep_orphaned_tags([orphan_1.id, used.id]) == 1
+        db_session.expire_all()
+        assert sorted(tag.title for tag in Tag.query) == ["orphan 2", "used"]
+        assert sweep_orphaned_tags() == 1
+        db_session.expire_all()
+        assert [tag.title for tag in Tag.query] == ["used"]
+
     def test_get_content_items_from_tag(self, root):
         from kotti.resources import Tag, Content
 
@@ -1,4 +1,5 @@
 import pytest
+from pytest import mark
 
 
 @pytest.mark.user("admin")
@@ -23,3 +24,220 @@ def test_traversal(webtest, root):
     assert "Title 2" in resp.text
     assert "Title 3" in resp.text
     assert "Body 3" in resp.text
+
+
+class TestTraversalCache:
+    @staticmethod
+    def _setup(root, db_session):
+        from kotti.resources import Document
+        from kotti.traversal import path_cache
+
+        path_cache.clear()
+        d1 = root["d1"] = Document(title="Title 1")
+        d2 = d1["d2"] = Document(title="Title 2")
+        d2["d3"] = Document(title="Title 3")
+        db_session.flush()
+        return path_cache
+
+    def test_hit_without_sql(self, root, db_session, events, sql_statements):
+        from kotti.traversal import NodeTreeTraverser
+        from kotti.traversal import cached_node_ids
+
+        self._setup(root, db_session)
+        nodes = NodeTreeTraverser.traverse(root, ("d1", "d2", "d3"))
+        assert cached_node_ids("/d1/d2/d3/") == tuple(n.id for n in nodes)
+
+        with sql_statements() as statements:
+            cached = NodeTreeTraverser.traverse(root, ("d1", "d2", "d3"))
+        assert cached == nodes
+        assert statements == []
+
+    def test_hit_loads_by_primary_key(self, root, db_session, events, sql_statements):
+        from kotti.traversal import NodeTreeTraverser
+
+        self._setup(root, db_session)
+        nodes = NodeTreeTraverser.traverse(root, ("d1", "d2"))
+        ids = [n.id for n in nodes]
+        db_session.expunge(nodes[0])  # cascades to the children
+
+        with sql_statements() as statements:
+            cached = NodeTreeTraverser.traverse(root, ("d1", "d2"))
+        assert [n.id for n in cached] == ids
+        # the nodes and their local groups (see Node.local_groups)
+        assert len(statements) == 2
+        assert "nodes.path" not in statements[0].split("WHERE")[1]
+        assert "FROM local_groups" in statements[1]
+
+    def test_partial_match(self, root, db_session, events):
+        from kotti.traversal import NodeTreeTraverser
+        from kotti.traversal import cached_node_ids
+
+        self._setup(root, db_session)
+        nodes = NodeTreeTraverser.traverse(root, ("d1", "edit"))
+        assert [n.name for n in nodes] == ["d1"]
+        assert cached_node_ids("/d1/edit/") is None
+
+    def test_partial_match_not_stale(self, root, db_session, events):
+        from kotti import traversal
+        from kotti.resources import Document
+        from kotti.traversal import NodeTreeTraverser
+
+        self._setup(root, db_session)
+        assert len(NodeTreeTraverser.traverse(root, ("d1", "x"))) == 1
+        root["d1"]["x"] = Document()
+        db_session.flush()
+        # as if added by another process, which doesn't invalidate this cache
+        traversal._invalidated.clear()
+        assert len(NodeTreeTraverser.traverse(root, ("d1", "x"))) == 2
+
+    def test_invalidated_on_add(self, root, db_session, events):
+        from kotti.resources import Document
+        from kotti.traversal import NodeTreeTraverser
+        from kotti.traversal import cached_node_ids
+
+        self._setup(root, db_session)
+        assert len(NodeTreeTraverser.traverse(root, ("d1", "edit"))) == 1
+        root["d1"]["edit"] = Document()
+        assert cached_node_ids("/d1/edit/") is None
+        assert len(NodeTreeTraverser.traverse(root, ("d1", "edit"))) == 2
+
+    def test_invalidated_on_rename(self, root, db_session, events):
+        from kotti.traversal import NodeTreeTraverser
+        from kotti.traversal import cached_node_ids
+
+        self._setup(root, db_session)
+        NodeTreeTraverser.traverse(root, ("d1", "d2", "d3"))
+        root["d1"].name = "x1"
+        db_session.flush()
+        assert cached_node_ids("/d1/d2/d3/") is None
+        assert NodeTreeTraverser.traverse(root, ("d1", "d2", "d3")) == []
+        nodes = NodeTreeTraverser.traverse(root, ("x1", "d2", "d3"))
+        assert [n.name for n in nodes] == ["x1", "d2", "d3"]
+
+    def test_invalidated_on_delete(self, root, db_session, events):
+        from kotti.traversal import NodeTreeTraverser
+        from kotti.traversal import cached_node_ids
+
+        self._setup(root, db_session)
+        NodeTreeTraverser.traverse(root, ("d1", "d2", "d3"))
+        del root["d1"]["d2"]
+        db_session.flush()
+        assert cached_node_ids("/d1/d2/d3/") is None
+        nodes = NodeTreeTraverser.traverse(root, ("d1", "d2", "d3"))
+        assert [n.name for n in nodes] == ["d1"]
+
+    def test_stale_entry(self, root, db_session, events):
+        from kotti.traversal import NodeTreeTraverser
+        from kotti.traversal import _next_generation
+        from kotti.traversal import cached_node_ids
+
+        path_cache = self._setup(root, db_session)
+        d1 = root["d1"]
+        path_cache.put("/d1/d2/", (_next_generation(), (d1.id, d1["d2"]["d3"].id)))
+        nodes = NodeTreeTraverser.traverse(root, ("d1", "d2"))
+        assert [n.name for n in nodes] == ["d1", "d2"]
+        assert cached_node_ids("/d1/d2/") == (d1.id, d1["d2"].id)
+
+    def test_invalidations_bounded(self, root, db_session, events, monkeypatch):
+        from repoze.lru import ExpiringLRUCache
+
+        from kotti import traversal
+        from kotti.traversal import NodeTreeTraverser
+        from kotti.traversal import cached_node_ids
+        from kotti.traversal import invalidate_path_cache
+
+        self._setup(root, db_session)
+        monkeypatch.setattr(traversal, "path_cache", ExpiringLRUCache(2))
+        monkeypatch.setattr(traversal, "_invalidated", {})
+        NodeTreeTraverser.traverse(root, ("d1", "d2"))
+        invalidate_path_cache("/x/")
+        invalidate_path_cache("/y/")
+        assert cached_node_ids("/d1/d2/") is not None
+        # Too many records, all entries are invalidated instead
+        invalidate_path_cache("/z/")
+        assert traversal._invalidated == {}
+        assert cached_node_ids("/d1/d2/") is None
+
+
+class TestTreeEngines:
+    @staticmethod
+    def _setup(root):
+        from kotti.resources import Document
+
+        a = root["a"] = Document()
+        b = a["b"] = Document()
+        c = b["c"] = Document()
+        a["b2"] = Document()
+        root["a_b"] = Document()
+        root["axb"] = Document()
+        return a, b, c
+
+    @mark.parametrize("engine", ["path", "cte"])
+    def test_traverse(self, root, db_session, events, engine):
+        from kotti.traversal import tree_engines
+
+        a, b, c = self._setup(root)
+        db_session.flush()
+        engine = tree_engines[engine]
+        assert engine.traverse(root, ("a", "b", "c")) == [a, b, c]
+        assert engine.traverse(root, ("a", "b", "edit")) == [a, b]
+        assert engine.traverse(root, ("a", "c")) == [a]
+        assert engine.traverse(root, ("x", "b")) == []
+        assert engine.traverse(b, ("c",)) == [c]
+
+    @mark.parametrize("engine", ["path", "cte"])
+    def test_lineage(self, root, db_session, events, engine):
+        from kotti.traversal import tree_engines
+
+        a, b, c = self._setup(root)
+        db_session.flush()
+        engine = tree_engines[engine]
+        assert engine.lineage(c) == [c, b, a, root]
+        assert engine.lineage(root) == [root]
+
+    @mark.parametrize("engine", ["path", "cte"])
+    def test_descendants(self, root, db_session, events, engine):
+        from kotti.traversal import tree_engines
+
+        a, b, c = self._setup(root)
+        db_session.flush()
+        engine = tree_engines[engine]
+        assert {n.name for n in engine.descendants(a)} == {"b", "b2", "c"}
+        assert engine.descendants(c).all() == []
+        root["a_b"]["x"] = b.__class__()
+        db_session.flush()
+        assert {n.name for n in engine.descendants(root["a_b"])} == {"x"}
+
+    @mark.parametrize("engine", ["path", "cte"])
+    def test_in_subtree(self, root, db_session, events, engine):
+        from kotti.resources import Node
+        from kotti.traversal import tree_engines
+
+        a, b, c = self._setup(root)
+        db_session.flush()
+        engine = tree_engines[engine]
+        query = db_session.query(Node.name)
+        names = {name for (name,) in query.filter(engine.in_subtree(Node.id, b))}
+        assert names == {"b", "c"}
+        names = {name for (name,) in query.filter(engine.in_subtree(Node.id, c))}
+        assert names == {"c"}
+
+    def test_unknown_tree_engine(self, config):
+        from kotti.traversal import includeme
+
+        config.get_settings()["kotti.tree_engine"] = "ctee"
+        with pytest.raises(ValueError):
+            includeme(config)
+
+    def test_tree_engine_setting(self, root, db_session, monkeypatch):
+        from kotti import get_settings
+        from kotti.traversal import CTETreeEngine
+        from kotti.traversal import PathTreeEngine
+        from kotti.traversal import tree_engine
+
+        assert tree_engine() is PathTreeEngine
+        monkeypatch.setitem(get_settings(), "kotti.tree_engine", "cte")
+        # Only used on PostgreSQL by default
+        assert tree_engine() is PathTreeEngine
+        monkeypatch.setattr(CTETreeEngine, "dialects", ("sqlite",))
+        assert tree_engine() is CTETreeEngine
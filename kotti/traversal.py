@@ -30,8 +30,26 @@ request.path          Pyramid traverser (rps) Kotti traverser (rps)
 /a/b/c/d/e/f/g/h/i/j/ 8                       29
 ===================== ======================= =====================
 
+The queries for traversal, lineage and subtree enumeration are delegated to a
+*tree engine*, which is selected with the ``kotti.tree_engine`` setting:
+
+``path`` (default)
+    :class:`PathTreeEngine` uses the materialized ``Node.path`` column and
+    works on all databases.
+
+``cte``
+    :class:`CTETreeEngine` uses recursive common table expressions on
+    ``Node.parent_id`` instead.  It is used on PostgreSQL only, all other
+    databases fall back to :class:`PathTreeEngine`.  Run
+    ``py.test --runslow -k benchmark kotti/tests/test_benchmarks.py`` with
+    ``KOTTI_TEST_DB_STRING`` pointing to your database to compare the engines
+    on deep and wide trees.
+
 """
 
+import threading
+from itertools import count
+
 from pyramid.compat import decode_path_info
 from pyramid.compat import is_nonstr_iter
 from pyramid.exceptions import URLDecodeError
@@ -41,11 +59,115 @@ from pyramid.traversal import ResourceTreeTraverser
 from pyramid.traversal import empty
 from pyramid.traversal import slash
 from pyramid.traversal import split_path_info
+from repoze.lru import ExpiringLRUCache
+from sqlalchemy import event
+from sqlalchemy import and_
+from sqlalchemy import case
+from sqlalchemy import inspect
+from sqlalchemy import literal_column
 from sqlalchemy import or_
+from sqlalchemy import select
 from zope.interface import implementer
 
 from kotti import DBSession
+from kotti import get_settings
+from kotti.resources import Content
 from kotti.resources import Node
+from kotti.resources import hash_path
+
+#: Process wide cache that maps virtual paths (e.g. ``/a/b/c/``) to the ids of
+#: the nodes found by :meth:`NodeTreeTraverser.traverse` for that path, if a
+#: node was found for each of the path's segments.  It is
+#: configured by :func:`includeme` from the ``kotti.traversal_cache_size`` and
+#: ``kotti.traversal_cache_timeout`` settings and is ``None`` if disabled.
+#: Use :func:`cached_node_ids` to look up paths.
+path_cache = ExpiringLRUCache(1000, default_timeout=60)
+
+_INVALIDATED_PATHS_KEY = "kotti.traversal.invalidated_paths"
+
+# Cache entries are stored with the generation in which they were added.
+# Invalidating a path records a new generation for it, entries for the path
+# and the paths below it that are older than that are ignored.  Once more
+# paths than the cache can hold were invalidated, the records are replaced
+# by a single generation that all older entries are ignored for.
+_lock = threading.Lock()
+_generations = count(1)
+_invalidated = {}
+_invalidated_all = 0
+
+
+def cached_node_ids(path):
+    """Return the ids of the nodes that were found for ``path`` by
+    :meth:`NodeTreeTraverser.traverse` from the traversal cache, or ``None``
+    if the path isn't cached or was invalidated since.
+
+    :param path: Virtual path, e.g. ``/a/b/c/``
+    :type path: str
+
+    :result: Ids of the nodes, from root (excluded) to context (included)
+    :rtype: tuple or None
+    """
+
+    if path_cache is None:
+        return None
+    entry = path_cache.get(path)
+    if entry is None:
+        return None
+    generation, ids = entry
+    prefix = ""
+    with _lock:
+        stale = generation <= _invalidated_all
+        for segment in path.split("/")[:-1]:
+            prefix += segment + "/"
+            if stale or _invalidated.get(prefix, 0) >= generation:
+                stale = True
+                break
+    if stale:
+        path_cache.invalidate(path)
+        return None
+    return ids
+
+
+def _next_generation():
+    with _lock:
+        return next(_generations)
+
+
+def invalidate_path_cache(path):
+    """Remove all entries for ``path`` and any path below it from the
+    traversal cache.  The paths are invalidated once more when the current
+    transaction ends, as concurrent requests may have cached them again
+    before the changes were committed.
+
+    :param path: The (old or new) ``path`` of a node that was added, moved,
+                 renamed or deleted.
+    :type path: str
+    """
+
+    if path_cache is None or not path:
+        return
+    DBSession().info.setdefault(_INVALIDATED_PATHS_KEY, set()).add(path)
+    _invalidate(path)
+
+
+def _invalidate(path):
+    global _invalidated_all
+
+    generation = _next_generation()
+    with _lock:
+        if len(_invalidated) < path_cache.size:
+            _invalidated[path] = generation
+        else:
+            _invalidated.clear()
+            _invalidated_all = generation
+
+
+# noinspection PyUnusedLocal
+def _after_transaction(session, *args):
+    paths = session.info.pop(_INVALIDATED_PATHS_KEY, ())
+    if path_cache is not None:
+        for path in paths:
+            _invalidate(path)
 
 
 @implementer(ITraverser)
@@ -166,18 +288,28 @@ class NodeTreeTraverser(ResourceTreeTraverser):
         :rtype: list of :class:`kotti.resources.Node`
         """
 
-        conditions = [
-            (Node.path == root.path + "/".join(vpath_tuple[: idx + 1]) + "/")
+        paths = [
+            root.path + "/".join(vpath_tuple[: idx + 1]) + "/"
             for idx, item in enumerate(vpath_tuple)
         ]
-        nodes = (
-            DBSession()
-            .query(Node)
-            .with_polymorphic(Node)
-            .order_by(Node.path)
-            .filter(or_(*conditions))
-            .all()
-        )
+        nodes = None
+        ids = cached_node_ids(paths[-1])
+        if ids is not None:
+            nodes = NodeTreeTraverser._nodes_by_id(ids, paths)
+            if nodes is None:
+                path_cache.invalidate(paths[-1])
+        if nodes is None:
+            # Taken before the query, so that the entry is ignored if the
+            # path is invalidated in the meantime
+            generation = _next_generation()
+            nodes = tree_engine().traverse(root, vpath_tuple)
+            # Partial results are not cached: their last segments (view names
+            # or missing nodes) may be added by other processes, which only
+            # invalidate their own caches.  Cached nodes are validated by
+            # their paths (see _nodes_by_id) instead.
+            if path_cache is not None and len(nodes) == len(vpath_tuple):
+                ids = tuple(node.id for node in nodes)
+                path_cache.put(paths[-1], (generation, ids))
         for i, node in enumerate(nodes):
             if i == 0:
                 setattr(node, "parent", root)
@@ -187,58 +319,250 @@ class NodeTreeTraverser(ResourceTreeTraverser):
         return nodes
 
     @staticmethod
-    def _traverse_cte(root, vpath_tuple):  # pragma: no cover
-        """Version of the traverse method, that uses a CTE instead of the
-        Node.path attribute.  Unfortunately this is **much** slower and works
-        only on PostgreSQL.
-
-        It **does** work, but is not used ATM.  Could be very useful to replace
-        :func:`kotti.events._set_path_for_new_parent` and
-        :func:`kotti.events._set_path_for_new_name` event handlers to handle
-        everything on the database with a single call, instead of the expensive
-        recursion maassacre we have right now.
-        """
+    def _nodes_by_id(ids, paths):
+        """Load the nodes for a cached traversal result.  Nodes that are
+        already in the session's identity map are used directly, all others
+        are fetched with a single primary key query.
+
+        :param ids: Ids of the nodes, from root (excluded) to context
+        :type ids: tuple
 
-        raise NotImplementedError("Use the traverse method instead.")
+        :param paths: Expected paths of the nodes for each traversed segment
+        :type paths: list
 
+        :return: List of nodes or ``None`` if the cached ids are stale, i.e.
+                 one of the nodes no longer exists or has a different path.
+        :rtype: list of :class:`kotti.resources.Node` or None
         """
-        # needed until we find out how to pass an empty array of type String
-        # (i.e. 'VARCHAR[]') to the initial cte.
-
-        vpath = ('', ) + vpath_tuple
-
-        cte = DBSession.query(
-                Node.id,
-                # array([concat('', Node.name)]).label('path')) \
-                concat('', Node.name).label('path')) \
-            .enable_eagerloads(False) \
-            .filter(Node.parent_id == None) \
-            .cte(name="n1", recursive=True)
-        parent = aliased(cte, name='parent')
-        child = aliased(Node, name='child')
-        inner = DBSession.query(
-                child.id,
-                # (parent.c.path + array([concat('', child.name)])).label('path')) \
-                concat(parent.c.path, '/', child.name).label('path')) \
-            .enable_eagerloads(False) \
-            .filter(child.parent_id == parent.c.id)
-        cte = cte.union_all(inner)
-        conditions = [
-            # (cte.c.path == array(vpath[:idx + 1]))
-            (cte.c.path == '/'.join(vpath[:idx + 1]))
-            for idx, item in enumerate(vpath)]
-        ids = DBSession.query(Node.id.label('node_id')) \
-            .select_entity_from(cte) \
-            .filter(or_(*conditions))
-        nodes = DBSession.query(Node).filter(Node.id.in_(ids)).order_by(Node.path).offset(1).all()
-        for i, node in enumerate(nodes):
-            if i == 0:
-                setattr(node, 'parent', root)
+
+        session = DBSession()
+        mapper = inspect(Node)
+        found = {}
+        missing = []
+        for id_ in ids:
+            key = mapper.identity_key_from_primary_key((id_,))
+            node = session.identity_map.get(key)
+            if node is None:
+                missing.append(id_)
             else:
-                setattr(node, 'parent', nodes[i-1])
+                found[id_] = node
+        if missing:
+            for node in (
+                session.query(Node)
+                .with_polymorphic([Content])
+                .filter(Node.id.in_(missing))
+            ):
+                found[node.id] = node
+        nodes = [found.get(id_) for id_ in ids]
+        if None in nodes or any(
+            node.path != path for node, path in zip(nodes, paths)
+        ):
+            return None
         return nodes
+
+
+class PathTreeEngine:
+    """Tree engine that uses the materialized :attr:`kotti.resources.Node.path`
+    (and its hash) to find nodes.  It works on all databases and is used
+    unless the ``kotti.tree_engine`` setting selects another engine.
+    """
+
+    name = "path"
+
+    @staticmethod
+    def traverse(root, vpath_tuple):
+        """
+        :param root: The node where traversal should start
+        :type root: :class:`kotti.resources.Node`
+
+        :param vpath_tuple: Tuple of path segments to be traversed
+        :type vpath_tuple: tuple
+
+        :return: List of nodes, from root (excluded) to context (included).
+        :rtype: list of :class:`kotti.resources.Node`
+        """
+
+        paths = [
+            root.path + "/".join(vpath_tuple[: idx + 1]) + "/"
+            for idx, item in enumerate(vpath_tuple)
+        ]
+        return (
+            DBSession()
+            .query(Node)
+            .with_polymorphic([Content])
+            .order_by(Node.path)
+            .filter(Node.path_hash.in_([hash_path(path) for path in paths]))
+            .filter(Node.path.in_(paths))
+            .all()
+        )
+
+    @staticmethod
+    def lineage(node):
+        """
+        :param node: The node whose lineage should be returned
+        :type node: :class:`kotti.resources.Node`
+
+        :return: List of nodes, from ``node`` (included) to the root, i.e. in
+                 the same order as :func:`pyramid.location.lineage`.
+        :rtype: list of :class:`kotti.resources.Node`
+        """
+
+        segments = node.path.split("/")[1:-1]
+        paths = ["/"] + [
+            "/" + "/".join(segments[: idx + 1]) + "/"
+            for idx, item in enumerate(segments)
+        ]
+        return (
+            DBSession()
+            .query(Node)
+            .with_polymorphic([Content])
+            .order_by(Node.path.desc())
+            .filter(Node.path_hash.in_([hash_path(path) for path in paths]))
+            .filter(Node.path.in_(paths))
+            .all()
+        )
+
+    @staticmethod
+    def descendant_ids(node):
+        """
+        :param node: The node whose descendants should be selected
+        :type node: :class:`kotti.resources.Node`
+
+        :return: Selectable with the ids of all descendants of ``node``
+                 (``node`` excluded) in a single column named ``id``.
+        :rtype: :class:`sqlalchemy.sql.expression.Select`
+        """
+
+        return select([Node.id]).where(
+            and_(Node.path.startswith(node.path, autoescape=True), Node.id != node.id)
+        )
+
+    @classmethod
+    def in_subtree(cls, column, node):
+        """
+        :param column: Column with node ids, e.g. ``Node.id``
+        :type column: :class:`sqlalchemy.schema.Column`
+
+        :param node: The root of the subtree
+        :type node: :class:`kotti.resources.Node`
+
+        :return: Condition that ``column`` is the id of ``node`` or of one of
+                 its descendants.
+        :rtype: :class:`sqlalchemy.sql.expression.ColumnElement`
         """
 
+        return or_(column == node.id, column.in_(cls.descendant_ids(node)))
+
+    @classmethod
+    def descendants(cls, node):
+        """
+        :param node: The node whose descendants should be queried
+        :type node: :class:`kotti.resources.Node`
+
+        :return: Query for all descendants of ``node`` (``node`` excluded)
+        :rtype: :class:`sqlalchemy.orm.query.Query`
+        """
+
+        return DBSession.query(Node).filter(Node.id.in_(cls.descendant_ids(node)))
+
+
+class CTETreeEngine(PathTreeEngine):
+    """Tree engine that walks ``parent_id`` relations with recursive common
+    table expressions and therefore doesn't depend on
+    :attr:`kotti.resources.Node.path` at all.  It's only selected on the
+    databases listed in :attr:`dialects`.
+    """
+
+    name = "cte"
+    dialects = ("postgresql",)
+
+    @staticmethod
+    def traverse(root, vpath_tuple):
+        if not vpath_tuple:
+            return []
+        nodes = Node.__table__
+        child = nodes.alias("child")
+        cte = (
+            select([nodes.c.id, literal_column("1").label("depth")])
+            .where(and_(nodes.c.parent_id == root.id, nodes.c.name == vpath_tuple[0]))
+            .cte("traversed", recursive=True)
+        )
+        names = {idx + 1: name for idx, name in enumerate(vpath_tuple)}
+        cte = cte.union_all(
+            select([child.c.id, (cte.c.depth + 1).label("depth")]).where(
+                and_(
+                    child.c.parent_id == cte.c.id,
+                    cte.c.depth < len(vpath_tuple),
+                    child.c.name == case(names, value=cte.c.depth + 1),
+                )
+            )
+        )
+        return (
+            DBSession()
+            .query(Node)
+            .with_polymorphic([Content])
+            .join(cte, Node.id == cte.c.id)
+            .order_by(cte.c.depth)
+            .all()
+        )
+
+    @staticmethod
+    def lineage(node):
+        nodes = Node.__table__
+        parent = nodes.alias("parent")
+        cte = (
+            select([nodes.c.id, nodes.c.parent_id, literal_column("0").label("depth")])
+            .where(nodes.c.id == node.id)
+            .cte("lineage", recursive=True)
+        )
+        cte = cte.union_all(
+            select(
+                [parent.c.id, parent.c.parent_id, (cte.c.depth + 1).label("depth")]
+            ).where(parent.c.id == cte.c.parent_id)
+        )
+        return (
+            DBSession()
+            .query(Node)
+            .with_polymorphic([Content])
+            .join(cte, Node.id == cte.c.id)
+            .order_by(cte.c.depth)
+            .all()
+        )
+
+    @staticmethod
+    def descendant_ids(node):
+        nodes = Node.__table__
+        child = nodes.alias("child")
+        cte = (
+            select([nodes.c.id])
+            .where(nodes.c.parent_id == node.id)
+            .cte("descendants", recursive=True)
+        )
+        cte = cte.union_all(
+            select([child.c.id]).where(child.c.parent_id == cte.c.id)
+        )
+        return select([cte.c.id])
+
+
+#: Tree engines that can be selected with the ``kotti.tree_engine`` setting
+tree_engines = {engine.name: engine for engine in (PathTreeEngine, CTETreeEngine)}
+
+
+def tree_engine():
+    """Return the tree engine selected by the ``kotti.tree_engine`` setting.
+    Engines that don't support the current database fall back to
+    :class:`PathTreeEngine`.
+
+    :result: Tree engine
+    :rtype: :class:`PathTreeEngine` or :class:`CTETreeEngine`
+    """
+
+    engine = tree_engines[get_settings()["kotti.tree_engine"]]
+    dialects = getattr(engine, "dialects", None)
+    if dialects is not None and DBSession.get_bind().dialect.name not in dialects:
+        return PathTreeEngine
+    return engine
+
 
 def includeme(config):
     """Pyramid includeme hook.
@@ -247,4 +571,21 @@ def includeme(config):
     :type config: :class:`pyramid.config.Configurator`
     """
 
+    global path_cache
+
+    settings = config.get_settings()
+    if settings["kotti.tree_engine"] not in tree_engines:
+        raise ValueError(f"Unknown tree engine: {settings['kotti.tree_engine']!r}")
+    size = int(settings["kotti.traversal_cache_size"])
+    if size > 0:
+        path_cache = ExpiringLRUCache(
+            size, default_timeout=int(settings["kotti.traversal_cache_timeout"])
+        )
+    else:
+        path_cache = None
+
+    for name in ("after_commit", "after_rollback"):
+        if not event.contains(DBSession, name, _after_transaction):
+            event.listen(DBSession, name, _after_transaction)
+
     config.add_traverser(NodeTreeTraverser, Node)
@@ -2,6 +2,7 @@
 Action views
 """
 from pyramid.exceptions import Forbidden
+from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.httpexceptions import HTTPFound
 from pyramid.url import resource_url
 from pyramid.view import view_config
@@ -12,6 +13,7 @@ from kotti import get_settings
 from kotti.fanstatic import contents_view_js
 from kotti.interfaces import IContent
 from kotti.resources import Node
+from kotti.resources import copy_subtree
 from kotti.util import ActionButton
 from kotti.util import _
 from kotti.util import get_paste_items
@@ -132,13 +134,11 @@ class NodeActions:
                     if count is len(ids) - 1:
                         del self.request.session["kotti.paste"]
                 elif action == "copy":
-                    copy = item.copy()
-                    name = copy.name
+                    name = item.name
                     if not name:  # for root
-                        name = copy.title
+                        name = item.title
                     name = title_to_name(name, blacklist=self.context.keys())
-                    copy.name = name
-                    self.context[name] = copy
+                    copy_subtree(item, self.context, name)
                 self.flash(
                     _("${title} was pasted.", mapping=dict(title=item.title)), "success"
                 )
@@ -496,6 +496,74 @@ def contents(context, request):
     return {"children": context.children_with_permission(request), "buttons": buttons}
 
 
+@view_config(
+    context=IContent,
+    name="contents",
+    permission="view",
+    request_param="format=json",
+    renderer="json",
+)
+def contents_json(context, request):
+    """ Paginated JSON version of the contents view.
+
+    Accepts the optional request parameters ``after`` (the ``next`` value of
+    the previous page), ``limit`` (page size, at most
+    ``kotti.contents_max_page_size``) and ``sort`` (``position`` or
+    ``-position``).
+
+    :result: JSON serializable object with the children of the page
+             (``items``) and the value for ``after`` to fetch the next page
+             (``next``), which is ``None`` on the last page.
+    :rtype: dict
+    """
+
+    max_limit = int(get_settings()["kotti.contents_max_page_size"])
+    try:
+        after = request.params.get("after")
+        if after not in (None, ""):
+            position, id = after.split(",")
+            after = (int(position), int(id))
+        else:
+            after = None
+        limit = int(request.params.get("limit", max_limit))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        raise HTTPBadRequest()
+    sort = request.params.get("sort", "position")
+    if sort not in ("position", "-position"):
+        raise HTTPBadRequest()
+
+    limit = min(limit, max_limit)
+    children = context.children_page(
+        after=after,
+        limit=limit,
+        permission="view",
+        sort=sort,
+        request=request,
+    )
+    items = [
+        {
+            "id": child.id,
+            "name": child.name,
+            "title": child.title,
+            "type": child.type_info.name,
+            "state": getattr(child, "state", None),
+            "position": child.position,
+            "in_navigation": child.in_navigation,
+            "creation_date": child.creation_date and child.creation_date.isoformat(),
+            "modification_date": child.modification_date
+            and child.modification_date.isoformat(),
+            "url": resource_url(child, request),
+        }
+        for child in children
+    ]
+    next_after = None
+    if len(children) == limit:
+        next_after = f"{children[-1].position},{children[-1].id}"
+    return {"items": items, "next": next_after}
+
+
 @view_config(
     name="move-child-position",
     permission="edit",
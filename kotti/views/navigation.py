@@ -30,11 +30,9 @@ def render_tree_navigation(context, request):
 )
 def local_navigation(context, request):
     def ch(node):
-        return [
-            child
-            for child in node.values()
-            if child.in_navigation and request.has_permission("view", child)
-        ]
+        return request.filter_permitted(
+            [child for child in node.values() if child.in_navigation], "view"
+        )
 
     parent = context
     children = ch(context)
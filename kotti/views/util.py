@@ -21,6 +21,7 @@ from sqlalchemy import or_
 
 from kotti import DBSession
 from kotti import get_settings
+from kotti.acl_index import view_filter
 from kotti.events import objectevent_listeners
 from kotti.interfaces import INavigationRoot
 from kotti.resources import Content
@@ -292,11 +293,10 @@ class TemplateAPI:
                 return context.children
             return context.children_with_permission(self.request, permission)
 
-        return [
-            c
-            for c in getattr(context, "values", lambda: [])()
-            if (not permission or self.request.has_permission(permission, c))
-        ]
+        children = getattr(context, "values", lambda: [])()
+        if not permission:
+            return list(children)
+        return self.request.filter_permitted(children, permission)
 
     inside = staticmethod(inside)
 
@@ -404,8 +404,9 @@ class NodesTree:
                 self._item_to_children,
                 self._permission,
             )
-            for child in self._item_to_children[self.id]
-            if self._request.has_permission(self._permission, child)
+            for child in self._request.filter_permitted(
+                self._item_to_children[self.id], self._permission
+            )
         ]
 
     def _flatten(self, item):
@@ -424,9 +425,15 @@ class NodesTree:
 def nodes_tree(request, context=None, permission="view"):
     item_mapping = {}
     item_to_children = defaultdict(lambda: [])
-    for node in DBSession.query(Content).with_polymorphic(Content):
+    nodes = DBSession.query(Content).with_polymorphic(Content).all()
+    condition = view_filter(request, permission)
+    if condition is not None:
+        permitted = {id for (id,) in DBSession.query(Node.id).filter(condition)}
+    else:
+        permitted = {node.id for node in request.filter_permitted(nodes, permission)}
+    for node in nodes:
         item_mapping[node.id] = node
-        if request.has_permission(permission, node):
+        if node.id in permitted:
             item_to_children[node.parent_id].append(node)
 
     for children in item_to_children.values():
@@ -456,11 +463,11 @@ def default_search_content(search_term, request=None):
         Content.description.like(searchstring),
     )
 
-    results = (
+    results = _viewable(
         DBSession.query(Content)
         .filter(generic_filter)
-        .order_by(Content.title.asc())
-        .all()
+        .order_by(Content.title.asc()),
+        request,
     )
 
     # specific result contain objects matching additional criteria
@@ -470,50 +477,65 @@ def default_search_content(search_term, request=None):
         and_(Document.body.like(searchstring), not_(generic_filter))
     )
 
-    for results_set in [content_with_tags([searchstring]), document_results.all()]:
+    for results_set in [
+        _viewable(_content_with_tags_query([searchstring]), request),
+        _viewable(document_results, request),
+    ]:
         [results.append(c) for c in results_set if c not in results]
 
     result_dicts = []
 
     for result in results:
-        if request.has_permission("view", result):
-            result_dicts.append(
-                dict(
-                    name=result.name,
-                    title=result.title,
-                    description=result.description,
-                    path=request.resource_path(result),
-                )
+        result_dicts.append(
+            dict(
+                name=result.name,
+                title=result.title,
+                description=result.description,
+                path=request.resource_path(result),
             )
+        )
 
     return result_dicts
 
 
-def content_with_tags(tag_terms):
+def _viewable(query, request):
+    """ Return the results of ``query`` that the user may view, filtered in
+    SQL if the ACL index is enabled. """
+
+    condition = view_filter(request)
+    if condition is not None:
+        return query.filter(condition).all()
+    return [result for result in query if request.has_permission("view", result)]
+
+
+def _content_with_tags_query(tag_terms):
 
     return (
         DBSession.query(Content)
         .join(TagsToContents)
         .join(Tag)
         .filter(or_(*[Tag.title.like(tag_term) for tag_term in tag_terms]))
-        .all()
     )
 
 
+def content_with_tags(tag_terms):
+
+    return _content_with_tags_query(tag_terms).all()
+
+
 def search_content_for_tags(tags, request=None):
 
     result_dicts = []
 
-    for result in content_with_tags(tags):
-        if request.has_permission("view", result):
-            result_dicts.append(
-                dict(
-                    name=result.name,
-                    title=result.title,
-                    description=result.description,
-                    path=request.resource_path(result),
-                )
+    for result in _viewable(_content_with_tags_query(tags), request):
+        result_dicts.append(
+            dict(
+                name=result.name,
+                title=result.title,
+                description=result.description,
+                path=request.resource_path(result),
             )
+        )
 
     return result_dicts
 
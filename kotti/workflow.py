@@ -38,20 +38,34 @@ def initialize_workflow(event):
         wf.initialize(event.object)
 
 
-def workflow_callback(context, info):
-    wf = info.workflow
-    to_state = info.transition.get("to_state")
-
-    if to_state is None:
-        if context.state:
-            to_state = context.state
-        else:
-            to_state = wf.initial_state
-
-    state_data = wf._state_data[to_state].copy()
+def _initialize_workflow_batch(event):
+    """Batch implementation of :func:`initialize_workflow`.  If the initial
+    state's callback is :func:`workflow_callback`, the ACL is computed only
+    once per workflow and state. """
+
+    acls = {}
+    for obj in event.objects:
+        wf = get_workflow(obj)
+        if wf is None:
+            continue
+        if wf._state_data[wf.initial_state]["callback"] is not workflow_callback:
+            wf.initialize(obj)
+            continue
+        to_state = obj.state or wf.initial_state
+        key = (id(wf), to_state)
+        if key not in acls:
+            acls[key] = _state_acl(wf, to_state)
+        obj.__acl__ = list(acls[key])
+        setattr(obj, wf.state_attr, wf.initial_state)
+
+
+initialize_workflow.batch = _initialize_workflow_batch
+
+
+def _state_acl(wf, state):
+    state_data = wf._state_data[state].copy()
     acl = []
 
-    # This could definitely be cached...
     special_roles = ("system.Everyone", "system.Authenticated")
     for key, value in state_data.items():
         if key.startswith("role:") or key in special_roles:
@@ -61,7 +75,20 @@ def workflow_callback(context, info):
     if state_data.get("inherit", "0").lower() not in TRUE_VALUES:
         acl.append(DENY_ALL)
 
-    context.__acl__ = acl
+    return acl
+
+
+def workflow_callback(context, info):
+    wf = info.workflow
+    to_state = info.transition.get("to_state")
+
+    if to_state is None:
+        if context.state:
+            to_state = context.state
+        else:
+            to_state = wf.initial_state
+
+    context.__acl__ = _state_acl(wf, to_state)
 
     if info.transition:
         notify(WorkflowTransition(context, info))
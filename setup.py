@@ -52,7 +52,7 @@ install_requires = [
     'repoze.lru',
     'repoze.workflow>=1.0b1',
     'repoze.zcml>=1.0b1',
-    'sqlalchemy>=1.4.16',
+    'sqlalchemy>=1.4.16,<2',  # Mapper._set_with_polymorphic, see resources
     'sqlalchemy-utils>=0.37.6',
     'transaction>=1.1.0',
     'unidecode',
@@ -180,6 +180,9 @@ classifiers=[
               'kotti-migrate = kotti.migrate:kotti_migrate_command',
               'kotti-reset-workflow = kotti.workflow:reset_workflow_command',
               'kotti-migrate-storage = kotti.filedepot:migrate_storages_command',  # noqa
+              'kotti-depot-gc = kotti.filedepot:sweep_orphaned_files_command',  # noqa
+              'kotti-rebuild-acl-index = kotti.acl_index:rebuild_acl_index_command',  # noqa
+              'kotti-delete-orphaned-tags = kotti.events:delete_orphaned_tags_command',  # noqa
           ],
           'pytest11': [
               'kotti = kotti.tests',